@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import apiClient from "@/utils/appClient";
 import {
   Dialog,
@@ -53,6 +53,8 @@ const AITools2 = ({ canvas, imageUrl, imageRef, setLoadSate }: Props) => {
   const [showImageAddButton, setShowImageAddButton] = useState(false);
   const [styleImages, setStyleImages] = useState<StyleTemplate[] | []>([]);
   const [stylizeRatio, setStylizeRatio] = useState(1.0);
+  // hash the server returned for the last stylized canvas image, an unchanged image is sent as the hash only
+  const contentHashRef = useRef<{ image: string; hash: string } | null>(null);
   const currentFilters = useCommonProps((state) => state.currentFilters);
   const resetFilters = useAdjustStore((state) => state.resetFilters);
   const {
@@ -118,7 +120,10 @@ const AITools2 = ({ canvas, imageUrl, imageRef, setLoadSate }: Props) => {
     }
   };
 
-  const handleStyleTransfer = async (predefinedImageUrl: string = "") => {
+  const handleStyleTransfer = async (
+    predefinedImageUrl: string = "",
+    styleId: string = ""
+  ) => {
     setLoadSate(true);
     removeTempStylizeImage();
 
@@ -128,8 +133,6 @@ const AITools2 = ({ canvas, imageUrl, imageRef, setLoadSate }: Props) => {
       });
 
     try {
-      const formData = new FormData();
-
       const canvasImageBase64 = getCanvasDataUrl(
         canvas,
         imageRef.current,
@@ -141,30 +144,69 @@ const AITools2 = ({ canvas, imageUrl, imageRef, setLoadSate }: Props) => {
       //   originalImageBase64 = await urlToBase64(originalImageBase64);
       // }
 
-      const originalImageFile = base64ToFile(canvasImageBase64, "image");
-
-      if (predefinedImageUrl.length > 0) {
-        const styleImageFile = await urlToFile(predefinedImageUrl);
-        formData.append("styleImage", styleImageFile);
-      } else {
-        const styleImageFile = await urlToFile(uploadedImage);
-        formData.append("styleImage", styleImageFile);
+      let styleImageFile = null;
+      if (styleId.length === 0) {
+        styleImageFile = await urlToFile(
+          predefinedImageUrl.length > 0 ? predefinedImageUrl : uploadedImage
+        );
       }
 
-      formData.append("originalImage", originalImageFile);
-      formData.append("alpha", stylizeRatio.toString());
+      const postStyleTransfer = (contentHash: string | null) => {
+        const formData = new FormData();
+
+        if (styleId.length > 0) {
+          // curated styles are precomputed on the server, only the id is needed
+          formData.append("style_id", styleId);
+        } else {
+          formData.append("styleImage", styleImageFile);
+        }
+
+        if (contentHash) {
+          // the server still has the encoded content image, only the style or the alpha changed
+          formData.append("content_hash", contentHash);
+        } else {
+          formData.append(
+            "originalImage",
+            base64ToFile(canvasImageBase64, "image")
+          );
+        }
+        formData.append("alpha", stylizeRatio.toString());
 
-      console.log([...formData]);
+        console.log([...formData]);
 
-      const response = await apiClient.post(
-        "/image_proc/style_transfer",
-        formData,
-        {
+        return apiClient.post("/image_proc/style_transfer", formData, {
           headers: {
             Authorization: `Bearer ${user?.token}`,
           },
-        }
-      );
+        });
+      };
+
+      const contentHash =
+        contentHashRef.current?.image === canvasImageBase64
+          ? contentHashRef.current.hash
+          : null;
+
+      let response;
+      try {
+        response = await postStyleTransfer(contentHash);
+      } catch (error) {
+        // the content image expired on the server, upload it again
+        if (
+          !contentHash ||
+          !axios.isAxiosError(error) ||
+          error.response?.status !== 404
+        )
+          throw error;
+        contentHashRef.current = null;
+        response = await postStyleTransfer(null);
+      }
+
+      if (response.status === 200 && response.data.content_hash) {
+        contentHashRef.current = {
+          image: canvasImageBase64,
+          hash: response.data.content_hash,
+        };
+      }
 
       if (response.status === 200) {
         disableSavingIntoStackRef.current = true;
@@ -447,7 +489,9 @@ const AITools2 = ({ canvas, imageUrl, imageRef, setLoadSate }: Props) => {
             <div
               key={index}
               className="relative rounded-lg overflow-hidden shadow-md cursor-pointer"
-              onClick={() => handleStyleTransfer(style.image_url)}
+              onClick={() =>
+                handleStyleTransfer(style.image_url, style.image_id)
+              }
             >
               <img
                 src={style.image_url}
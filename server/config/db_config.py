@@ -1,17 +1,18 @@
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from utils.mongo_metrics import mongo_command_listener
 
 load_dotenv()
 
 def get_db():
     if(os.getenv("DEPLOY_PRODUCTION").lower() == 'true'):
         print("launching database in production mode")
-        client = MongoClient(os.getenv("DATABASE_PRODUCTION_URL")) 
+        client = MongoClient(os.getenv("DATABASE_PRODUCTION_URL"), event_listeners=[mongo_command_listener]) 
         db = client["StyleForge"]
     else:
         print("launching database in development mode")
-        client = MongoClient(os.getenv("DATABASE_URI")) 
+        client = MongoClient(os.getenv("DATABASE_URI"), event_listeners=[mongo_command_listener]) 
         db = client["StyleForge"]
 
     return db
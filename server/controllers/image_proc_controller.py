@@ -1,20 +1,37 @@
-from flask import jsonify, request, g
+from flask import jsonify, request, g, Response, send_file, make_response
 from PIL import Image
 from bson import ObjectId
-from utils.preprocessing import get_style_transfer_transform, get_similar_image_transform, get_super_resolution_transform
+from utils.preprocessing import get_style_transfer_transform, get_similar_image_transform
+from utils.postprocessing import StageTimings, to_numpy_image
+from utils.server_timing import span, timing_metrics
+from utils.profiler import inference_profiler
+from utils.ingest import probe_image, open_image, ImageTooLargeError, ingest_metrics
 from model_config import CFG
 import torchvision.transforms.v2 as T
 import io
 import base64
+from contextlib import nullcontext
+from functools import wraps
 import torch
 from model_config import CFG
 from models.style_transfer import *
 from models.super_resolution_model import *
 from models.similarity_model import  get_embedding
-from torchvision import models
+from models.model_registry import (
+    model_registry, STYLE_TRANSFER_MODEL, SUPER_RESOLUTION_MODEL, SUPER_RESOLUTION_FAST_MODEL, SIMILARITY_MODEL,
+    get_fast_super_resolution_paths
+)
+from utils.style_batcher import StyleTransferBatcher
+from utils.style_bank import style_bank, style_stats_cache, get_style_stats
+from utils.tensor_cache import TensorCache, hash_bytes
+from utils.inference_service import inference_client
+from utils.job_queue import job_queue, JOB_DONE, JOB_FAILED
+from utils.load_tracker import InFlightCounter
+from utils.latency_budget import LatencyBudget, OverloadedError
+from utils.admission import AdmissionController, parse_tier_weights, estimate_style_transfer_memory, estimate_super_resolution_memory
+from utils.result_cache import result_cache, get_style_result_key, get_super_resolution_result_key, should_charge_quota
 from config.db_config import get_db
 import numpy as np
-import gc
 import os
 
 
@@ -29,114 +46,470 @@ SUPER_RESOULTION_PRO_COMPUTE = int(os.getenv("SUPER_RESOULTION_PRO_COMPUTE", 100
 STYLE_ULTIMATE_COMPUTE = int(os.getenv("STYLE_ULTIMATE_COMPUTE", 99999))
 SUPER_RESOULTION_ULTIMATE_COMPUTE = int(os.getenv("SUPER_RESOULTION_ULTIMATE_COMPUTE", 99999))
 
+SUPER_RESOLUTION_JOB = "super_res"
+STYLE_TRANSFER_JOB = "style_transfer"
 
+IMAGE_MIMETYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
 
 
+def get_encoder_options(format):
+    if format == "webp":
+        return {"quality": CFG.image_webp_quality, "lossless": CFG.image_webp_lossless}
+    if format == "jpeg":
+        return {"quality": CFG.image_jpeg_quality}
+    return {"compress_level": CFG.image_png_compress_level}
 
 
+def encode_image_bytes(image, format="png"):
+    """
+    image: PIL image or HWC uint8 numpy array (see utils/postprocessing.py)
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **get_encoder_options(format))
+    return buffer.getvalue()
+
+
+def get_response_format():
+    """
+    Negotiates the response from the Accept header: None keeps the JSON (base64) response, otherwise
+    the image format of a binary response ("png", "webp", "jpeg" or "auto" for image/*)
+    """
+    accept = request.accept_mimetypes
+    mimetypes = [mimetype for mimetype, _ in accept]
+    if not any(mimetype.startswith("image/") for mimetype in mimetypes):
+        return None
+
+    explicit = [mimetype for mimetype in IMAGE_MIMETYPES.values() if mimetype in mimetypes]
+    best = accept.best_match(explicit + ["image/*", "application/json"])
+    if best == "application/json":
+        return None
+    if best == "image/*":
+        return "auto"
+    return next(format for format, mimetype in IMAGE_MIMETYPES.items() if mimetype == best)
 
-def apply_style_transfer():
-  try:
-    if 'originalImage' not in request.files or 'styleImage' not in request.files:
-        return jsonify({"success": False, "message": "Both originalImage and styleImage must be provided"}), 400
-    
-    user_id = str(g._id)
-    user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
-    subscription_plan = user.get("subscription_plan", "free")
-    style_completion = user.get("style_completion", 0) 
-    
-  
 
-    if(subscription_plan == 'free'):
-        return jsonify({"success": False, "message": "Upgrade to To Premium"}), 201
-    
-    if(subscription_plan == 'pro' and style_completion >= STYLE_PRO_COMPUTE):
-        return jsonify({"success": False, "message": "Style Completion Quota Complete"}), 202
+def negotiated(fn):
+    """
+    Marks every response of an endpoint using get_response_format as depending on the Accept header,
+    so shared caches do not send the binary response to JSON clients (or the other way around)
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        response = make_response(fn(*args, **kwargs))
+        response.vary.add("Accept")
+        return response
+    return wrapper
 
-    
-    
 
-    original_image_file = request.files['originalImage']
-    style_image_file = request.files['styleImage']
-    print(request.files)
-    print(request.form.get("alpha"))
-    alpha_value = float(request.form.get("alpha"))
-    
+def resolve_image_format(format, width, height):
+    """
+    Replaces "auto" by the configured format, webp for large outputs by default
+    """
+    if format == "auto":
+        format = CFG.image_response_format
+    if format == "auto":
+        return "webp" if width * height / 1e6 >= CFG.image_webp_min_megapixels else "png"
+    return format
 
 
+def image_response(data, format, metadata):
+    """
+    Binary image response, the metadata of the JSON response is sent in X- headers
+    """
+    response = Response(data, mimetype=IMAGE_MIMETYPES[format])
+    headers = {f"X-{name}": str(value) for name, value in metadata.items() if value is not None}
+    response.headers.update(headers)
+    # let the browser client read the metadata headers across origins
+    response.headers["Access-Control-Expose-Headers"] = ", ".join(headers)
+    return response, 200
 
-    # loading model
-    vgg_encoder = VGG_ENCODER(CFG.style_transfer_encoder_path).to(CFG.device)
-    vgg_decoder = VGG_DECODER.to(CFG.device)
-    style_transfer_model = Network(vgg_encoder, vgg_decoder).to(CFG.device)
 
-    style_transfer_model.decoder.load_state_dict(torch.load(CFG.style_transfer_decoder_path, map_location=CFG.device, weights_only=True))
+def is_admin():
+    return (g.role or "").lower() in ["admin", "super admin"]
 
-    # Open the original image
-    original_image = Image.open(original_image_file).convert('RGB')
-    # Open the style image
-    style_image = Image.open(style_image_file).convert("RGB")
 
-    org_width, org_height = original_image.width, original_image.height
+def get_profile_trace_id():
+    """
+    Trace id of the torch profiler capture of this request's inference (see utils/profiler.py), None when
+    it is not profiled. Admins ask for a capture with profile=true, other requests are sampled at PROFILE_SAMPLE_RATE.
+    """
+    requested = request.values.get("profile", "").lower() == "true" and is_admin()
+    if requested or inference_profiler.sample():
+        return inference_profiler.new_trace_id()
+    return None
 
-    
 
+def get_captured_trace_id(trace_id):
+    # the capture is skipped while another request of the process is profiled
+    return trace_id if inference_profiler.exists(trace_id) else None
+
+
+def encode_image_base64(image, format="png"):
+    return base64.b64encode(encode_image_bytes(image, format=format)).decode('utf-8')
+
+
+style_batcher = StyleTransferBatcher(
+    lambda: model_registry.get(STYLE_TRANSFER_MODEL),
+    max_batch_size=CFG.style_batch_max_size,
+    max_wait_ms=CFG.style_batch_wait_ms,
+)
+
+# super resolution model runs in progress in this process, used to pick the super resolution tier
+super_resolution_in_flight = InFlightCounter(name="super_resolution")
+
+SUPER_RESOLUTION_TIERS = ["auto", "quality", "fast"]
+
+# content resolution of style transfer under the p95 latency target (STYLE_LATENCY_TARGET_MS)
+style_latency_budget = LatencyBudget(CFG.style_latency_target_ms, shed_factor=CFG.style_latency_shed_factor)
+
+# bounds the synchronous requests running a model, jobs are bounded by the job workers instead
+image_proc_admission = AdmissionController(
+    max_concurrent=CFG.admission_max_concurrent,
+    max_memory=int(CFG.admission_max_memory_mb * 1024 ** 2),
+    max_per_user=CFG.admission_max_per_user,
+    max_queue=CFG.admission_max_queue,
+    max_queued_per_user=CFG.admission_max_queued_per_user,
+    max_wait=CFG.admission_max_wait,
+    tier_weights=parse_tier_weights(CFG.admission_tier_weights),
+    default_tier="pro",
+    starvation_after=CFG.admission_starvation_after,
+)
+
+content_features_cache = TensorCache(
+    max_bytes=int(CFG.content_features_cache_mb * 1024 ** 2),
+    device=CFG.device,
+    ttl=CFG.content_features_cache_ttl,
+    name="content_features",
+)
+
+
+
+
+
+
+
+def admit(user, memory):
+    """
+    Admission of the model run of a request (see image_proc_admission) scheduled by the subscription
+    plan of the user, a no-op for jobs (user None)
+    """
+    if user is None:
+        return nullcontext()
+    return image_proc_admission.admit(str(user["_id"]), memory, tier=user.get("subscription_plan"))
+
+
+def get_style_transfer_size(org_width, org_height):
     # Determine the resizing logic based on the original image dimensions
     min_dim = min(org_width, org_height)
     if min_dim < 512:
-        img_size = None  # No resizing
+        return None  # No resizing
     elif min_dim < 1024:
-        img_size = 512  
+        return 512  
     else:
-        img_size = 1024  
+        return 1024  
 
-    
 
+def get_quota_error(user, completion_field, pro_limit, kind=None):
+    """
+    Returns the error response of users which can not run the model, None otherwise.
+    With `kind` the queued and running jobs of the user count against the quota as well.
+    """
+    subscription_plan = user.get("subscription_plan", "free")
+    completion = user.get(completion_field) or 0
+    if kind is not None:
+        completion += job_queue.count_active(user["_id"], kind)
 
-    original_image_transfrom = get_style_transfer_transform(img_size=img_size)
-    style_image_transform = get_style_transfer_transform(img_size=512)
-    
-    original_image = original_image_transfrom(original_image).unsqueeze(0).to(CFG.device)
-    style_image = style_image_transform(style_image).unsqueeze(0).to(CFG.device)
-    
+    if(subscription_plan == 'free'):
+        return jsonify({"success": False, "message": "Upgrade to To Premium"}), 201
 
-    print(original_image.shape, style_image.shape)
+    if(subscription_plan == 'pro' and completion >= pro_limit):
+        return jsonify({"success": False, "message": "Style Completion Quota Complete"}), 202
 
-    with torch.no_grad():
-        stylized_img = style_transfer_model.stylize_image(original_image, style_image, alpha=alpha_value).to('cpu')[0]
+    return None
 
-    stylized_img = T.ToPILImage()(stylized_img)
-    stylized_img = stylized_img.resize((org_width, org_height))
 
-    del style_transfer_model, original_image, style_image
-    torch.cuda.empty_cache()
-    gc.collect()
+def get_style_transfer_sizes(org_width, org_height):
+    """
+    Resizes the content image can be stylized at, the default size then the smaller STYLE_ADAPTIVE_SIZES
+    """
+    img_size = get_style_transfer_size(org_width, org_height)
+    min_dim = min(org_width, org_height)
+    return [img_size] + [size for size in sorted(CFG.style_adaptive_sizes, reverse=True) if size < (img_size or min_dim)]
+
+
+def get_cached_style_transfer_size(content_hash, org_width, org_height):
+    """
+    Largest resize whose encoder output is cached for the content hash. Requests sending only the hash
+    can not be decoded at another size, so the size is not chosen again from the current load.
+    """
+    for size in get_style_transfer_sizes(org_width, org_height):
+        if content_features_cache.get(f"{content_hash}_{size}") is not None:
+            return size
+    raise LookupError("Content image has expired, originalImage must be provided")
+
+
+def choose_style_transfer_size(org_width, org_height, allow_shed=True):
+    """
+    Returns the resize of the content image (None keeps the original size). With a latency target the
+    largest of the default size and the smaller STYLE_ADAPTIVE_SIZES which is predicted to fit is used,
+    raises OverloadedError when even the smallest size is far over the target.
+    """
+    img_size = get_style_transfer_size(org_width, org_height)
+    if CFG.style_latency_target_ms <= 0:
+        return img_size
 
+    min_dim = min(org_width, org_height)
+    sizes = get_style_transfer_sizes(org_width, org_height)
+    candidates = [(size, org_width * org_height * ((size or min_dim) / min_dim) ** 2) for size in sizes]
+    (img_size, _), predicted_ms = style_latency_budget.choose(candidates, allow_shed=allow_shed)
+    return img_size
+
+
+def get_content_size(original_image_bytes, content_hash):
+    """
+    (width, height) of the content image, only the image header is read (too large images are rejected here)
+    """
+    if original_image_bytes is not None:
+        image = probe_image(original_image_bytes)
+        return image.width, image.height
+
+    org_size = content_features_cache.get(content_hash)
+    if org_size is None:
+        raise LookupError("Content image has expired, originalImage must be provided")
+    return tuple(org_size[0].tolist())
+
+
+def parse_alphas(alphas, alpha):
+    """
+    a comma separated list of alphas returns one stylized image per alpha from a single encoder pass,
+    returns None when the number of alphas is not allowed
+    """
+    if alphas:
+        alpha_values = [float(alpha) for alpha in alphas.split(",") if alpha.strip()]
+        if not alpha_values or len(alpha_values) > CFG.style_max_alphas:
+            return None
+        return alpha_values
+    return [float(alpha)]
+
+
+def prepare_style_transfer(original_image_bytes, content_hash, style_image_bytes, style_id, img_size=None):
+    """
+    Decodes the content image (or looks up the size of a previously uploaded one by its hash) and
+    gets the style statistics. Raises LookupError when the content image expired or the style does not exist.
+    img_size: shorter side the content image is resized to, it is decoded at the nearest size above it
+    returns the content image (None when only the hash was sent), its hash, its original (width, height) and the style (mean, std)
+    """
+    original_image = None
+    if original_image_bytes is not None:
+        # Open the original image
+        content_hash = content_hash or hash_bytes(original_image_bytes)
+        original_image, org_size, _ = open_image(original_image_bytes, min_side=img_size)
+    else:
+        # the client only sent the hash of an image it uploaded earlier
+        org_size = content_features_cache.get(content_hash)
+        if org_size is None:
+            raise LookupError("Content image has expired, originalImage must be provided")
+        org_size = tuple(org_size[0].tolist())
+
+    if style_image_bytes is not None:
+        # mean/std of the style features, cached by the hash of the style image
+        with span("style_stats"):
+            style_stats = get_style_stats(style_image_bytes)
+    else:
+        # precomputed mean/std of an admin curated style
+        style_stats = style_bank.get(style_id)
+        if style_stats is None:
+            raise LookupError("Style not found")
+
+    return original_image, content_hash, org_size, style_stats
+
+
+def run_style_transfer(original_image, content_hash, org_size, style_stats, alpha_values, img_size, timings=None, trace_id=None):
+    """
+    Stylizes the content image resized to img_size (see choose_style_transfer_size) with every alpha and
+    returns the images at the original size as HWC uint8 numpy arrays. The encoder output is cached by
+    content hash and resize bucket so later edits only run the decoder.
+    trace_id: the inference is captured with the torch profiler under this id (see get_profile_trace_id)
+    """
+    timings = StageTimings() if timings is None else timings
+    org_width, org_height = org_size
+    style_mean, style_std = style_stats
+
+    # encoder output of the content image, cached by image hash and resize bucket
+    content_features_key = f"{content_hash}_{img_size}"
+    cached_content = content_features_cache.get(content_features_key)
+    if cached_content is not None:
+        content_features, content_size = cached_content
+        content_size = tuple(content_size.tolist())
+        original_image = None
+    elif original_image is None:
+        raise LookupError("Content image has expired, originalImage must be provided")
+    else:
+        content_features = None
+        original_image_transfrom = get_style_transfer_transform(img_size=img_size)
+        original_image = original_image_transfrom(original_image).to(CFG.device)
+        content_size = tuple(original_image.shape[-2:])
+
+    with span("model_load"):
+        style_transfer_model = model_registry.get(STYLE_TRANSFER_MODEL)
+    # the latency of every run feeds the content resolution choice of the next requests
+    profile_metadata = {"content_size": content_size, "img_size": img_size, "alphas": alpha_values, "cached_content": cached_content is not None}
+    with style_latency_budget.track(img_size, content_size[0] * content_size[1]), timings.stage("inference"), \
+            inference_profiler.capture(trace_id, "style_transfer", profile_metadata):
+        if len(alpha_values) > 1:
+            # all the alphas share the encoder pass and are decoded as one batch
+            with torch.no_grad():
+                if content_features is None:
+                    with span("encoder"):
+                        content_features = style_transfer_model.encode_content_batch([original_image])[0]
+                with span("decoder"):
+                    stylized_imgs = style_transfer_model.decode_alphas(content_features, style_mean, style_std, alpha_values)
+                    stylized_imgs = stylized_imgs[:, :, :content_size[0], :content_size[1]]
+        elif CFG.style_batching and trace_id is None:
+            # concurrent requests in the same size bucket are stylized together (the span includes the batching wait),
+            # profiled requests run in their own thread so the capture only contains them
+            with span("batcher"):
+                stylized_img, content_features = style_batcher.stylize(
+                    original_image, (style_mean, style_std), alpha_values[0], bucket=img_size,
+                    content_features=content_features, content_size=content_size,
+                )
+            stylized_imgs = [stylized_img]
+        else:
+            with torch.no_grad():
+                if content_features is None:
+                    with span("encoder"):
+                        content_features = style_transfer_model.encode_content_batch([original_image])[0]
+                with span("decoder"):
+                    stylized_imgs = style_transfer_model.decode_batch([content_features], [(style_mean, style_std)], alpha_values, [content_size])
+
+    if cached_content is None:
+        content_features_cache.put(content_hash, (torch.tensor([org_width, org_height]),))
+        content_features_cache.put(content_features_key, (content_features, torch.tensor(content_size)))
+
+    del original_image, content_features
+
+    # resized back to the original size on the device, only the uint8 images are copied to the cpu
+    return [to_numpy_image(stylized_img, size=(org_height, org_width), timings=timings) for stylized_img in stylized_imgs]
+
+
+def stylize_cached(original_image_bytes, content_hash, style_image_bytes, style_id, alpha_values, progress=None, allow_shed=True, image_format="png", trace_id=None, user=None):
+    """
+    Style transfer through the result cache, returns the encoded image of every alpha, the content hash,
+    the content resolution, the image format ("auto" is resolved from the output size) and where the
+    result came from (see utils/result_cache.py). Profiled requests (trace_id) always run the model.
+    user: the model run of this user waits for admission (raises AdmissionError when it is rejected)
+    """
+    if original_image_bytes is not None:
+        content_hash = hash_bytes(original_image_bytes)
+    style_key = hash_bytes(style_image_bytes) if style_image_bytes is not None else f"style_id:{style_id}"
+
+    org_width, org_height = get_content_size(original_image_bytes, content_hash)
+    if original_image_bytes is not None:
+        img_size = choose_style_transfer_size(org_width, org_height, allow_shed=allow_shed)
+    else:
+        img_size = get_cached_style_transfer_size(content_hash, org_width, org_height)
+    image_format = resolve_image_format(image_format, org_width, org_height)
+
+    # estimated from the header, nothing is decoded before the request is admitted (single alpha requests
+    # share a padded batch, see run_style_transfer)
+    batched = CFG.style_batching and trace_id is None and len(alpha_values) == 1
+    memory = estimate_style_transfer_memory(org_width, org_height, img_size, len(alpha_values), batched=batched)
+
+    def compute():
+        with admit(user, memory):
+            original_image, _, org_size, style_stats = prepare_style_transfer(original_image_bytes, content_hash, style_image_bytes, style_id, img_size=img_size)
+            if progress is not None:
+                progress(0.1)
+            timings = StageTimings()
+            stylized_imgs = run_style_transfer(original_image, content_hash, org_size, style_stats, alpha_values, img_size, timings=timings, trace_id=trace_id)
+            with timings.stage("encode"):
+                outputs = [encode_image_bytes(stylized_img, format=image_format) for stylized_img in stylized_imgs]
+            return outputs
+
+    result_key = get_style_result_key(content_hash, style_key, alpha_values, img_size, image_format)
+    outputs, source = result_cache.get_or_compute(result_key, compute, refresh=trace_id is not None)
+    # shorter side of the content image the model ran on
+    resolution = img_size or min(org_width, org_height)
+    return outputs, content_hash, resolution, image_format, source
+
+
+@negotiated
+def apply_style_transfer():
+  try:
+    style_id = request.form.get("style_id")
+    content_hash = request.form.get("content_hash")
+    if ('originalImage' not in request.files and not content_hash) or ('styleImage' not in request.files and not style_id):
+        return jsonify({"success": False, "message": "Both originalImage (or content_hash) and styleImage (or style_id) must be provided"}), 400
+    
+    user_id = str(g._id)
+    with span("db_user"):
+        user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
+    style_completion = user.get("style_completion", 0) 
+    
+  
 
+    quota_error = get_quota_error(user, "style_completion", STYLE_PRO_COMPUTE)
+    if quota_error:
+        return quota_error
 
-    # encode to base64
-    buffer = io.BytesIO()
-    stylized_img.save(buffer, format="png")
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    
     
     
+
+    print(request.files)
+    print(request.form.get("alpha"))
+
+    alphas = request.form.get("alphas")
+    alpha_values = parse_alphas(alphas, request.form.get("alpha"))
+    if alpha_values is None:
+        return jsonify({"success": False, "message": f"Between 1 and {CFG.style_max_alphas} alpha values must be provided"}), 400
     
 
-    result = users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": {"style_completion": style_completion + 1}}
+    # several alphas can only be sent in the JSON response
+    response_format = get_response_format() if len(alpha_values) == 1 else None
+    trace_id = get_profile_trace_id()
+
+    try:
+        stylized_imgs, content_hash, resolution, image_format, source = stylize_cached(
+            request.files['originalImage'].read() if 'originalImage' in request.files else None, content_hash,
+            request.files['styleImage'].read() if 'styleImage' in request.files else None, style_id, alpha_values,
+            image_format=response_format or "png", trace_id=trace_id, user=user,
         )
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    except ImageTooLargeError as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+    except OverloadedError as e:
+        # degrading the resolution is not enough or the request was not admitted, ask the client to come back
+        return jsonify({"success": False, "message": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
+    trace_id = get_captured_trace_id(trace_id)
+
+
+
+    if should_charge_quota(source):
+        with span("db_quota"):
+            result = users_collection.update_one(
+                    {"_id": ObjectId(user_id)},
+                    {"$set": {"style_completion": style_completion + 1}}
+                )
+        print(result)
 
-    
-    print(result)
+    if response_format:
+        return image_response(stylized_imgs[0], image_format, {"Content-Hash": content_hash, "Resolution": resolution, "Result-Source": source, "Profile-Trace": trace_id})
+
+    # encode to base64
+    with span("base64"):
+        images_base64 = [base64.b64encode(stylized_img).decode('utf-8') for stylized_img in stylized_imgs]
     
     
 
     
     
-    return jsonify({"success": True, "message": "Style Trasnfer Successfull", "image": image_base64}), 200
+    if alphas:
+        return jsonify({"success": True, "message": "Style Trasnfer Successfull", "images": images_base64, "alphas": alpha_values, "content_hash": content_hash, "resolution": resolution, "profile_trace": trace_id}), 200
+    
+    return jsonify({"success": True, "message": "Style Trasnfer Successfull", "image": images_base64[0], "content_hash": content_hash, "resolution": resolution, "profile_trace": trace_id}), 200
 
   except Exception as e:
     return jsonify({"success": False, "message": f"An Error has occurced {str(e)}"}), 500
@@ -151,23 +524,20 @@ def find_similar_image():
         base_image_file = request.files['baseImage']
         
         # Open the original image
-        img = Image.open(base_image_file).convert('RGB')
+        with span("decode"):
+            img, _, _ = open_image(base_image_file.read(), min_side=224)
         img_transform = get_similar_image_transform(img_size=(224, 224))
 
         # Load model
-        m = models.vgg16(weights=None)
-        m.load_state_dict(torch.load(CFG.similarity_model_path, map_location=CFG.device, weights_only=True))
-        sim_model = torch.nn.Sequential(*[m.features, m.avgpool, m.classifier[0]])
+        with span("model_load"):
+            sim_model = model_registry.get(SIMILARITY_MODEL)
         
-        with torch.no_grad():
+        with torch.no_grad(), span("embedding"):
             # Getting embedding
-            img_emb = get_embedding(sim_model, img_transform(img)).to('cpu')  
-
-        del style_transfer_model
-        torch.cuda.empty_cache()
-        gc.collect()
+            img_emb = get_embedding(sim_model, img_transform(img).to(CFG.device)).to('cpu')  
      
-        stored_embeddings = list(embedding_collection.find({"is_public": "true"}, {"project_id": 1, "embedding": 1}))
+        with span("db_embeddings"):
+            stored_embeddings = list(embedding_collection.find({"is_public": "true"}, {"project_id": 1, "embedding": 1}))
 
         if not stored_embeddings:
             return jsonify({"success": False, "message": "No embeddings found in the database"}), 404
@@ -190,23 +560,120 @@ def find_similar_image():
             "message": "Top 10 similar images found",
             "similar_projects": top_10_similar
         }), 200
+    except ImageTooLargeError as e:
+        return jsonify({"success": False, "message": str(e)}), 413
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
       
 
+def select_super_resolution_tier(requested, width, height, resolution):
+    """
+    Returns "quality" (MDSR) or "fast" (EDSR). The fast tier only exists for the scales with an EDSR
+    checkpoint, "auto" uses it for inputs of at least SR_FAST_MEGAPIXELS or when SR_FAST_QUEUE_DEPTH
+    super resolution runs are already queued or in progress.
+    """
+    if resolution not in get_fast_super_resolution_paths():
+        return "quality"
+    if requested in ["quality", "fast"]:
+        return requested
+
+    megapixels = width * height / 1e6
+    queue_depth = super_resolution_in_flight.value + job_queue.queue_depth(SUPER_RESOLUTION_JOB)
+    if megapixels >= CFG.super_resolution_fast_megapixels or queue_depth >= CFG.super_resolution_fast_queue_depth:
+        return "fast"
+    return "quality"
+
+
+def run_super_resolution(image, resolution, progress=None, tier="quality", timings=None, trace_id=None):
+    """
+    Upscales the PIL image by `resolution` (2, 3 or 4) and returns the upscaled image as a HWC uint8 numpy array.
+    progress: optional callable(done_tiles, total_tiles) of the tiled forward
+    tier: "quality" (MDSR) or "fast" (EDSR)
+    trace_id: the inference is captured with the torch profiler under this id (see get_profile_trace_id)
+    """
+    timings = StageTimings() if timings is None else timings
+
+    # the models work on [0, 255] pixel values, the uint8 image is converted once on the device
+    with timings.stage("to_tensor"):
+        image = T.functional.pil_to_tensor(image).unsqueeze(0).to(CFG.device).float()
+    print("DEBUG: Image transformed to tensor")
+
+    # Load the model
+    with span("model_load"):
+        model = None
+        if tier == "fast":
+            try:
+                model = model_registry.get(SUPER_RESOLUTION_FAST_MODEL)
+            except Exception as e:
+                # the quality tier (MDSR) supports every scale, a broken fast tier must not fail the request
+                print(f"Failed to load the fast super resolution model, using the quality tier: {str(e)}")
+        if model is None:
+            model = model_registry.get(SUPER_RESOLUTION_MODEL)
+    print("DEBUG: Model loaded successfully")
+
+    # Apply super-resolution based on the scale
+    print(f"DEBUG: Applying super-resolution for scale {resolution}")
+    profile_metadata = {"input_size": tuple(image.shape[-2:]), "scale": resolution, "tier": tier}
+    with torch.no_grad(), timings.stage("inference"), inference_profiler.capture(trace_id, "super_resolution", profile_metadata):
+        if CFG.super_resolution_tile_size > 0:
+            image = model.forward_tiled(
+                image, resolution,
+                tile_size=CFG.super_resolution_tile_size,
+                overlap=CFG.super_resolution_tile_overlap,
+                # profiled requests run every tile in the request thread so the capture contains all of them
+                num_workers=CFG.super_resolution_tile_workers if trace_id is None else 1,
+                progress=progress,
+            )
+        else:
+            image = model(image, resolution)
+    print(f"DEBUG: Super-resolution applied for scale {resolution}")
+
+    # clamped and quantized in one pass, only the uint8 image is copied to the cpu
+    return to_numpy_image(image[0], max_value=255, timings=timings)
+
+
+def upscale_cached(image_bytes, resolution, progress=None, tier=None, image_format="png", trace_id=None, user=None):
+    """
+    Super resolution through the result cache, returns the encoded upscaled image, the tier which was
+    used, the image format ("auto" is resolved from the output size) and where the result came from
+    (see utils/result_cache.py). Profiled requests (trace_id) always run the model.
+    user: the model run of this user waits for admission (raises AdmissionError when it is rejected)
+    """
+    # only the header is read here, the pixels are decoded when the model runs
+    image = probe_image(image_bytes)
+    tier = select_super_resolution_tier(tier or CFG.super_resolution_tier, image.width, image.height, resolution)
+    image_format = resolve_image_format(image_format, image.width * resolution, image.height * resolution)
+    memory = estimate_super_resolution_memory(
+        image.width, image.height, resolution,
+        tile_size=CFG.super_resolution_tile_size, overlap=CFG.super_resolution_tile_overlap, num_workers=CFG.super_resolution_tile_workers,
+    )
+
+    def compute():
+        with admit(user, memory), super_resolution_in_flight.track():
+            timings = StageTimings()
+            with timings.stage("decode"):
+                rgb_image, _, _ = open_image(image_bytes)
+            upscaled = run_super_resolution(rgb_image, resolution, progress=progress, tier=tier, timings=timings, trace_id=trace_id)
+            with timings.stage("encode"):
+                output = encode_image_bytes(upscaled, format=image_format)
+            return [output]
+
+    result_key = get_super_resolution_result_key(image_bytes, resolution, tier, image_format)
+    outputs, source = result_cache.get_or_compute(result_key, compute, refresh=trace_id is not None)
+    return outputs[0], tier, image_format, source
+
+
+@negotiated
 def apply_super_resolution():
     try:
         user_id = str(g._id)
-        user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
-        subscription_plan = user.get("subscription_plan", "free")
+        with span("db_user"):
+            user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
         upscale_completion = user.get("upscale_completion")  
 
-        if(subscription_plan == 'free'):
-            return jsonify({"success": False, "message": "Upgrade to To Premium"}), 201
-    
-        
-        if(subscription_plan == 'pro' and upscale_completion >= SUPER_RESOULTION_PRO_COMPUTE):
-            return jsonify({"success": False, "message": "Style Completion Quota Complete"}), 202
+        quota_error = get_quota_error(user, "upscale_completion", SUPER_RESOULTION_PRO_COMPUTE)
+        if quota_error:
+            return quota_error
 
         print("DEBUG: Starting apply_super_resolution function")
 
@@ -227,62 +694,277 @@ def apply_super_resolution():
         resolution = int(resolution)
         print(f"DEBUG: Parsed resolution: {resolution}")
 
-        # Open the image
-        image = Image.open(image_data).convert("RGB")
-        print("DEBUG: Image successfully opened and converted to RGB")
-
-        # Apply transformation
-        transform = get_super_resolution_transform()
-        image = transform(image)
-        print("DEBUG: Image transformed to tensor")
-
-        # Load the model
-        print("DEBUG: Loading MDSR model")
-        model = MDSR(num_res_blocks=80, num_feats=64, scales=[2, 3, 4]).to(CFG.device)
-        model_checkpoint = torch.load(CFG.super_resolution_model_path, map_location=CFG.device, weights_only=True)
-        model.load_state_dict(model_checkpoint['model_state'])
-        print("DEBUG: Model loaded successfully")
-
-        # Apply super-resolution based on the scale
-        if resolution in [2, 3, 4]:
-            print(f"DEBUG: Applying super-resolution for scale {resolution}")
-            with torch.no_grad():
-                image = image * 255
-                image = torch.clip(model(image.unsqueeze(0).to(CFG.device), resolution), min=0, max=255).to('cpu').squeeze(0)
-                image = image / 255
-            print(f"DEBUG: Super-resolution applied for scale {resolution}")
-        else:
+        if resolution not in [2, 3, 4]:
             print(f"DEBUG: Invalid resolution: {resolution}")
             return jsonify({"success": False, "message": f"Resolution {resolution} is not supported"}), 400
 
-        # Clean up
-        del model
-        torch.cuda.empty_cache()
-        gc.collect()
-        print("DEBUG: Model and cache cleared")
+        tier = request.form.get("tier")
+        if tier and tier not in SUPER_RESOLUTION_TIERS:
+            return jsonify({"success": False, "message": f"Tier must be one of {SUPER_RESOLUTION_TIERS}"}), 400
+
+        response_format = get_response_format()
+        trace_id = get_profile_trace_id()
+        image, tier, image_format, source = upscale_cached(image_data.read(), resolution, tier=tier, image_format=response_format or "png", trace_id=trace_id, user=user)
+        trace_id = get_captured_trace_id(trace_id)
+        
+    
+        if should_charge_quota(source):
+            with span("db_quota"):
+                result = users_collection.update_one(
+                    {"_id": ObjectId(user_id)},
+                    {"$set": {"upscale_completion": upscale_completion + 1}}
+                )
+            print(result)
 
-        # Convert tensor back to image
-        image = T.ToPILImage()(image)
-        print("DEBUG: Tensor converted back to PIL image")
+        if response_format:
+            return image_response(image, image_format, {"Scale": resolution, "Tier": tier, "Result-Source": source, "Profile-Trace": trace_id})
 
         # Encode image to base64
-        buffer = io.BytesIO()
-        image.save(buffer, format="png")
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        with span("base64"):
+            image_base64 = base64.b64encode(image).decode('utf-8')
         print("DEBUG: Image encoded to base64")
-        
-    
-        result = users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": {"upscale_completion": upscale_completion + 1}}
-        )
-        print(result)
 
-        return jsonify({"success": True, "message": "Super-resolution applied successfully", 'image': image_base64}), 200
+        return jsonify({"success": True, "message": "Super-resolution applied successfully", 'image': image_base64, "tier": tier, "profile_trace": trace_id}), 200
+
+    except ImageTooLargeError as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+
+    except OverloadedError as e:
+        return jsonify({"success": False, "message": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
 
     except Exception as e:
         print(f"DEBUG: Exception occurred - {str(e)}")
         return jsonify({"success": False, "message": f"An error occurred: {str(e)}"}), 500
 
 
+def run_super_resolution_job(job, inputs, progress):
+    progress(0.05)
+    # the tiles cover the model time, the last 5% are the png encoding
+    image, tier, _, source = upscale_cached(
+        inputs["originalImage"], job["params"]["scale"], progress=lambda done, total: progress(0.05 + 0.9 * done / total),
+        tier=job["params"].get("tier"), trace_id=job["params"].get("trace_id"),
+    )
+    profile_trace = get_captured_trace_id(job["params"].get("trace_id"))
+    return {"image_0.png": image}, {"images": ["image_0.png"], "tier": tier, "source": source, "profile_trace": profile_trace}
+
+
+def run_style_transfer_job(job, inputs, progress):
+    params = job["params"]
+    # jobs are queued by design, they degrade the resolution but are never rejected
+    stylized_imgs, content_hash, resolution, _, source = stylize_cached(
+        inputs.get("originalImage"), params.get("content_hash"), inputs.get("styleImage"), params.get("style_id"),
+        params["alphas"], progress=progress, allow_shed=False, trace_id=params.get("trace_id"),
+    )
+    outputs = {f"image_{i}.png": stylized_img for i, stylized_img in enumerate(stylized_imgs)}
+    profile_trace = get_captured_trace_id(params.get("trace_id"))
+    return outputs, {"images": list(outputs), "alphas": params["alphas"], "content_hash": content_hash, "resolution": resolution, "source": source, "profile_trace": profile_trace}
+
+
+def increment_completion(field):
+    def on_success(job, result):
+        if not should_charge_quota(result["source"]):
+            return
+        # $inc since several jobs of the same user may finish concurrently
+        users_collection.update_one({"_id": ObjectId(job["user_id"])}, {"$inc": {field: 1}})
+    return on_success
+
+
+job_queue.register(SUPER_RESOLUTION_JOB, run_super_resolution_job, on_success=increment_completion("upscale_completion"))
+job_queue.register(STYLE_TRANSFER_JOB, run_style_transfer_job, on_success=increment_completion("style_completion"))
+
+
+def submit_super_resolution_job():
+    try:
+        user_id = str(g._id)
+        with span("db_user"):
+            user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
+        quota_error = get_quota_error(user, "upscale_completion", SUPER_RESOULTION_PRO_COMPUTE, kind=SUPER_RESOLUTION_JOB)
+        if quota_error:
+            return quota_error
+
+        if 'originalImage' not in request.files:
+            return jsonify({"success": False, "message": "originalImage must be provided"}), 400
+
+        resolution = request.form.get("scale")
+        if not resolution:
+            return jsonify({"success": False, "message": "Resolution must be provided"}), 400
+        resolution = int(resolution)
+        if resolution not in [2, 3, 4]:
+            return jsonify({"success": False, "message": f"Resolution {resolution} is not supported"}), 400
+
+        tier = request.form.get("tier")
+        if tier and tier not in SUPER_RESOLUTION_TIERS:
+            return jsonify({"success": False, "message": f"Tier must be one of {SUPER_RESOLUTION_TIERS}"}), 400
+
+        image_bytes = request.files['originalImage'].read()
+        # too large images are rejected before they are queued
+        probe_image(image_bytes)
+        with span("job_submit"):
+            job_id = job_queue.submit(
+                SUPER_RESOLUTION_JOB, user_id, {"scale": resolution, "tier": tier, "trace_id": get_profile_trace_id()}, {"originalImage": image_bytes},
+            )
+        return jsonify({"success": True, "message": "Super-resolution job submitted", "job_id": job_id}), 202
+
+    except ImageTooLargeError as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+
+    except Exception as e:
+        return jsonify({"success": False, "message": f"An error occurred: {str(e)}"}), 500
+
+
+def submit_style_transfer_job():
+    try:
+        style_id = request.form.get("style_id")
+        content_hash = request.form.get("content_hash")
+        if ('originalImage' not in request.files and not content_hash) or ('styleImage' not in request.files and not style_id):
+            return jsonify({"success": False, "message": "Both originalImage (or content_hash) and styleImage (or style_id) must be provided"}), 400
+
+        user_id = str(g._id)
+        with span("db_user"):
+            user = users_collection.find_one({"_id": ObjectId(user_id)}, {})
+        quota_error = get_quota_error(user, "style_completion", STYLE_PRO_COMPUTE, kind=STYLE_TRANSFER_JOB)
+        if quota_error:
+            return quota_error
+
+        alpha_values = parse_alphas(request.form.get("alphas"), request.form.get("alpha"))
+        if alpha_values is None:
+            return jsonify({"success": False, "message": f"Between 1 and {CFG.style_max_alphas} alpha values must be provided"}), 400
+
+        inputs = {name: request.files[name].read() for name in ['originalImage', 'styleImage'] if name in request.files}
+        # too large images are rejected before they are queued
+        for data in inputs.values():
+            probe_image(data)
+        with span("job_submit"):
+            job_id = job_queue.submit(
+                STYLE_TRANSFER_JOB, user_id, {"alphas": alpha_values, "content_hash": content_hash, "style_id": style_id, "trace_id": get_profile_trace_id()}, inputs,
+            )
+        return jsonify({"success": True, "message": "Style transfer job submitted", "job_id": job_id}), 202
+
+    except ImageTooLargeError as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+
+    except Exception as e:
+        return jsonify({"success": False, "message": f"An Error has occurced {str(e)}"}), 500
+
+
+def get_job_status(job_id):
+    try:
+        # long polling: ?wait=<seconds> returns as soon as the job finished
+        wait = min(float(request.args.get("wait", 0)), CFG.job_max_wait)
+        job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+        if job is None or job["user_id"] != str(g._id):
+            return jsonify({"success": False, "message": "Job not found"}), 404
+
+        return jsonify({
+            "success": True,
+            "job": {
+                "job_id": job["job_id"],
+                "kind": job["kind"],
+                "status": job["status"],
+                "progress": job["progress"],
+                "error": job["error"],
+                "created_at": job["created_at"],
+                "started_at": job["started_at"],
+                "finished_at": job["finished_at"],
+                "profile_trace": job["result"].get("profile_trace") if job["result"] else None,
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": f"An error occurred: {str(e)}"}), 500
+
+
+@negotiated
+def get_job_result(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if job is None or job["user_id"] != str(g._id):
+            return jsonify({"success": False, "message": "Job not found"}), 404
+
+        if job["status"] == JOB_FAILED:
+            return jsonify({"success": False, "message": job["error"]}), 500
+        if job["status"] != JOB_DONE:
+            return jsonify({"success": False, "message": f"Job is {job['status']}", "progress": job["progress"]}), 409
+
+        result = job["result"]
+        outputs = [job_queue.read_output(job_id, name) for name in result["images"]]
+        if any(output is None for output in outputs):
+            # the outputs are removed with the job after JOB_RESULT_TTL
+            return jsonify({"success": False, "message": "Job result has expired"}), 410
+
+        response_format = get_response_format() if len(outputs) == 1 else None
+        if response_format:
+            # the job outputs are stored as png, other formats are encoded on the way out
+            image = outputs[0]
+            output = Image.open(io.BytesIO(image))
+            image_format = resolve_image_format(response_format, output.width, output.height)
+            if image_format != "png":
+                image = encode_image_bytes(output.convert("RGB"), format=image_format)
+            if job["kind"] == STYLE_TRANSFER_JOB:
+                metadata = {"Content-Hash": result["content_hash"], "Resolution": result["resolution"]}
+            else:
+                metadata = {"Tier": result["tier"]}
+            return image_response(image, image_format, metadata)
+
+        with span("base64"):
+            images_base64 = [base64.b64encode(output).decode('utf-8') for output in outputs]
+
+        # same response as the synchronous endpoints
+        if job["kind"] == STYLE_TRANSFER_JOB:
+            if len(result["alphas"]) > 1:
+                return jsonify({"success": True, "message": "Style Trasnfer Successfull", "images": images_base64, "alphas": result["alphas"], "content_hash": result["content_hash"], "resolution": result["resolution"]}), 200
+            return jsonify({"success": True, "message": "Style Trasnfer Successfull", "image": images_base64[0], "content_hash": result["content_hash"], "resolution": result["resolution"]}), 200
+        return jsonify({"success": True, "message": "Super-resolution applied successfully", 'image': images_base64[0], "tier": result["tier"]}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "message": f"An error occurred: {str(e)}"}), 500
+
+
+def get_model_stats():
+    try:
+        role = g.role
+        if role.lower() not in ["admin", "super admin"]:
+            return jsonify({"success": False, "message": "Unauthorized. Only admins are allowed"}), 403
+
+        data = {
+            "models": model_registry.stats(),
+            "style_batcher": style_batcher.metrics(),
+            "style_stats_cache": style_stats_cache.stats(),
+            "style_bank_size": len(style_bank),
+            "content_features_cache": content_features_cache.stats(),
+            "jobs": job_queue.stats(),
+            "result_cache": result_cache.stats(),
+            "style_latency_budget": style_latency_budget.metrics(),
+            "admission": image_proc_admission.stats(),
+            "ingest": ingest_metrics.stats(),
+            "timings": timing_metrics.stats(),
+        }
+        if inference_client is not None:
+            data["inference_service"] = inference_client.stats()
+
+        return jsonify({"success": True, "data": data}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+def list_profiles():
+    try:
+        if not is_admin():
+            return jsonify({"success": False, "message": "Unauthorized. Only admins are allowed"}), 403
+        return jsonify({"success": True, "data": inference_profiler.list()}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+
+def download_profile(trace_id):
+    try:
+        if not is_admin():
+            return jsonify({"success": False, "message": "Unauthorized. Only admins are allowed"}), 403
+
+        # ?kind=trace (chrome trace, default) or ?kind=table (operator table)
+        kind = request.args.get("kind", "trace")
+        path = inference_profiler.get_file(trace_id, kind)
+        if path is None:
+            return jsonify({"success": False, "message": "Profile not found"}), 404
+        return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
@@ -9,6 +9,7 @@ from bson import ObjectId
 import datetime
 from utils.common import get_user_paths
 from cloudinary.uploader import upload, destroy
+from utils.server_timing import span
 
 load_dotenv()
 
@@ -78,7 +79,8 @@ def save_project():
 
      
         # Check if a project with the given project_id already exists
-        existing_project = projects_collection.find_one({"project_id": canvas_id, "user_id": user_id})
+        with span("db_find"):
+            existing_project = projects_collection.find_one({"project_id": canvas_id, "user_id": user_id})
 
         if existing_project:
             if(os.getenv("DEPLOY_PRODUCTION").lower() == 'true'):
@@ -90,17 +92,19 @@ def save_project():
                 inter_image_path = f"{INTER_IMG_FOLDER}{filename}"
                 canvas_image_path = f"{CANVAS_IMG_FOLDER}{filename}"
 
-                cloud_inter_result = upload(
-                    inter_image_file,
-                    public_id=inter_image_path,  # This sets the folder and filename
-                    overwrite=True  # Optional: allows overwriting if file with same ID exists
-                )
+                with span("storage_upload"):
+                    cloud_inter_result = upload(
+                        inter_image_file,
+                        public_id=inter_image_path,  # This sets the folder and filename
+                        overwrite=True  # Optional: allows overwriting if file with same ID exists
+                    )
 
-                cloud_canvas_result = upload(
-                    canvas_image_file,
-                    public_id=canvas_image_path, # This sets the folder and filename
-                    overwrite=True  # Optional: allows overwriting if file with same ID exists
-                )
+                with span("storage_upload"):
+                    cloud_canvas_result = upload(
+                        canvas_image_file,
+                        public_id=canvas_image_path, # This sets the folder and filename
+                        overwrite=True  # Optional: allows overwriting if file with same ID exists
+                    )
 
                 
                 #  Update the image URL in canvas JSON
@@ -108,19 +112,20 @@ def save_project():
                     if obj.get("type").lower() == "image":
                         obj["src"] = cloud_inter_result['secure_url']
 
-                projects_collection.update_one(
-                    {"project_id": canvas_id, "user_id": user_id}, 
-                    {"$set": {
-                        "project_data": canvas_data,
-                        "project_logs": canvas_logs, 
-                        "final_image_shape": final_image_shape, 
-                        "download_image_shape": download_image_shape,
-                        "filter_names": filter_names,
-                        "all_filters_applied": all_filters_applied,
-                        "project_name": project_name,
-                        "updated_at": datetime.datetime.utcnow()  # ✅ Update timestamp
-                    }}
-                )
+                with span("db_write"):
+                    projects_collection.update_one(
+                        {"project_id": canvas_id, "user_id": user_id}, 
+                        {"$set": {
+                            "project_data": canvas_data,
+                            "project_logs": canvas_logs, 
+                            "final_image_shape": final_image_shape, 
+                            "download_image_shape": download_image_shape,
+                            "filter_names": filter_names,
+                            "all_filters_applied": all_filters_applied,
+                            "project_name": project_name,
+                            "updated_at": datetime.datetime.utcnow()  # ✅ Update timestamp
+                        }}
+                    )
                 response_message = "Project updated successfully"
                 status_code = 200
 
@@ -132,27 +137,29 @@ def save_project():
                 canvas_image_path = f"{CANVAS_IMG_FOLDER}/{image_filename}"
 
                 # Update the existing project
-                inter_image_file.save(inter_image_path)
-                canvas_image_file.save(canvas_image_path)
+                with span("storage_write"):
+                    inter_image_file.save(inter_image_path)
+                    canvas_image_file.save(canvas_image_path)
 
                 #  Update the image URL in canvas JSON
                 for obj in canvas_data.get("objects", []):
                     if obj.get("type").lower() == "image":
                         obj["src"] = os.getenv("BACKEND_SERVER") + "/server/static/" + user_id +  "/inter/" + image_filename
 
-                projects_collection.update_one(
-                    {"project_id": canvas_id, "user_id": user_id}, 
-                    {"$set": {
-                        "project_data": canvas_data,
-                        "project_logs": canvas_logs, 
-                        "final_image_shape": final_image_shape, 
-                        "download_image_shape": download_image_shape,
-                        "filter_names": filter_names,
-                        "all_filters_applied": all_filters_applied,
-                        "project_name": project_name,
-                        "updated_at": datetime.datetime.utcnow()  # ✅ Update timestamp
-                    }}
-                )
+                with span("db_write"):
+                    projects_collection.update_one(
+                        {"project_id": canvas_id, "user_id": user_id}, 
+                        {"$set": {
+                            "project_data": canvas_data,
+                            "project_logs": canvas_logs, 
+                            "final_image_shape": final_image_shape, 
+                            "download_image_shape": download_image_shape,
+                            "filter_names": filter_names,
+                            "all_filters_applied": all_filters_applied,
+                            "project_name": project_name,
+                            "updated_at": datetime.datetime.utcnow()  # ✅ Update timestamp
+                        }}
+                    )
                 response_message = "Project updated successfully"
                 status_code = 200
                 
@@ -167,23 +174,26 @@ def save_project():
                 canvas_image_path = f"{CANVAS_IMG_FOLDER}{filename}"
 
                 print('canvas id', original_image_path)
-                cloud_org_result = upload(
-                    original_image_file,
-                    public_id=original_image_path,  # This sets the folder and filename
-                    overwrite=True  # Optional: allows overwriting if file with same ID exists
-                )
-
-                cloud_inter_result = upload(
-                    inter_image_file,
-                    public_id=inter_image_path,  # This sets the folder and filename
-                    overwrite=True  # Optional: allows overwriting if file with same ID exists
-                )
-
-                cloud_canvas_result = upload(
-                    canvas_image_file,
-                    public_id=canvas_image_path,  # This sets the folder and filename
-                    overwrite=True  # Optional: allows overwriting if file with same ID exists
-                )
+                with span("storage_upload"):
+                    cloud_org_result = upload(
+                        original_image_file,
+                        public_id=original_image_path,  # This sets the folder and filename
+                        overwrite=True  # Optional: allows overwriting if file with same ID exists
+                    )
+
+                with span("storage_upload"):
+                    cloud_inter_result = upload(
+                        inter_image_file,
+                        public_id=inter_image_path,  # This sets the folder and filename
+                        overwrite=True  # Optional: allows overwriting if file with same ID exists
+                    )
+
+                with span("storage_upload"):
+                    cloud_canvas_result = upload(
+                        canvas_image_file,
+                        public_id=canvas_image_path,  # This sets the folder and filename
+                        overwrite=True  # Optional: allows overwriting if file with same ID exists
+                    )
 
                 #  Update the image URL in canvas JSON
                 for obj in canvas_data.get("objects", []):
@@ -228,9 +238,10 @@ def save_project():
                     if obj.get("type").lower() == "image":
                         obj["src"] = os.getenv("BACKEND_SERVER") + "/server/static/" + user_id +  "/inter/" + image_filename
 
-                original_image_file.save(original_image_path)
-                inter_image_file.save(inter_image_path)
-                canvas_image_file.save(canvas_image_path)
+                with span("storage_write"):
+                    original_image_file.save(original_image_path)
+                    inter_image_file.save(inter_image_path)
+                    canvas_image_file.save(canvas_image_path)
                         # Create a new project
                 new_project = {
                     "user_id": user_id,
@@ -259,7 +270,8 @@ def save_project():
         
           
 
-            projects_collection.insert_one(new_project)
+            with span("db_write"):
+                projects_collection.insert_one(new_project)
             response_message = "Project created successfully"
             status_code = 201
 
@@ -483,7 +495,8 @@ def delete_project(project_id):
         user_id = str(g._id)  # Extracted by the middleware
 
         # Delete the project from the collection
-        result = projects_collection.delete_one({"project_id": project_id})
+        with span("db_write"):
+            result = projects_collection.delete_one({"project_id": project_id})
         # delete embedding of the project from collection
         # result_emb = embedding_collection.delete_one({"project_id": project_id}) 
 
@@ -505,18 +518,20 @@ def delete_project(project_id):
             print('canvas id', original_image_path)
 
     
-            destroy(original_image_path, resource_type = "image")
-            destroy(inter_image_path, resource_type = "image")
-            destroy(canvas_image_path, resource_type = "image")
+            with span("storage_delete"):
+                destroy(original_image_path, resource_type = "image")
+                destroy(inter_image_path, resource_type = "image")
+                destroy(canvas_image_path, resource_type = "image")
         else:
             _, ORG_IMG_FOLDER,CANVAS_IMG_FOLDER, INTER_IMG_FOLDER=  get_user_paths(os.getenv("USER_COMMON_PATH"), user_id)
             original_image_path = f"{ORG_IMG_FOLDER}/{image_filename}"
             inter_image_path = f"{INTER_IMG_FOLDER}/{image_filename}"
             canvas_image_path = f"{CANVAS_IMG_FOLDER}/{image_filename}"
 
-            for path in [original_image_path, canvas_image_path, inter_image_path]:
-                if os.path.exists(path):
-                    os.remove(path)
+            with span("storage_delete"):
+                for path in [original_image_path, canvas_image_path, inter_image_path]:
+                    if os.path.exists(path):
+                        os.remove(path)
 
         return jsonify({"success": True, "message": "Project deleted successfully"}), 200
 
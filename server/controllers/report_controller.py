@@ -9,6 +9,7 @@ from utils.common import get_user_paths, create_user_paths
 import shutil
 from utils.common import get_user_paths
 from cloudinary.uploader import upload, destroy
+from utils.style_bank import style_bank, compute_style_stats, style_stats_to_document
 import json
 load_dotenv()
 
@@ -387,6 +388,10 @@ def add_style_img():
             image_name = request.form.get("imageName")
 
             image_filename = secure_filename(f"{image_id}.png")
+
+            # precompute the style statistics once so style transfer requests can refer to the style by id
+            style_stats = compute_style_stats(style_image.read())
+            style_image.stream.seek(0)
             
             if(os.getenv("DEPLOY_PRODUCTION").lower() == 'false'):
                 image_path = f"{STYLE_IMG_FOLDER}/{image_filename}"
@@ -406,10 +411,12 @@ def add_style_img():
                 "image_id": image_id,
                 "image_name": image_name,
                 "image_url": image_url,
-                "created_at": datetime.datetime.utcnow()
+                "created_at": datetime.datetime.utcnow(),
+                **style_stats_to_document(style_stats)
             }
 
             style_image_collection.insert_one(new_style_image)
+            style_bank.add(image_id, style_stats)
       
             return jsonify({
                 "success": True, 
@@ -457,6 +464,7 @@ def delete_style_img(image_id):
                 
         
             style_image_collection.delete_one({"image_id": image_id})
+            style_bank.remove(image_id)
             
 
             
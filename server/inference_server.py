@@ -0,0 +1,208 @@
+"""
+Dedicated inference service, runs the models in a pool of worker processes separate from the
+flask workers. Every worker loads the models once and pins its intra-op threads so the workers
+share the cores instead of oversubscribing them. The flask workers send the model calls over a
+unix socket (utils/inference_service.py) and the tensors through shared memory.
+
+usage (from the server folder):
+    INFERENCE_SERVICE_ADDRESS=/tmp/imagecraft-inference.sock python inference_server.py
+and start the flask workers with the same INFERENCE_SERVICE_ADDRESS.
+"""
+import os
+
+# the processes of the service load the real models instead of the proxies
+os.environ["INFERENCE_SERVICE_WORKER"] = "true"
+
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Listener
+import torch
+from model_config import CFG
+from utils.inference_service import ALLOWED_METHODS, pack_tensors, unpack_tensors
+
+
+def worker_main(worker_id, jobs, results, num_threads):
+    torch.set_num_threads(num_threads)
+    from models.model_registry import model_registry
+    model_registry.preload()
+    print(f"Inference worker {worker_id} ready ({num_threads} threads)")
+    model_registry.memory_report()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, model_name, method, args, kwargs = job
+        results.put(("started", worker_id, job_id))
+        try:
+            if method not in ALLOWED_METHODS.get(model_name, ()):
+                raise ValueError(f"{model_name}.{method} can not be called through the inference service")
+
+            # the input blocks belong to the client, the output blocks are unlinked by the client
+            args, kwargs = unpack_tensors(args, track=False), unpack_tensors(kwargs, track=False)
+            model = model_registry.get(model_name)
+            with torch.no_grad():
+                output = getattr(model, method)(*args, **kwargs)
+
+            blocks = []
+            results.put(("done", worker_id, job_id, True, pack_tensors(output, blocks, track=False)))
+            for shm in blocks:
+                shm.close()
+        except Exception as e:
+            results.put(("done", worker_id, job_id, False, str(e)))
+
+
+class InferenceServer:
+    def __init__(self, address, authkey, num_workers, threads_per_worker, request_timeout=600):
+        self.address = address
+        self.authkey = authkey
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.request_timeout = request_timeout
+
+        self.ctx = mp.get_context("spawn")
+        self.jobs = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        self.workers = {}
+        # job run by every worker, guarded by lock (filled by the dispatcher, read by the monitor)
+        self.running_jobs = {}
+        self.pending = {}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.started_at = time.time()
+
+    def start_worker(self, worker_id):
+        process = self.ctx.Process(
+            target=worker_main, args=(worker_id, self.jobs, self.results, self.threads_per_worker), daemon=True
+        )
+        process.start()
+        self.workers[worker_id] = process
+
+    def finish_job(self, job_id, ok, payload):
+        with self.lock:
+            future = self.pending.pop(job_id, None)
+            # a job is counted once, by whoever resolves it (result, crash or timeout)
+            if future is not None:
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+        if future is not None:
+            future.set_result((ok, payload))
+        elif ok:
+            # the request already timed out, free the output blocks nobody will read
+            unpack_tensors(payload, unlink=True)
+
+    def dispatch_results(self):
+        while True:
+            message = self.results.get()
+            if message[0] == "started":
+                _, worker_id, job_id = message
+                with self.lock:
+                    self.running_jobs[worker_id] = job_id
+            else:
+                _, worker_id, job_id, ok, payload = message
+                with self.lock:
+                    if self.running_jobs.get(worker_id) == job_id:
+                        del self.running_jobs[worker_id]
+                self.finish_job(job_id, ok, payload)
+
+    def monitor_workers(self):
+        while True:
+            time.sleep(1)
+            for worker_id, process in list(self.workers.items()):
+                if process.is_alive():
+                    continue
+
+                print(f"Inference worker {worker_id} exited with code {process.exitcode}, restarting")
+                with self.lock:
+                    job_id = self.running_jobs.pop(worker_id, None)
+                # a job whose "started" message was not dispatched yet is failed by the request timeout
+                if job_id is not None:
+                    self.finish_job(job_id, False, f"inference worker {worker_id} crashed")
+                self.restarts += 1
+                self.start_worker(worker_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.num_workers,
+                "workers_alive": sum(p.is_alive() for p in self.workers.values()),
+                "threads_per_worker": self.threads_per_worker,
+                "in_flight": len(self.pending),
+                "running": len(self.running_jobs),
+                "queue_depth": self.jobs.qsize(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "restarts": self.restarts,
+                "uptime_sec": round(time.time() - self.started_at, 1),
+            }
+
+    def handle_connection(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+
+                if request[0] == "stats":
+                    conn.send((True, self.stats()))
+                    continue
+
+                _, model_name, method, args, kwargs = request
+                job_id = next(self.job_ids)
+                future = Future()
+                with self.lock:
+                    self.pending[job_id] = future
+                self.jobs.put((job_id, model_name, method, args, kwargs))
+                try:
+                    conn.send(future.result(timeout=self.request_timeout))
+                except FutureTimeoutError:
+                    self.finish_job(job_id, False, f"inference request timed out after {self.request_timeout:.0f}s")
+                    conn.send(future.result())
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        for worker_id in range(self.num_workers):
+            self.start_worker(worker_id)
+        threading.Thread(target=self.dispatch_results, daemon=True).start()
+        threading.Thread(target=self.monitor_workers, daemon=True).start()
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            print(f"Inference service listening on {self.address} with {self.num_workers} workers")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, mp.AuthenticationError) as e:
+                    # failed handshake (e.g. wrong authkey), keep serving the other clients
+                    print(f"Rejected inference service connection: {str(e)}")
+                    continue
+                threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    if not CFG.inference_service_address:
+        raise SystemExit("Set INFERENCE_SERVICE_ADDRESS to the unix socket path of the inference service")
+
+    server = InferenceServer(
+        CFG.inference_service_address, CFG.inference_service_authkey.encode(), CFG.inference_workers, CFG.inference_threads_per_worker,
+        request_timeout=CFG.inference_request_timeout,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        for _ in server.workers:
+            server.jobs.put(None)
@@ -7,6 +7,12 @@ from routes.image_proc_routes import image_proc_routes
 from routes.text_proc_routes import text_proc_routes
 from routes.subscription_route import subscription_routes
 from controllers.subscription_controller import stripe_webhook
+from models.model_registry import model_registry
+from utils.style_bank import style_bank
+from utils.job_queue import job_queue
+from utils.server_timing import init_server_timing
+from utils.metrics import init_metrics, metrics_response
+from model_config import CFG
 from dotenv import load_dotenv
 import os 
 import cloudinary
@@ -38,12 +44,23 @@ CORS(app, resources={
     r"/*": {"origins": [os.getenv("FRONTEND_SERVER", "https://pixeltune-theta.vercel.app")]}  # Restrict all other routes (e.g., /api/*)
 }, supports_credentials=True)
 
+# per stage timings of every request in the Server-Timing header
+init_server_timing(app, allowed_origin=os.getenv("FRONTEND_SERVER", "https://pixeltune-theta.vercel.app"))
+# request counts, latency histograms and in flight gauges of every endpoint for /metrics
+init_metrics(app)
+
 
 @app.route('/')
 def index():
     return "<h1>Hello World</h1>"
 
 
+# prometheus metrics of all the worker processes (PROMETHEUS_MULTIPROC_DIR)
+@app.route('/metrics')
+def metrics():
+    return metrics_response()
+
+
 # gets the original image from the static folder
 @app.route('/server/static/<string:user_id>/original/<string:filename>')
 def get_original_image(user_id, filename):
@@ -97,6 +114,21 @@ app.register_blueprint(image_proc_routes)
 app.register_blueprint(text_proc_routes)
 app.register_blueprint(subscription_routes)
 
+# load the inference models once per worker at boot time
+if CFG.preload_models:
+    model_registry.preload()
+    # resident vs shared memory of the weights, the memory mapped weights are shared between the workers
+    model_registry.memory_report()
+
+# worker threads of the asynchronous super resolution / style transfer jobs
+job_queue.start()
+
+# load the precomputed statistics of the curated style images
+try:
+    style_bank.load()
+except Exception as e:
+    print(f"Failed to load the style bank: {str(e)}")
+
 # runs the server on port 5000
 if __name__ == "__main__":
     if(os.getenv("DEPLOY_PRODUCTION").lower() == 'true'):
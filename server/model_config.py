@@ -14,5 +14,131 @@ class CFG:
     super_resolution_x2_model_path = os.path.join(backend_dir, "weights", "edsr_scale2_3500.pth")
     super_resolution_x4_model_path = os.path.join(backend_dir, "weights", "edsr_scale4_last_checkpoint_4000.pth")
     super_resolution_model_path = os.path.join(backend_dir, "weights", "mdsr_8000.pth")
-    
 
+    # load every inference model when the worker boots instead of on the first request
+    preload_models = os.getenv("PRELOAD_MODELS", "false").lower() == "true"
+
+    # micro-batching of concurrent style transfer requests
+    style_batching = os.getenv("STYLE_BATCHING", "true").lower() == "true"
+    style_batch_max_size = int(os.getenv("STYLE_BATCH_MAX_SIZE", 8))
+    style_batch_wait_ms = float(os.getenv("STYLE_BATCH_WAIT_MS", 10))
+
+    # tiled super resolution, images larger than the tile size are upscaled tile by tile (0 disables tiling)
+    super_resolution_tile_size = int(os.getenv("SR_TILE_SIZE", 256))
+    super_resolution_tile_overlap = int(os.getenv("SR_TILE_OVERLAP", 16))
+    super_resolution_tile_workers = int(os.getenv("SR_TILE_WORKERS", 1))
+
+    # cache of the relu4_1 mean/std of style images keyed by the hash of the uploaded bytes
+    style_stats_cache_mb = float(os.getenv("STYLE_STATS_CACHE_MB", 16))
+    style_stats_cache_dir = os.getenv("STYLE_STATS_CACHE_DIR") or None
+
+    # maximum number of alpha values which can be stylized in a single request
+    style_max_alphas = int(os.getenv("STYLE_MAX_ALPHAS", 8))
+
+    # short lived cache of the encoder output of content images for iterative style edits
+    content_features_cache_mb = float(os.getenv("CONTENT_FEATURES_CACHE_MB", 256))
+    content_features_cache_ttl = float(os.getenv("CONTENT_FEATURES_CACHE_TTL", 600))
+
+    # precision of the style transfer and super resolution models, "fp32" or "int8" (cpu only)
+    inference_precision = os.getenv("INFERENCE_PRECISION", "fp32").lower()
+    quantized_weights_dir = os.getenv("QUANTIZED_WEIGHTS_DIR", os.path.join(backend_dir, "weights", "int8"))
+
+    # compile the fp32 models when they are loaded, "none", "trace" (TorchScript, cached on disk) or "torch_compile"
+    compile_mode = os.getenv("COMPILE_MODE", "none").lower()
+    compiled_models_dir = os.getenv("COMPILED_MODELS_DIR", os.path.join(backend_dir, "weights", "compiled"))
+
+    # runtime of the inference models, "torch" or "onnxruntime" (cpu, models exported with scripts/export_onnx.py)
+    inference_backend = os.getenv("INFERENCE_BACKEND", "torch").lower()
+    onnx_models_dir = os.getenv("ONNX_MODELS_DIR", os.path.join(backend_dir, "weights", "onnx"))
+    onnx_num_threads = int(os.getenv("ONNX_NUM_THREADS", 0))
+
+    # cpu execution mode of the fp32 torch models, "fp32", "channels_last" or "bf16" (channels_last + bfloat16 autocast)
+    execution_mode = os.getenv("EXECUTION_MODE", "fp32").lower()
+    # minimum PSNR (dB) against the fp32 output for the optimized execution mode to be kept
+    execution_min_psnr = float(os.getenv("EXECUTION_MIN_PSNR", 35))
+
+    # dedicated inference service (inference_server.py), when the unix socket address is set the web
+    # workers forward every model call to the service instead of loading the models themselves
+    inference_service_address = os.getenv("INFERENCE_SERVICE_ADDRESS") or None
+    inference_service_authkey = os.getenv("INFERENCE_SERVICE_AUTHKEY", "imagecraft-inference")
+    inference_workers = int(os.getenv("INFERENCE_WORKERS", 2))
+    # intra-op threads of every inference worker, by default the cores are split evenly between the workers
+    inference_threads_per_worker = int(os.getenv("INFERENCE_THREADS_PER_WORKER", 0)) or max(1, (os.cpu_count() or 1) // max(1, inference_workers))
+    # model calls taking longer fail (lost or stuck jobs), the web workers give up a bit later
+    inference_request_timeout = float(os.getenv("INFERENCE_REQUEST_TIMEOUT", 600))
+    # set by inference_server.py in its worker processes, they load the real models
+    inference_service_worker = os.getenv("INFERENCE_SERVICE_WORKER", "false").lower() == "true"
+    # intra-op threads of the web workers when the models run in the inference service
+    web_worker_threads = int(os.getenv("WEB_WORKER_THREADS", 1))
+
+    # asynchronous super resolution / style transfer jobs (sqlite + filesystem queue)
+    jobs_dir = os.getenv("JOBS_DIR", os.path.join(backend_dir, "jobs"))
+    # job worker threads per process, 0 only accepts jobs (another process runs them)
+    job_workers = int(os.getenv("JOB_WORKERS", 1))
+    job_result_ttl = float(os.getenv("JOB_RESULT_TTL", 3600))
+    job_timeout = float(os.getenv("JOB_TIMEOUT", 900))
+    # maximum time a status request waits for the job to finish (long polling)
+    job_max_wait = float(os.getenv("JOB_MAX_WAIT", 30))
+
+    # cache of the encoded style transfer / super resolution outputs keyed by the input hashes and parameters
+    result_cache_mb = float(os.getenv("RESULT_CACHE_MB", 128))
+    result_cache_dir = os.getenv("RESULT_CACHE_DIR") or None
+    result_cache_disk_mb = float(os.getenv("RESULT_CACHE_DISK_MB", 1024))
+    # "charge": cached results count against the style/upscale quota like a model run, "free": only model runs count
+    result_cache_quota = os.getenv("RESULT_CACHE_QUOTA", "charge").lower()
+
+    # memory map the converted checkpoints (scripts/convert_checkpoints.py) so the worker processes share the weights
+    mmap_weights = os.getenv("MMAP_WEIGHTS", "true").lower() == "true"
+    mmap_weights_dir = os.getenv("MMAP_WEIGHTS_DIR", os.path.join(backend_dir, "weights", "mmap"))
+
+    # super resolution tiers: "quality" runs the 80 block MDSR, "fast" the single scale EDSR models (x2, x4),
+    # "auto" picks the fast tier for large inputs or when the super resolution queue is busy
+    super_resolution_tier = os.getenv("SR_TIER", "auto").lower()
+    edsr_num_res_blocks = int(os.getenv("EDSR_NUM_RES_BLOCKS", 16))
+    super_resolution_fast_megapixels = float(os.getenv("SR_FAST_MEGAPIXELS", 1.0))
+    super_resolution_fast_queue_depth = int(os.getenv("SR_FAST_QUEUE_DEPTH", 2))
+
+    # latency budget of style transfer, the largest content resolution whose predicted p95 latency fits is used (0 disables)
+    style_latency_target_ms = float(os.getenv("STYLE_LATENCY_TARGET_MS", 0))
+    # content resolutions (shorter side) the latency budget can fall back to
+    style_adaptive_sizes = [int(size) for size in os.getenv("STYLE_ADAPTIVE_SIZES", "1024,768,512,384,256").split(",")]
+    # requests predicted above target * factor even at the smallest resolution get a 503 (0 never rejects)
+    style_latency_shed_factor = float(os.getenv("STYLE_LATENCY_SHED_FACTOR", 2.0))
+
+    # binary image responses (Accept: image/*), "auto" sends webp for outputs of at least image_webp_min_megapixels, png otherwise
+    image_response_format = os.getenv("IMAGE_RESPONSE_FORMAT", "auto").lower()
+    image_webp_min_megapixels = float(os.getenv("IMAGE_WEBP_MIN_MEGAPIXELS", 2.0))
+    image_webp_quality = int(os.getenv("IMAGE_WEBP_QUALITY", 90))
+    image_webp_lossless = os.getenv("IMAGE_WEBP_LOSSLESS", "false").lower() == "true"
+    image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", 90))
+    image_png_compress_level = int(os.getenv("IMAGE_PNG_COMPRESS_LEVEL", 6))
+
+    # image ingest: uploads above max_image_pixels are rejected from the header before decoding (decompression bombs),
+    # images resized later are decoded at the nearest smaller JPEG scale (draft) or box reduced
+    max_image_pixels = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+    ingest_draft = os.getenv("INGEST_DRAFT", "true").lower() == "true"
+
+    # bearer token required by /metrics (empty: open, restrict it at the load balancer)
+    metrics_token = os.getenv("METRICS_TOKEN", "")
+
+    # admission control of the synchronous style transfer / super resolution requests of a process, requests over the
+    # limits wait in a bounded queue and get a 429 (user limits) or 503 (queue full or waited too long), 0 disables a limit
+    admission_max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", 4))
+    # estimated peak memory of the admitted requests (see utils/admission.py)
+    admission_max_memory_mb = float(os.getenv("ADMISSION_MAX_MEMORY_MB", 4096))
+    admission_max_per_user = int(os.getenv("ADMISSION_MAX_PER_USER", 2))
+    admission_max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", 16))
+    admission_max_queued_per_user = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", 2))
+    admission_max_wait = float(os.getenv("ADMISSION_MAX_WAIT", 30))
+    # weighted fair queuing of the waiting requests between the subscription plans, other plans are scheduled as "pro"
+    admission_tier_weights = os.getenv("ADMISSION_TIER_WEIGHTS", "ultimate:4,pro:1")
+    # requests waiting longer are admitted first whatever their plan (0 disables the starvation protection)
+    admission_starvation_after = float(os.getenv("ADMISSION_STARVATION_AFTER", 10))
+
+    # torch profiler captures: admins send profile=true with a request, or a fraction of the requests is sampled
+    profile_dir = os.getenv("PROFILE_DIR", os.path.join(backend_dir, "traces"))
+    profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+    # retention of the captured traces, the oldest are deleted first
+    profile_max_traces = int(os.getenv("PROFILE_MAX_TRACES", 50))
+    profile_max_age_hours = float(os.getenv("PROFILE_MAX_AGE_HOURS", 72))
+    profile_max_mb = float(os.getenv("PROFILE_MAX_MB", 1024))
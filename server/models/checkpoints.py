@@ -0,0 +1,129 @@
+import os
+import torch
+from model_config import CFG
+
+
+def get_mmap_checkpoint_path(path):
+    return os.path.join(CFG.mmap_weights_dir, os.path.splitext(os.path.basename(path))[0] + ".pt")
+
+
+def get_state_dict(checkpoint, key=None):
+    """
+    Returns checkpoint[key] for training checkpoints which wrap the state dict, the checkpoint itself otherwise
+    """
+    if key is not None and key in checkpoint:
+        return checkpoint[key]
+    return checkpoint
+
+
+def convert_checkpoint(path, key=None):
+    """
+    Saves the (contiguous, cpu) state dict of the checkpoint in the zip format torch.load can memory map,
+    optimizer states and other training leftovers of the checkpoint are dropped
+    """
+    state_dict = get_state_dict(torch.load(path, map_location="cpu", weights_only=True), key)
+    state_dict = {name: tensor.contiguous() for name, tensor in state_dict.items()}
+
+    os.makedirs(CFG.mmap_weights_dir, exist_ok=True)
+    mmap_path = get_mmap_checkpoint_path(path)
+    tmp_path = f"{mmap_path}.{os.getpid()}.tmp"
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, mmap_path)
+    return mmap_path
+
+
+def can_mmap(path):
+    if not CFG.mmap_weights or CFG.device != "cpu":
+        return False
+
+    mmap_path = get_mmap_checkpoint_path(path)
+    if not os.path.exists(mmap_path):
+        return False
+    if os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(mmap_path):
+        print(f"{mmap_path} is older than {path}, run scripts/convert_checkpoints.py again")
+        return False
+    return True
+
+
+def load_weights(module, path, key=None):
+    """
+    Loads the checkpoint into the module. When a converted checkpoint exists (scripts/convert_checkpoints.py)
+    the file is memory mapped and the parameters point straight into the mapping, so every worker process
+    shares the same page cache pages instead of holding a private copy of the weights. The models are
+    frozen, so the copy-on-write mapping is never written to.
+
+    returns the module and the path of the mapped file (None when the checkpoint was read into memory)
+    """
+    if can_mmap(path):
+        mmap_path = get_mmap_checkpoint_path(path)
+        state_dict = torch.load(mmap_path, map_location="cpu", weights_only=True, mmap=True)
+        module.load_state_dict(state_dict, assign=True)
+        return module, mmap_path
+
+    state_dict = torch.load(path, map_location=CFG.device, weights_only=True)
+    module.load_state_dict(get_state_dict(state_dict, key))
+    return module, None
+
+
+def parse_smaps(smaps_path="/proc/self/smaps"):
+    """
+    Returns {mapped file: {"rss": bytes, "shared": bytes, "private": bytes, "pss": bytes}}, empty when smaps is not available
+    """
+    mappings = {}
+    current = None
+    try:
+        with open(smaps_path) as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if "-" in fields[0] and not fields[0].endswith(":"):
+                    # header line of a mapping: address perms offset dev inode [path]
+                    current = mappings.setdefault(fields[5], {"rss": 0, "shared": 0, "private": 0, "pss": 0}) if len(fields) > 5 else None
+                elif current is not None and fields[0] in ("Rss:", "Pss:", "Shared_Clean:", "Shared_Dirty:", "Private_Clean:", "Private_Dirty:"):
+                    value = int(fields[1]) * 1024
+                    if fields[0] == "Rss:":
+                        current["rss"] += value
+                    elif fields[0] == "Pss:":
+                        current["pss"] += value
+                    elif fields[0].startswith("Shared"):
+                        current["shared"] += value
+                    else:
+                        current["private"] += value
+    except OSError:
+        return {}
+    return mappings
+
+
+def get_process_memory():
+    """
+    Resident, proportional and shared memory of the whole process (/proc/self/smaps_rollup)
+    """
+    memory = {"rss": 0, "pss": 0, "shared": 0, "private": 0}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] == "Rss:":
+                    memory["rss"] = int(fields[1]) * 1024
+                elif fields[0] == "Pss:":
+                    memory["pss"] = int(fields[1]) * 1024
+                elif fields[0] in ("Shared_Clean:", "Shared_Dirty:"):
+                    memory["shared"] += int(fields[1]) * 1024
+                elif fields[0] in ("Private_Clean:", "Private_Dirty:"):
+                    memory["private"] += int(fields[1]) * 1024
+    except OSError:
+        return None
+    return memory
+
+
+def get_mapped_memory(paths, mappings=None):
+    """
+    Sums the smaps counters of the mappings of the given files
+    """
+    mappings = parse_smaps() if mappings is None else mappings
+    memory = {"rss": 0, "shared": 0, "private": 0, "pss": 0}
+    for path in paths:
+        for name, value in memory.items():
+            memory[name] = value + mappings.get(os.path.realpath(path), {}).get(name, 0)
+    return memory
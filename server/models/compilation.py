@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+import torch
+from torch import nn
+from model_config import CFG
+from models.quantization import SuperResolutionScale, ScaleDispatchMDSR
+
+
+COMPILE_MODES = ["none", "trace", "torch_compile"]
+
+if CFG.compile_mode == "torch_compile":
+    # keep inductor's compiled kernels next to the traced graphs so restarts reuse them
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(CFG.compiled_models_dir, "inductor"))
+
+
+def get_size_bucket(size):
+    """
+    Maps a spatial size to the resize buckets used by the endpoints (512, 1024, anything larger)
+    """
+    if size <= 512:
+        return "512"
+    elif size <= 1024:
+        return "1024"
+    return "full"
+
+
+def get_checkpoint_fingerprint(*paths):
+    """
+    Short hash of the checkpoints and torch version, compiled graphs are rebuilt when either changes
+    """
+    digest = hashlib.sha256(torch.__version__.encode())
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}|{stat.st_size}|{stat.st_mtime}".encode())
+    return digest.hexdigest()[:12]
+
+
+class CompiledModule(nn.Module):
+    """
+    Runs a module through one compiled graph per input size bucket and falls back to eager mode
+    when compiling (or running the compiled graph) fails. The graphs only contain shape agnostic
+    conv/pool/upsample ops, so a graph traced for one shape also runs the other shapes of its bucket.
+
+    With the "trace" mode every bucket is traced with TorchScript, frozen and saved to
+    `CFG.compiled_models_dir` so the next start only loads the file. With the "torch_compile"
+    mode the graph is compiled with torch.compile and inductor's on-disk cache is used instead.
+    """
+
+    def __init__(self, module, name, bucket_fn, fingerprint, mode=None):
+        super().__init__()
+        self.module = module
+        self.name = name
+        self.bucket_fn = bucket_fn
+        self.fingerprint = fingerprint
+        self.mode = mode or CFG.compile_mode
+        self._graphs = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def _graph_path(self, bucket):
+        return os.path.join(CFG.compiled_models_dir, f"{self.name}_{bucket}_{self.fingerprint}.pt")
+
+    def _compile(self, bucket, example_inputs):
+        if self.mode == "torch_compile":
+            return torch.compile(self.module)
+
+        path = self._graph_path(bucket)
+        if os.path.exists(path):
+            return torch.jit.load(path, map_location=CFG.device)
+
+        with torch.no_grad():
+            traced = torch.jit.trace(self.module, example_inputs, strict=False)
+            graph = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+        os.makedirs(CFG.compiled_models_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.jit.save(graph, tmp_path)
+        os.replace(tmp_path, path)
+        return graph
+
+    def get_graph(self, *inputs):
+        bucket = self.bucket_fn(*inputs)
+        graph = self._graphs.get(bucket)
+        if graph is not None or bucket in self._failed:
+            return bucket, graph
+
+        with self._lock:
+            if bucket not in self._graphs and bucket not in self._failed:
+                try:
+                    self._graphs[bucket] = self._compile(bucket, inputs)
+                    print(f"Compiled {self.name} for bucket {bucket} ({self.mode})")
+                except Exception as e:
+                    print(f"Compiling {self.name} for bucket {bucket} failed, using eager mode: {str(e)}")
+                    self._failed.add(bucket)
+
+        return bucket, self._graphs.get(bucket)
+
+    def warmup(self, *example_inputs):
+        bucket, graph = self.get_graph(*example_inputs)
+        if graph is not None:
+            self.forward(*example_inputs)
+        return bucket not in self._failed
+
+    def forward(self, *inputs):
+        bucket, graph = self.get_graph(*inputs)
+        if graph is None:
+            return self.module(*inputs)
+
+        try:
+            return graph(*inputs)
+        except Exception as e:
+            print(f"Compiled {self.name} failed for bucket {bucket}, using eager mode: {str(e)}")
+            with self._lock:
+                self._graphs.pop(bucket, None)
+                self._failed.add(bucket)
+            return self.module(*inputs)
+
+    def compiled_buckets(self):
+        return sorted(self._graphs)
+
+
+def compile_style_transfer_model(model, warmup_sizes=(512, 1024)):
+    """
+    Wraps the encoder and decoder of the style transfer network with compiled graphs, one per size bucket
+    """
+    fingerprint = get_checkpoint_fingerprint(CFG.style_transfer_encoder_path, CFG.style_transfer_decoder_path)
+    model.encoder = CompiledModule(
+        model.encoder, "vgg_encoder", lambda x: get_size_bucket(min(x.shape[-2:])), fingerprint,
+    )
+    # the decoder input is 8 times smaller than the image
+    model.decoder = CompiledModule(
+        model.decoder, "vgg_decoder", lambda t: get_size_bucket(8 * min(t.shape[-2:])), fingerprint,
+    )
+
+    with torch.no_grad():
+        for size in warmup_sizes:
+            x = torch.rand(1, 3, size, size, device=CFG.device)
+            model.encoder.warmup(x)
+            model.decoder.warmup(torch.rand(1, 512, size // 8, size // 8, device=CFG.device))
+
+    return model
+
+
+def compile_super_resolution_model(model, warmup_size=None):
+    """
+    Builds one compiled graph per scale (and input size bucket) of the multi-scale MDSR
+    """
+    fingerprint = get_checkpoint_fingerprint(CFG.super_resolution_model_path)
+    warmup_size = warmup_size or CFG.super_resolution_tile_size or 256
+
+    compiled = {}
+    for scale in model.scales:
+        compiled[scale] = CompiledModule(
+            SuperResolutionScale(model, scale), f"mdsr_x{scale}", lambda x: get_size_bucket(max(x.shape[-2:])), fingerprint,
+        )
+        with torch.no_grad():
+            compiled[scale].warmup(torch.rand(1, 3, warmup_size, warmup_size, device=CFG.device) * 255)
+
+    return ScaleDispatchMDSR(compiled)
@@ -0,0 +1,114 @@
+import torch
+from torch import nn
+from model_config import CFG
+from models.quantization import SuperResolutionScale, ScaleDispatchMDSR
+from utils.image_quality import calculate_psnr
+
+
+EXECUTION_MODES = ["fp32", "channels_last", "bf16"]
+
+
+def is_bf16_supported():
+    """
+    True when oneDNN can run bfloat16 kernels natively on this cpu (avx512_bf16 / amx)
+    """
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
+
+
+def get_execution_mode():
+    """
+    Returns the execution mode the models should use, falling back to fp32 when bf16 is not supported
+    """
+    mode = CFG.execution_mode
+    if mode not in EXECUTION_MODES:
+        print(f"Unknown execution mode {mode}, using fp32")
+        return "fp32"
+
+    if mode != "fp32" and CFG.device != "cpu":
+        return "fp32"
+
+    if mode == "bf16" and not is_bf16_supported():
+        print("bfloat16 is not supported on this cpu, falling back to fp32")
+        return "fp32"
+
+    return mode
+
+
+def to_float32(output):
+    if isinstance(output, dict):
+        return {k: to_float32(v) for k, v in output.items()}
+    return output.float().contiguous()
+
+
+class OptimizedExecution(nn.Module):
+    """
+    Runs the wrapped module on channels_last inputs, optionally under cpu bfloat16 autocast.
+    Outputs are returned as contiguous fp32 tensors so the surrounding code is unchanged.
+    """
+
+    def __init__(self, module, bf16=False):
+        super().__init__()
+        self.module = module.to(memory_format=torch.channels_last)
+        self.bf16 = bf16
+
+    def forward(self, *inputs):
+        inputs = [x.contiguous(memory_format=torch.channels_last) if isinstance(x, torch.Tensor) and x.dim() == 4 else x for x in inputs]
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+            return to_float32(self.module(*inputs))
+
+
+def get_guard_image(height=256, width=256):
+    """
+    Deterministic test image (smooth gradients plus texture) used to compare the execution modes
+    """
+    generator = torch.Generator().manual_seed(0)
+    y = torch.linspace(0, 1, height).view(-1, 1).expand(height, width)
+    x = torch.linspace(0, 1, width).view(1, -1).expand(height, width)
+    img = torch.stack([x, y, (x + y) / 2]) * 0.8 + torch.rand(3, height, width, generator=generator) * 0.2
+    return img.unsqueeze(0).to(CFG.device)
+
+
+def passes_quality_guard(reference, optimized, name):
+    psnr = calculate_psnr(reference, optimized)
+    if psnr < CFG.execution_min_psnr:
+        print(f"{name} output in the optimized execution mode has a PSNR of {psnr:.2f}dB against fp32 (< {CFG.execution_min_psnr}dB), falling back to fp32")
+        return False
+    print(f"{name} optimized execution mode PSNR against fp32: {psnr:.2f}dB")
+    return True
+
+
+def optimize_style_transfer_model(model, mode):
+    encoder, decoder = model.encoder, model.decoder
+    img = get_guard_image()
+    style_mean, style_std = torch.ones(1, 512, 1, 1, device=img.device), torch.ones(1, 512, 1, 1, device=img.device)
+
+    with torch.no_grad():
+        reference = model.stylize_image_with_stats(img, style_mean, style_std, alpha=1.0)
+        model.encoder = OptimizedExecution(encoder, bf16=mode == "bf16")
+        model.decoder = OptimizedExecution(decoder, bf16=mode == "bf16")
+        optimized = model.stylize_image_with_stats(img, style_mean, style_std, alpha=1.0)
+
+    if not passes_quality_guard(reference, optimized, "style transfer"):
+        model.encoder, model.decoder = encoder.to(memory_format=torch.contiguous_format), decoder.to(memory_format=torch.contiguous_format)
+        return model, "fp32"
+
+    return model, mode
+
+
+def optimize_super_resolution_model(model, mode):
+    img = get_guard_image(64, 64) * 255
+
+    optimized_model = ScaleDispatchMDSR({s: OptimizedExecution(SuperResolutionScale(model, s), bf16=mode == "bf16") for s in model.scales})
+    # every scale has its own head and upsampler, each of them has to pass the guard
+    for scale in model.scales:
+        with torch.no_grad():
+            reference = torch.clip(model(img, scale), 0, 255) / 255
+            optimized = torch.clip(optimized_model(img, scale), 0, 255) / 255
+
+        if not passes_quality_guard(reference, optimized, f"super resolution x{scale}"):
+            return model.to(memory_format=torch.contiguous_format), "fp32"
+
+    return optimized_model, mode
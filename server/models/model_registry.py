@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+import torch
+from torchvision import models
+from model_config import CFG
+from models.style_transfer import VGG_ENCODER, VGG_DECODER, Network
+from models.super_resolution_model import MDSR, EDSR
+from models.quantization import (
+    get_inference_precision, load_quantized_model, ScaleDispatchMDSR, QUANTIZED_ENCODER_FILE,
+    QUANTIZED_DECODER_FILE, SUPER_RESOLUTION_SCALES, get_quantized_mdsr_file
+)
+from models.compilation import compile_style_transfer_model, compile_super_resolution_model
+from models.execution import get_execution_mode, optimize_style_transfer_model, optimize_super_resolution_model
+from models.checkpoints import load_weights, get_state_dict, get_mapped_memory, get_process_memory, parse_smaps
+from models.onnx_backend import (
+    get_inference_backend, OnnxModule, OnnxEncoder, SimilarityTrunk, ONNX_ENCODER_FILE, ONNX_DECODER_FILE, ONNX_SIMILARITY_FILE,
+    ONNX_SUPER_RESOLUTION_SCALES, get_onnx_mdsr_file
+)
+
+
+def get_model_size(model):
+    """
+    Returns the number of bytes held by the weights and buffers of the model
+    """
+    # quantized modules keep their weights out of parameters() but still report them in the state dict
+    tensors = {t.data_ptr(): t for t in model.state_dict().values() if isinstance(t, torch.Tensor)}
+    return sum(t.numel() * t.element_size() for t in tensors.values())
+
+
+def freeze_model(model):
+    """
+    Puts the model in eval mode and disables gradients for all of its parameters
+    """
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad_(False)
+    return model
+
+
+def load_style_transfer_model(precision=None, compile_mode=None, backend=None):
+    if (backend or get_inference_backend()) == "onnxruntime":
+        style_transfer_model = Network(OnnxEncoder(ONNX_ENCODER_FILE), OnnxModule(ONNX_DECODER_FILE))
+        style_transfer_model.backend = "onnxruntime"
+        return style_transfer_model
+
+    if (precision or get_inference_precision()) == "int8":
+        style_transfer_model = Network(load_quantized_model(QUANTIZED_ENCODER_FILE), load_quantized_model(QUANTIZED_DECODER_FILE))
+        style_transfer_model.precision = "int8"
+        return style_transfer_model
+
+    vgg_encoder = VGG_ENCODER(CFG.style_transfer_encoder_path).to(CFG.device)
+    vgg_decoder = VGG_DECODER.to(CFG.device)
+    style_transfer_model = Network(vgg_encoder, vgg_decoder).to(CFG.device)
+    _, decoder_file = load_weights(style_transfer_model.decoder, CFG.style_transfer_decoder_path)
+    style_transfer_model.mapped_files = [f for f in (vgg_encoder.mapped_file, decoder_file) if f]
+
+    execution_mode = get_execution_mode()
+    if execution_mode != "fp32":
+        style_transfer_model, execution_mode = optimize_style_transfer_model(freeze_model(style_transfer_model), execution_mode)
+
+    if (compile_mode or CFG.compile_mode) != "none":
+        style_transfer_model = compile_style_transfer_model(freeze_model(style_transfer_model))
+        style_transfer_model.compile_mode = compile_mode or CFG.compile_mode
+    style_transfer_model.execution_mode = execution_mode
+    return style_transfer_model
+
+
+def load_super_resolution_model(precision=None, compile_mode=None, backend=None):
+    if (backend or get_inference_backend()) == "onnxruntime":
+        model = ScaleDispatchMDSR({s: OnnxModule(get_onnx_mdsr_file(s)) for s in ONNX_SUPER_RESOLUTION_SCALES})
+        model.backend = "onnxruntime"
+        return model
+
+    if (precision or get_inference_precision()) == "int8":
+        model = ScaleDispatchMDSR({s: load_quantized_model(get_quantized_mdsr_file(s)) for s in SUPER_RESOLUTION_SCALES})
+        model.precision = "int8"
+        return model
+
+    model = MDSR(num_res_blocks=80, num_feats=64, scales=[2, 3, 4]).to(CFG.device)
+    _, mapped_file = load_weights(model, CFG.super_resolution_model_path, key='model_state')
+    mapped_files = [mapped_file] if mapped_file else []
+
+    execution_mode = get_execution_mode()
+    if execution_mode != "fp32":
+        model, execution_mode = optimize_super_resolution_model(freeze_model(model), execution_mode)
+
+    if (compile_mode or CFG.compile_mode) != "none":
+        model = compile_super_resolution_model(freeze_model(model))
+        model.compile_mode = compile_mode or CFG.compile_mode
+    model.execution_mode = execution_mode
+    model.mapped_files = mapped_files
+    return model
+
+
+_fast_super_resolution_paths = None
+_fast_super_resolution_lock = threading.Lock()
+
+
+def matches_checkpoint(module, path, key=None):
+    """
+    True when the checkpoint has exactly the parameter names and shapes of the module
+    """
+    state_dict = get_state_dict(torch.load(path, map_location="cpu", weights_only=True), key)
+    expected = {name: tuple(tensor.shape) for name, tensor in module.state_dict().items()}
+    return expected == {name: tuple(tensor.shape) for name, tensor in state_dict.items()}
+
+
+def get_fast_super_resolution_paths():
+    """
+    Checkpoints of the single scale EDSR models of the fast tier by scale. Only the checkpoints which
+    exist and match the EDSR layout (EDSR_NUM_RES_BLOCKS) are returned, they are checked once per process.
+    """
+    global _fast_super_resolution_paths
+    with _fast_super_resolution_lock:
+        if _fast_super_resolution_paths is None:
+            paths = {}
+            for scale, path in {2: CFG.super_resolution_x2_model_path, 4: CFG.super_resolution_x4_model_path}.items():
+                if not os.path.exists(path):
+                    continue
+                try:
+                    edsr = EDSR(num_res_blocks=CFG.edsr_num_res_blocks, num_feats=64, scale=scale)
+                    if matches_checkpoint(edsr, path, key='model_state'):
+                        paths[scale] = path
+                    else:
+                        print(f"{path} does not match the EDSR layout ({CFG.edsr_num_res_blocks} blocks), the fast tier is disabled for x{scale}")
+                except Exception as e:
+                    print(f"Failed to read {path}, the fast tier is disabled for x{scale}: {str(e)}")
+            _fast_super_resolution_paths = paths
+        return dict(_fast_super_resolution_paths)
+
+
+def load_fast_super_resolution_model():
+    paths = get_fast_super_resolution_paths()
+    if not paths:
+        raise FileNotFoundError("No EDSR checkpoint found for the fast super resolution tier")
+
+    models, mapped_files = {}, []
+    for scale, path in paths.items():
+        edsr = EDSR(num_res_blocks=CFG.edsr_num_res_blocks, num_feats=64, scale=scale).to(CFG.device)
+        _, mapped_file = load_weights(edsr, path, key='model_state')
+        models[scale] = edsr
+        if mapped_file:
+            mapped_files.append(mapped_file)
+
+    model = ScaleDispatchMDSR(models)
+    model.mapped_files = mapped_files
+    return model
+
+
+def load_similarity_model(backend=None):
+    if (backend or get_inference_backend()) == "onnxruntime":
+        model = OnnxModule(ONNX_SIMILARITY_FILE)
+        model.backend = "onnxruntime"
+        return model
+
+    m = models.vgg16(weights=None)
+    _, mapped_file = load_weights(m, CFG.similarity_model_path)
+    model = torch.nn.Sequential(*[m.features, m.avgpool, m.classifier[0]]).to(CFG.device)
+    if CFG.inference_service_worker:
+        # the web workers call the whole trunk (see get_embedding), the same graph as the onnx export
+        model = SimilarityTrunk(model)
+    model.mapped_files = [mapped_file] if mapped_file else []
+    return model
+
+
+class ModelRegistry:
+    """
+    Keeps a single frozen instance of every model per worker process.
+
+    Models are loaded lazily on the first `get` (or eagerly with `preload`) and the same
+    instance is handed out to every request afterwards. Loading is guarded by a per model
+    lock so concurrent requests never load the same weights twice. The models are only
+    used for inference so sharing the instance between threads is safe.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self._loaders:
+            raise KeyError(f"Model {name} is not registered")
+
+        with self._locks[name]:
+            # another thread may have loaded the model while we were waiting
+            if name in self._models:
+                return self._models[name]
+
+            start = time.perf_counter()
+            with torch.no_grad():
+                model = freeze_model(self._loaders[name]())
+            load_time = time.perf_counter() - start
+
+            self._stats[name] = {
+                "load_time_sec": round(load_time, 4),
+                "size_bytes": get_model_size(model),
+                "device": str(CFG.device),
+                "backend": getattr(model, "backend", "torch"),
+                "precision": getattr(model, "precision", "fp32"),
+                "compile_mode": getattr(model, "compile_mode", "none"),
+                "execution_mode": getattr(model, "execution_mode", "fp32"),
+                "mapped_files": getattr(model, "mapped_files", []),
+                "loaded_at": time.time(),
+            }
+            self._models[name] = model
+            print(f"Loaded model {name} in {load_time:.2f}s ({self._stats[name]['size_bytes'] / 1024 ** 2:.1f} MB)")
+
+        return model
+
+    def preload(self, names=None):
+        for name in names or list(self._loaders):
+            try:
+                self.get(name)
+            except Exception as e:
+                # optional models (e.g. the fast super resolution tier) may have no weights on this host
+                print(f"Failed to preload model {name}: {str(e)}")
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def unload(self, name):
+        with self._locks[name]:
+            self._models.pop(name, None)
+            self._stats.pop(name, None)
+
+    def memory(self):
+        """
+        Resident / shared / private bytes of the memory mapped weights of every loaded model,
+        the weights of models which are not memory mapped are private to the process
+        """
+        mappings = parse_smaps()
+        memory = {}
+        for name, stats in list(self._stats.items()):
+            if stats["mapped_files"]:
+                memory[name] = dict(get_mapped_memory(stats["mapped_files"], mappings), mmap=True)
+            else:
+                memory[name] = {"rss": stats["size_bytes"], "shared": 0, "private": stats["size_bytes"], "mmap": False}
+        return memory
+
+    def memory_report(self):
+        print(f"{'model':>18} | {'mmap':>5} | {'rss (MB)':>9} | {'shared (MB)':>11} | {'private (MB)':>12}")
+        for name, memory in self.memory().items():
+            print(
+                f"{name:>18} | {str(memory['mmap']):>5} | {memory['rss'] / 1024 ** 2:>9.1f} | "
+                f"{memory['shared'] / 1024 ** 2:>11.1f} | {memory['private'] / 1024 ** 2:>12.1f}"
+            )
+        process = get_process_memory()
+        if process is not None:
+            print(
+                f"process {os.getpid()}: rss {process['rss'] / 1024 ** 2:.1f} MB, pss {process['pss'] / 1024 ** 2:.1f} MB, "
+                f"shared {process['shared'] / 1024 ** 2:.1f} MB, private {process['private'] / 1024 ** 2:.1f} MB"
+            )
+
+    def stats(self):
+        memory = self.memory()
+        return {
+            name: dict(self._stats[name], loaded=True, memory=memory[name]) if name in self._stats else {"loaded": False}
+            for name in self._loaders
+        }
+
+
+STYLE_TRANSFER_MODEL = "style_transfer"
+SUPER_RESOLUTION_MODEL = "super_resolution"
+SUPER_RESOLUTION_FAST_MODEL = "super_resolution_fast"
+SIMILARITY_MODEL = "similarity"
+
+model_registry = ModelRegistry()
+model_registry.register(STYLE_TRANSFER_MODEL, load_style_transfer_model)
+model_registry.register(SUPER_RESOLUTION_MODEL, load_super_resolution_model)
+model_registry.register(SUPER_RESOLUTION_FAST_MODEL, load_fast_super_resolution_model)
+model_registry.register(SIMILARITY_MODEL, load_similarity_model)
+
+if CFG.inference_service_address and not CFG.inference_service_worker:
+    # the models live in the inference service, the web workers only hold proxies
+    from utils.inference_service import inference_client, RemoteModel, RemoteStyleTransferModel, RemoteSuperResolutionModel
+
+    torch.set_num_threads(CFG.web_worker_threads)
+    model_registry.register(STYLE_TRANSFER_MODEL, lambda: RemoteStyleTransferModel(inference_client, STYLE_TRANSFER_MODEL))
+    model_registry.register(SUPER_RESOLUTION_MODEL, lambda: RemoteSuperResolutionModel(inference_client, SUPER_RESOLUTION_MODEL))
+    model_registry.register(SUPER_RESOLUTION_FAST_MODEL, lambda: RemoteSuperResolutionModel(inference_client, SUPER_RESOLUTION_FAST_MODEL))
+    model_registry.register(SIMILARITY_MODEL, lambda: RemoteModel(inference_client, SIMILARITY_MODEL))
@@ -0,0 +1,97 @@
+import os
+import torch
+from torch import nn
+from model_config import CFG
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+ONNX_ENCODER_FILE = "vgg_encoder.onnx"
+ONNX_DECODER_FILE = "vgg_decoder.onnx"
+ONNX_SIMILARITY_FILE = "vgg16_similarity.onnx"
+ONNX_SUPER_RESOLUTION_SCALES = [2, 3, 4]
+
+
+def get_onnx_mdsr_file(scale):
+    return f"mdsr_x{scale}.onnx"
+
+
+def get_onnx_files():
+    return [ONNX_ENCODER_FILE, ONNX_DECODER_FILE, ONNX_SIMILARITY_FILE] + [get_onnx_mdsr_file(s) for s in ONNX_SUPER_RESOLUTION_SCALES]
+
+
+class EncoderRelu41(nn.Module):
+    """
+    Export wrapper of VGG_ENCODER which only returns the relu4_1 features used at inference
+    """
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, x):
+        return self.encoder(x)['relu4_1']
+
+
+class SimilarityTrunk(nn.Module):
+    """
+    Export wrapper of the vgg16 similarity model (features -> avgpool -> first classifier layer)
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        temp = self.model[0:2](x)
+        return self.model[-1](temp.flatten(1))
+
+
+class OnnxModule(nn.Module):
+    """
+    Runs an exported ONNX graph on ONNX Runtime's CPU provider behind the same call interface
+    as the torch module it was exported from (torch tensors in, torch tensors out)
+    """
+
+    def __init__(self, file_name):
+        super().__init__()
+        session_options = ort.SessionOptions()
+        if CFG.onnx_num_threads > 0:
+            session_options.intra_op_num_threads = CFG.onnx_num_threads
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.path = os.path.join(CFG.onnx_models_dir, file_name)
+        self.session = ort.InferenceSession(self.path, session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().to("cpu", torch.float32).contiguous().numpy()})
+        return torch.from_numpy(outputs[0]).to(x.device)
+
+
+class OnnxEncoder(OnnxModule):
+    def forward(self, x):
+        return {'relu4_1': super().forward(x)}
+
+
+def get_inference_backend():
+    """
+    Returns the backend the models should run on, falling back to torch when ONNX Runtime was
+    requested but is not installed or the models were not exported yet
+    """
+    if CFG.inference_backend != "onnxruntime":
+        return "torch"
+
+    if ort is None:
+        print("onnxruntime is not installed, falling back to the torch backend")
+        return "torch"
+
+    missing = [f for f in get_onnx_files() if not os.path.exists(os.path.join(CFG.onnx_models_dir, f))]
+    if missing:
+        print(f"ONNX models {missing} not found in {CFG.onnx_models_dir}, run scripts/export_onnx.py. Falling back to the torch backend")
+        return "torch"
+
+    return "onnxruntime"
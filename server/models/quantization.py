@@ -0,0 +1,103 @@
+import copy
+import os
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from model_config import CFG
+from models.super_resolution_model import tiled_forward
+
+
+QUANTIZED_ENGINE = "x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm"
+QUANTIZED_ENCODER_FILE = "vgg_encoder_int8.pt"
+QUANTIZED_DECODER_FILE = "vgg_decoder_int8.pt"
+SUPER_RESOLUTION_SCALES = [2, 3, 4]
+
+
+def get_quantized_mdsr_file(scale):
+    return f"mdsr_x{scale}_int8.pt"
+
+
+def get_quantized_files():
+    return [QUANTIZED_ENCODER_FILE, QUANTIZED_DECODER_FILE] + [get_quantized_mdsr_file(s) for s in SUPER_RESOLUTION_SCALES]
+
+
+class SuperResolutionScale(nn.Module):
+    """
+    Fixes the scale of the multi-scale MDSR so every scale can be traced as a single graph
+    """
+
+    def __init__(self, model, scale):
+        super().__init__()
+        self.model = model
+        self.scale = scale
+
+    def forward(self, x):
+        return self.model(x, self.scale)
+
+
+class ScaleDispatchMDSR(nn.Module):
+    """
+    Same interface as MDSR, built from one single-scale graph per scale
+    """
+
+    def __init__(self, models):
+        super().__init__()
+        self.scales = sorted(models)
+        self.models = nn.ModuleDict({str(s): m for s, m in models.items()})
+
+    def forward(self, x, scale):
+        return self.models[str(scale)](x)
+
+    def forward_tiled(self, x, scale, tile_size=256, overlap=16, num_workers=1, progress=None):
+        return tiled_forward(self, x, scale, tile_size=tile_size, overlap=overlap, num_workers=num_workers, progress=progress)
+
+
+def quantize_model(model, example_inputs, calibration_inputs):
+    """
+    Post training static INT8 quantization with FX graph mode.
+
+    model: fp32 model, it is copied and left untouched
+    example_inputs: tuple of inputs used to trace the model
+    calibration_inputs: iterable of input tuples used to collect the activation ranges
+    """
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    qconfig_mapping = get_default_qconfig_mapping(QUANTIZED_ENGINE)
+
+    prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, example_inputs)
+    with torch.no_grad():
+        for inputs in calibration_inputs:
+            prepared(*inputs)
+
+    return convert_fx(prepared)
+
+
+def save_quantized_model(model, example_inputs, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs, strict=False)
+    torch.jit.save(traced, path)
+
+
+def load_quantized_model(file_name):
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    return torch.jit.load(os.path.join(CFG.quantized_weights_dir, file_name), map_location="cpu")
+
+
+def get_inference_precision():
+    """
+    Returns the precision the models should be loaded with, falling back to fp32 when INT8 was
+    requested but can not be used on this deployment
+    """
+    if CFG.inference_precision != "int8":
+        return "fp32"
+
+    if CFG.device != "cpu":
+        print("INT8 inference is only supported on cpu, falling back to fp32")
+        return "fp32"
+
+    missing = [f for f in get_quantized_files() if not os.path.exists(os.path.join(CFG.quantized_weights_dir, f))]
+    if missing:
+        print(f"Quantized weights {missing} not found in {CFG.quantized_weights_dir}, run scripts/calibrate_quantization.py. Falling back to fp32")
+        return "fp32"
+
+    return "int8"
@@ -7,5 +7,9 @@ def get_embedding(model, img):
   if(len(img.shape) == 3):
     img = img.unsqueeze(0)
     
+  # exported models (e.g. onnx) run the whole trunk as a single graph
+  if not isinstance(model, nn.Sequential):
+    return model(img)
+
   temp = model[0:2](img)
   return model[-1](temp.flatten().unsqueeze(0))
\ No newline at end of file
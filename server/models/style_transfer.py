@@ -1,7 +1,7 @@
 import torch
 from torch import nn
 import torch.nn.functional as F
-from model_config import CFG
+from models.checkpoints import load_weights
 
 
 
@@ -11,9 +11,17 @@ def AdaIN(content_features, style_features):
         content_features: (B, C, H, W)
         styel_features: (B, C, H, W)
     """
+    style_mean, style_std = calculate_mean_std(style_features)
+    return AdaIN_with_stats(content_features, style_mean, style_std)
+
+
+def AdaIN_with_stats(content_features, style_mean, style_std):
+    """
+        content_features: (B, C, H, W)
+        style_mean: (B, C, 1, 1); style_std: (B, C, 1, 1)
+    """
     # content_mean: (B, C, 1, 1); content_std: (B, C, 1, 1)
     content_mean, content_std = calculate_mean_std(content_features)
-    style_mean, style_std = calculate_mean_std(style_features)
 
     # normalizing the features
     normalized_content_features = (content_features - content_mean) / content_std
@@ -36,6 +44,28 @@ def calculate_mean_std(features, eps=1e-5):
     
     return feats_mean, feats_std
 
+def pad_to_batch(images, multiple=8):
+    """
+    images: list of (C, H, W) tensors with possibly different spatial sizes
+    output: (B, C, H_max, W_max) batch padded on the bottom/right with replicated border pixels
+            so that H_max and W_max are divisible by `multiple`, and the original (H, W) of every image
+    """
+    sizes = [(img.shape[-2], img.shape[-1]) for img in images]
+    max_h = -(-max(h for h, _ in sizes) // multiple) * multiple
+    max_w = -(-max(w for _, w in sizes) // multiple) * multiple
+
+    padded = [
+        F.pad(img.unsqueeze(0), (0, max_w - w, 0, max_h - h), mode='replicate')
+        for img, (h, w) in zip(images, sizes)
+    ]
+    return torch.cat(padded, dim=0), sizes
+
+
+def feature_sizes(sizes, factor=8):
+    # the encoder reduces the spatial size by 8 till relu4_1
+    return [(-(-h // factor), -(-w // factor)) for h, w in sizes]
+
+
 # the network structure of vgg19 till relu5_1 as we will at most need the relu5_1 output
 enc_layers = nn.Sequential( 
     nn.Conv2d(3,3,(1, 1)),  # this is an extra preprocessing layer
@@ -89,8 +119,8 @@ class VGG_ENCODER(nn.Module):
         self.relu3_4 = nn.Sequential(*enc_layers[24:27]) # relu3_3 -> relu3_3
         self.relu4_1 = nn.Sequential(*enc_layers[27:31]) # relu3_4 -> relu4_1
         
-        # loading pretrained vgg model weights
-        enc_layers.load_state_dict(torch.load(model_path,map_location=CFG.device, weights_only=True))
+        # loading pretrained vgg model weights (memory mapped when a converted checkpoint exists)
+        _, self.mapped_file = load_weights(enc_layers, model_path)
 
         # Freeze the layers to prevent training them
         for param in self.parameters():
@@ -189,16 +219,108 @@ class Network(nn.Module):
     
 
     def stylize_image(self, content_img, style_img, alpha=0.5):
-        content_feature_maps = self.encoder(content_img)
+        style_mean, style_std = self.calculate_style_stats(style_img)
+        return self.stylize_image_with_stats(content_img, style_mean, style_std, alpha=alpha)
+
+
+    def calculate_style_stats(self, style_img):
+        """
+        style_img: (B, C, H, W)
+        output: mean and std of the relu4_1 features of the style image, (B, 512, 1, 1) each
+        """
         style_feature_maps = self.encoder(style_img)
+        return calculate_mean_std(style_feature_maps['relu4_1'])
+
+
+    def stylize_image_with_stats(self, content_img, style_mean, style_std, alpha=0.5):
+        content_feature_maps = self.encoder(content_img)
         
-        t =  AdaIN(content_feature_maps['relu4_1'], style_feature_maps['relu4_1'])
+        t =  AdaIN_with_stats(content_feature_maps['relu4_1'], style_mean, style_std)
         t = alpha * t + (1-alpha) * content_feature_maps['relu4_1']
         generated_img = self.decoder(t)
         
         return torch.clip(generated_img, 0.0, 1.0)
             
 
+    def encode_content(self, content_img):
+        """
+        content_img: (B, C, H, W)
+        output: relu4_1 features of the content image, (B, 512, H/8, W/8)
+        """
+        return self.encoder(content_img)['relu4_1']
+
+
+    def stylize_image_alphas(self, content_img, style_mean, style_std, alphas):
+        """
+        content_img: (1, C, H, W)
+        alphas: list of N floats
+        output: (N, C, H, W) one stylized image per alpha, the encoder and AdaIN run only once
+                and all the blended feature maps are decoded as a single batch
+        """
+        return self.decode_alphas(self.encode_content(content_img), style_mean, style_std, alphas)
+
+
+    def decode_alphas(self, content_features, style_mean, style_std, alphas):
+        """
+        content_features: (1, 512, H, W) relu4_1 features of the content image
+        alphas: list of N floats
+        output: (N, C, 8H, 8W) one stylized image per alpha
+        """
+        t = AdaIN_with_stats(content_features, style_mean, style_std)
+
+        alpha = torch.tensor(alphas, dtype=t.dtype, device=t.device).view(-1, 1, 1, 1)
+        t = alpha * t + (1 - alpha) * content_features
+        generated_imgs = self.decoder(t)
+
+        return torch.clip(generated_imgs, 0.0, 1.0)
+
+
+    def encode_content_batch(self, content_imgs):
+        """
+        content_imgs: list of (C, H, W) content images, sizes may differ
+        output: list of (1, 512, ceil(H/8), ceil(W/8)) relu4_1 features, one per image, without the padding
+        """
+        content_batch, content_sizes = pad_to_batch(content_imgs)
+        content_features = self.encode_content(content_batch)
+
+        return [
+            content_features[i:i+1, :, :h, :w].contiguous()
+            for i, (h, w) in enumerate(feature_sizes(content_sizes))
+        ]
+
+
+    def decode_batch(self, content_features, style_stats, alphas, sizes):
+        """
+        content_features: list of (1, 512, h, w) relu4_1 features, sizes may differ
+        style_stats: list of (mean, std) relu4_1 statistics of the style images, (1, 512, 1, 1) each
+        alphas: list of floats, one per content image
+        sizes: list of (H, W) output sizes, one per content image
+        output: list of stylized (C, H, W) images
+        """
+        # AdaIN runs per image so the statistics are never computed over the padding
+        t = []
+        for features, (style_mean, style_std), alpha in zip(content_features, style_stats, alphas):
+            blended = alpha * AdaIN_with_stats(features, style_mean, style_std) + (1 - alpha) * features
+            t.append(blended[0])
+
+        t, _ = pad_to_batch(t, multiple=1)
+        generated_imgs = torch.clip(self.decoder(t), 0.0, 1.0)
+
+        return [generated_imgs[i, :, :h, :w] for i, (h, w) in enumerate(sizes)]
+
+
+    def stylize_batch(self, content_imgs, style_stats, alphas):
+        """
+        content_imgs: list of (C, H, W) content images, sizes may differ
+        style_stats: list of (mean, std) relu4_1 statistics of the style images, (1, 512, 1, 1) each
+        alphas: list of floats, one per content image
+        output: list of stylized (C, H, W) images with the same size as the content images
+        """
+        content_features = self.encode_content_batch(content_imgs)
+        sizes = [(img.shape[-2], img.shape[-1]) for img in content_imgs]
+        return self.decode_batch(content_features, style_stats, alphas, sizes)
+
+
     def calculate_style_loss(self, gen_features, style_features):
         gen_mean, gen_std = calculate_mean_std(gen_features)
         style_mean, style_std = calculate_mean_std(style_features)
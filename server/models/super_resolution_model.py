@@ -1,6 +1,90 @@
 import torch
 from torch import nn
 import torch.nn.functional as F
+from concurrent.futures import ThreadPoolExecutor
+
+def get_tile_starts(length, tile_size, overlap):
+    """
+    Returns the start offsets of the tiles covering `length` pixels where consecutive tiles overlap
+    by at least `overlap` pixels
+    """
+    if length <= tile_size:
+        return [0]
+
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    starts.append(length - tile_size)
+    return starts
+
+
+def get_feather_weights(length, ramp, ramp_start, ramp_end):
+    """
+    1D blending weights which linearly ramp up/down over `ramp` pixels on the sides that overlap
+    with a neighbouring tile and are 1 everywhere else
+    """
+    weights = torch.ones(length)
+    ramp = min(ramp, length)
+    if ramp > 0:
+        ramp_weights = torch.arange(1, ramp + 1, dtype=torch.float32) / (ramp + 1)
+        if ramp_start:
+            weights[:ramp] = ramp_weights
+        if ramp_end:
+            weights[-ramp:] = torch.minimum(weights[-ramp:], ramp_weights.flip(0))
+    return weights
+
+
+def tiled_forward(model, x, scale, tile_size=256, overlap=16, num_workers=1, progress=None):
+    """
+    Runs model(x, scale) on overlapping tiles of at most tile_size x tile_size pixels
+    and feather-blends the overlaps, so the peak activation memory depends on the tile size
+    instead of the image size.
+
+    x: (1, C, H, W)
+    num_workers: number of tiles processed in parallel
+    progress: optional callable(done_tiles, total_tiles) called after every blended tile
+    """
+    _, C, H, W = x.shape
+    if H <= tile_size and W <= tile_size:
+        return model(x, scale)
+
+    overlap = min(overlap, tile_size // 2)
+    tiles = [(top, left) for top in get_tile_starts(H, tile_size, overlap) for left in get_tile_starts(W, tile_size, overlap)]
+
+    output = torch.zeros((1, C, H * scale, W * scale), dtype=x.dtype, device=x.device)
+    weights = torch.zeros((1, 1, H * scale, W * scale), dtype=x.dtype, device=x.device)
+    ramp = overlap * scale
+
+    def run_tile(tile):
+        top, left = tile
+        patch = x[:, :, top:top + tile_size, left:left + tile_size]
+        return tile, model(patch, scale)
+
+    def blend_tile(tile, patch_out):
+        top, left = tile
+        _, _, h, w = patch_out.shape
+        weight_h = get_feather_weights(h, ramp, top > 0, top * scale + h < H * scale)
+        weight_w = get_feather_weights(w, ramp, left > 0, left * scale + w < W * scale)
+        weight = (weight_h.view(-1, 1) * weight_w.view(1, -1)).to(device=x.device, dtype=x.dtype)
+
+        y, x_ = top * scale, left * scale
+        output[:, :, y:y + h, x_:x_ + w] += patch_out * weight
+        weights[:, :, y:y + h, x_:x_ + w] += weight
+
+    def blend_tile_and_report(index, tile, patch_out):
+        blend_tile(tile, patch_out)
+        if progress is not None:
+            progress(index + 1, len(tiles))
+
+    if num_workers > 1:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # blending happens on this thread as tiles complete so the buffers are never written concurrently
+            for index, (tile, patch_out) in enumerate(executor.map(run_tile, tiles)):
+                blend_tile_and_report(index, tile, patch_out)
+    else:
+        for index, tile in enumerate(tiles):
+            blend_tile_and_report(index, *run_tile(tile))
+
+    return output / weights
+
 
 class MeanShift(nn.Conv2d):
     def __init__(self, rgb_range=255, rgb_mean=(0.4488, 0.4371, 0.4040), rgb_std=(1.0, 1.0, 1.0),
@@ -28,8 +112,7 @@ class ResBlock(nn.Module):
 
     def forward(self, x):
         res = self.body(x).mul(self.res_scale)
-        res += x
-        return res
+        return res + x
 
 
 class Upsampler(nn.Sequential):
@@ -96,7 +179,7 @@ class MDSR(nn.Module):
         res = self.body(x)
 
         
-        res += x
+        res = res + x
 
 
         x = self.upsamplers[f"{scale}"](res)
@@ -104,4 +187,46 @@ class MDSR(nn.Module):
         x = self.tail(x)
         x = self.add_mean(x)
 
-        return x
\ No newline at end of file
+        return x
+
+    def forward_tiled(self, x, scale, tile_size=256, overlap=16, num_workers=1, progress=None):
+        """
+        Same as forward but runs the model on overlapping tiles of at most tile_size x tile_size pixels,
+        see tiled_forward
+        """
+        return tiled_forward(self, x, scale, tile_size=tile_size, overlap=overlap, num_workers=num_workers, progress=progress)
+
+
+class EDSR(nn.Module):
+    """
+    Single scale EDSR, the same head/body/upsampler/tail as MDSR without the per scale branches.
+    Much shallower than the 80 block MDSR, used as the fast super resolution tier.
+    """
+
+    def __init__(self, num_res_blocks=16, num_feats=64, scale=2):
+        super(EDSR, self).__init__()
+        self.scale = scale
+        self.scales = [scale]
+
+        body_layers = [ResBlock(in_channel=num_feats, out_channel=num_feats) for _ in range(num_res_blocks)]
+        body_layers.append(nn.Conv2d(num_feats, num_feats, kernel_size=3, stride=1, padding=1, bias=True))
+
+        self.sub_mean = MeanShift(sign=-1)
+        self.add_mean = MeanShift(sign=1)
+        self.head = nn.Sequential(nn.Conv2d(3, num_feats, kernel_size=3, stride=1, padding=1, bias=True))
+        self.body = nn.Sequential(*body_layers)
+        self.upsampler = Upsampler(num_feats, scale=scale)
+        self.tail = nn.Sequential(nn.Conv2d(num_feats, 3, kernel_size=3, stride=1, padding=1, bias=True))
+
+    def forward(self, x):
+        x = self.sub_mean(x)
+        x = self.head(x)
+
+        res = self.body(x)
+        res = res + x
+
+        x = self.upsampler(res)
+        x = self.tail(x)
+        x = self.add_mean(x)
+
+        return x
@@ -1,6 +1,10 @@
 from flask import Blueprint, g, jsonify, request
 from middleware.auth import auth_middleware
-from controllers.image_proc_controller import apply_style_transfer, find_similar_image, apply_super_resolution
+from controllers.image_proc_controller import (
+    apply_style_transfer, find_similar_image, apply_super_resolution, get_model_stats,
+    submit_super_resolution_job, submit_style_transfer_job, get_job_status, get_job_result,
+    list_profiles, download_profile
+)
 
 
 image_proc_routes = Blueprint("image_processing", __name__)
@@ -68,3 +72,82 @@ def find_similar_image_route():
 
     # For POST requests, proceed with save_project logic
     return find_similar_image()
+
+
+@image_proc_routes.route("/api/image_proc/model_stats", methods=["OPTIONS", "GET"])
+def get_model_stats_route():
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return get_model_stats()
+
+
+# asynchronous jobs, the submit routes return a job id which is polled for the status and the result
+@image_proc_routes.route("/api/image_proc/jobs/super_res", methods=["OPTIONS", "POST"])
+def submit_super_resolution_job_route():
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return submit_super_resolution_job()
+
+
+@image_proc_routes.route("/api/image_proc/jobs/style_transfer", methods=["OPTIONS", "POST"])
+def submit_style_transfer_job_route():
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return submit_style_transfer_job()
+
+
+@image_proc_routes.route("/api/image_proc/jobs/<string:job_id>", methods=["OPTIONS", "GET"])
+def get_job_status_route(job_id):
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return get_job_status(job_id)
+
+
+@image_proc_routes.route("/api/image_proc/jobs/<string:job_id>/result", methods=["OPTIONS", "GET"])
+def get_job_result_route(job_id):
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return get_job_result(job_id)
+
+
+# torch profiler captures of single requests (profile=true), admins only
+@image_proc_routes.route("/api/image_proc/profiles", methods=["OPTIONS", "GET"])
+def list_profiles_route():
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return list_profiles()
+
+
+@image_proc_routes.route("/api/image_proc/profiles/<string:trace_id>", methods=["OPTIONS", "GET"])
+def download_profile_route(trace_id):
+    if request.method == "OPTIONS":
+        response = jsonify({})
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        return response, 204
+    return download_profile(trace_id)
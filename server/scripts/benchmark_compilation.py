@@ -0,0 +1,60 @@
+"""
+Benchmarks eager vs compiled inference of the style transfer network on the 512 and 1024
+content buckets and of MDSR on a single super resolution tile.
+
+usage (from the server folder): python -m scripts.benchmark_compilation --mode trace --runs 5
+"""
+import argparse
+import os
+import time
+import torch
+# the eager baseline and the compiled models are plain fp32 torch models, whatever the server runs with
+os.environ["EXECUTION_MODE"] = "fp32"
+os.environ["INFERENCE_BACKEND"] = "torch"
+from model_config import CFG
+from models.model_registry import load_style_transfer_model, load_super_resolution_model
+
+
+def time_it(fn, runs):
+    fn()  # warmup
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return 1000 * sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="trace", choices=["trace", "torch_compile"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--tile-size", type=int, default=CFG.super_resolution_tile_size or 256)
+    args = parser.parse_args()
+
+    CFG.compile_mode = args.mode
+    eager_style = load_style_transfer_model(precision="fp32", compile_mode="none", backend="torch").eval()
+    eager_sr = load_super_resolution_model(precision="fp32", compile_mode="none", backend="torch").eval()
+    compiled_style = load_style_transfer_model(precision="fp32", compile_mode=args.mode, backend="torch").eval()
+    compiled_sr = load_super_resolution_model(precision="fp32", compile_mode=args.mode, backend="torch").eval()
+
+    style_mean, style_std = torch.rand(1, 512, 1, 1, device=CFG.device), torch.rand(1, 512, 1, 1, device=CFG.device)
+
+    print(f"{'model':>24} | {'eager (ms)':>10} | {args.mode + ' (ms)':>18} | {'speedup':>8}")
+    with torch.no_grad():
+        for size in args.sizes:
+            content_img = torch.rand(1, 3, size, size, device=CFG.device)
+            eager_ms = time_it(lambda: eager_style.stylize_image_with_stats(content_img, style_mean, style_std, alpha=1.0), args.runs)
+            compiled_ms = time_it(lambda: compiled_style.stylize_image_with_stats(content_img, style_mean, style_std, alpha=1.0), args.runs)
+            print(f"{'style transfer ' + str(size):>24} | {eager_ms:>10.1f} | {compiled_ms:>18.1f} | {eager_ms / compiled_ms:>7.2f}x")
+
+        tile = torch.rand(1, 3, args.tile_size, args.tile_size, device=CFG.device) * 255
+        for scale in [2, 3, 4]:
+            eager_ms = time_it(lambda: eager_sr(tile, scale), args.runs)
+            compiled_ms = time_it(lambda: compiled_sr(tile, scale), args.runs)
+            print(f"{f'mdsr x{scale} {args.tile_size}px tile':>24} | {eager_ms:>10.1f} | {compiled_ms:>18.1f} | {eager_ms / compiled_ms:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
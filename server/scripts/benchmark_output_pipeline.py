@@ -0,0 +1,88 @@
+"""
+Per stage timings of the output pipeline on a 4K output, the PIL path (ToPILImage + PIL resize,
+float scaling by 255) against the tensor path of utils/postprocessing.py (torch resize, one uint8
+quantization, numpy array to the encoder).
+
+style: a 1024 content resolution output resized back to 3840x2160
+super resolution: a 1920x1080 input upscaled by 2 (model output in [0, 255])
+
+usage (from the server folder): python -m scripts.benchmark_output_pipeline --runs 5 --format png
+"""
+import argparse
+import io
+import torch
+import torchvision.transforms.v2 as T
+from PIL import Image
+from model_config import CFG
+from utils.postprocessing import StageTimings, to_numpy_image
+
+
+def encode(image, format):
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def style_pil(output, size, format, timings):
+    with timings.stage("to_pil"):
+        image = T.ToPILImage()(output.to("cpu"))
+    with timings.stage("resize"):
+        image = image.resize((size[1], size[0]))
+    with timings.stage("encode"):
+        encode(image, format)
+
+
+def style_tensor(output, size, format, timings):
+    image = to_numpy_image(output, size=size, timings=timings)
+    with timings.stage("encode"):
+        encode(image, format)
+
+
+def super_resolution_pil(output, format, timings):
+    with timings.stage("to_pil"):
+        image = torch.clip(output, min=0, max=255).to("cpu")
+        image = T.ToPILImage()(image / 255)
+    with timings.stage("encode"):
+        encode(image, format)
+
+
+def super_resolution_tensor(output, format, timings):
+    image = to_numpy_image(output, max_value=255, timings=timings)
+    with timings.stage("encode"):
+        encode(image, format)
+
+
+def run(fn, runs):
+    fn(StageTimings())  # warmup
+    timings = StageTimings()
+    for _ in range(runs):
+        fn(timings)
+    return {name: ms / runs for name, ms in timings.stages.items()}
+
+
+def print_row(name, stages):
+    breakdown = ", ".join(f"{stage} {ms:.1f}" for stage, ms in stages.items())
+    print(f"{name:<26} | {sum(stages.values()):>10.1f} | {breakdown}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--format", default="png", choices=["png", "webp", "jpeg"])
+    args = parser.parse_args()
+
+    size = (2160, 3840)
+    style_output = torch.rand(3, 1024, 1820, device=CFG.device)
+    super_resolution_output = torch.rand(3, 2160, 3840, device=CFG.device) * 270 - 5
+
+    print(f"{'pipeline':<26} | {'total (ms)':>10} | stages (ms)")
+    print_row("style PIL", run(lambda t: style_pil(style_output, size, args.format, t), args.runs))
+    print_row("style tensor", run(lambda t: style_tensor(style_output, size, args.format, t), args.runs))
+    print_row("super resolution PIL", run(lambda t: super_resolution_pil(super_resolution_output, args.format, t), args.runs))
+    print_row("super resolution tensor", run(lambda t: super_resolution_tensor(super_resolution_output, args.format, t), args.runs))
+
+
+if __name__ == "__main__":
+    main()
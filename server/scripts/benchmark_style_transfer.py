@@ -0,0 +1,56 @@
+"""
+Benchmarks the style transfer network on the 512 and 1024 content buckets.
+
+Compares a full request (content encoder + AdaIN + decoder) with a decoder only request
+which reuses cached content features.
+
+usage (from the server folder): python -m scripts.benchmark_style_transfer --runs 5
+"""
+import argparse
+import time
+import torch
+from model_config import CFG
+from models.model_registry import model_registry, STYLE_TRANSFER_MODEL
+
+
+def time_it(fn, runs):
+    fn()  # warmup
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return 1000 * sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    args = parser.parse_args()
+
+    model = model_registry.get(STYLE_TRANSFER_MODEL)
+    style_mean, style_std = torch.rand(1, 512, 1, 1, device=CFG.device), torch.rand(1, 512, 1, 1, device=CFG.device)
+
+    print(f"{'size':>6} | {'full (ms)':>10} | {'decoder only (ms)':>18} | {'speedup':>8}")
+    for size in args.sizes:
+        content_img = torch.rand(3, size, size * 4 // 3, device=CFG.device)
+        content_size = tuple(content_img.shape[-2:])
+
+        with torch.no_grad():
+            content_features = model.encode_content_batch([content_img])[0]
+
+            def full():
+                model.decode_batch(model.encode_content_batch([content_img]), [(style_mean, style_std)], [1.0], [content_size])
+
+            def decoder_only():
+                model.decode_batch([content_features], [(style_mean, style_std)], [1.0], [content_size])
+
+            full_ms = time_it(full, args.runs)
+            decoder_ms = time_it(decoder_only, args.runs)
+
+        print(f"{size:>6} | {full_ms:>10.1f} | {decoder_ms:>18.1f} | {full_ms / decoder_ms:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Latency and PSNR of the super resolution tiers on a fixed image set. Every image is center
+cropped, downscaled by the scale (bicubic) and upscaled again by each tier, the PSNR is measured
+against the original crop. Bicubic upscaling is listed as the baseline.
+
+usage (from the server folder):
+    python -m scripts.benchmark_super_resolution --images path/to/images --crop 256 --runs 3
+"""
+import argparse
+import os
+import time
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from model_config import CFG
+from models.model_registry import load_super_resolution_model, load_fast_super_resolution_model, get_fast_super_resolution_paths
+from utils.preprocessing import get_super_resolution_transform
+from utils.image_quality import calculate_psnr
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_crops(images_dir, crop):
+    crops = []
+    for file_name in sorted(os.listdir(images_dir)):
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        img = get_super_resolution_transform()(Image.open(os.path.join(images_dir, file_name)).convert("RGB"))
+        _, H, W = img.shape
+        if min(H, W) < crop:
+            continue
+        top, left = (H - crop) // 2, (W - crop) // 2
+        crops.append(img[:, top:top + crop, left:left + crop].unsqueeze(0).to(CFG.device))
+    return crops
+
+
+def time_it(fn, runs):
+    output = fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return output, 1000 * (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", required=True, help="folder with the benchmark images")
+    parser.add_argument("--crop", type=int, default=256, help="size of the center crop (high resolution reference)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # divisible by every scale so the upscaled low resolution image has the size of the crop
+    args.crop -= args.crop % 12
+    crops = load_crops(args.images, args.crop)
+    if not crops:
+        raise SystemExit(f"No image of at least {args.crop}px found in {args.images}")
+
+    tiers = {"quality": load_super_resolution_model(precision="fp32", compile_mode="none", backend="torch").eval()}
+    if get_fast_super_resolution_paths():
+        tiers["fast"] = load_fast_super_resolution_model().eval()
+
+    print(f"{len(crops)} images, {args.crop}px crops")
+    print(f"{'tier':>8} | {'scale':>5} | {'latency (ms)':>12} | {'PSNR (dB)':>9}")
+    with torch.no_grad():
+        for scale in [2, 3, 4]:
+            rows = {"bicubic": ([], [])}
+            for hr in crops:
+                lr = F.interpolate(hr, scale_factor=1 / scale, mode="bicubic", antialias=True, align_corners=False).clamp(0, 1)
+                bicubic, latency = time_it(lambda: F.interpolate(lr, size=hr.shape[-2:], mode="bicubic", align_corners=False), args.runs)
+                rows["bicubic"][0].append(latency)
+                rows["bicubic"][1].append(calculate_psnr(hr, bicubic.clamp(0, 1)))
+
+                for tier, model in tiers.items():
+                    if scale not in model.scales:
+                        continue
+                    sr, latency = time_it(lambda: model(lr * 255, scale), args.runs)
+                    sr = torch.clip(sr, 0, 255)[..., :hr.shape[-2], :hr.shape[-1]] / 255
+                    latencies, psnrs = rows.setdefault(tier, ([], []))
+                    latencies.append(latency)
+                    psnrs.append(calculate_psnr(hr, sr))
+
+            for tier, (latencies, psnrs) in rows.items():
+                print(f"{tier:>8} | {'x' + str(scale):>5} | {sum(latencies) / len(latencies):>12.1f} | {sum(psnrs) / len(psnrs):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
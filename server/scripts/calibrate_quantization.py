@@ -0,0 +1,125 @@
+"""
+Calibrates and exports the INT8 versions of VGG_ENCODER, VGG_DECODER and MDSR (one graph per scale)
+and writes a quality report (PSNR/SSIM of the INT8 output against the FP32 output).
+
+The exported models are used when the server runs with INFERENCE_PRECISION=int8.
+
+usage (from the server folder):
+    python -m scripts.calibrate_quantization --images path/to/sample/images --max-images 16
+"""
+import argparse
+import json
+import os
+import random
+import torch
+from PIL import Image
+# the reference outputs are always computed by the plain fp32 torch models, whatever the server runs with
+os.environ["EXECUTION_MODE"] = "fp32"
+os.environ["INFERENCE_BACKEND"] = "torch"
+from model_config import CFG
+from models.model_registry import load_style_transfer_model, load_super_resolution_model
+from models.quantization import (
+    quantize_model, save_quantized_model, SuperResolutionScale, ScaleDispatchMDSR, SUPER_RESOLUTION_SCALES,
+    QUANTIZED_ENCODER_FILE, QUANTIZED_DECODER_FILE, get_quantized_mdsr_file
+)
+from models.style_transfer import Network, AdaIN
+from utils.preprocessing import get_style_transfer_transform, get_super_resolution_transform
+from utils.image_quality import calculate_psnr, calculate_ssim
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_images(images_dir, max_images):
+    paths = sorted(os.path.join(images_dir, f) for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return [Image.open(path).convert("RGB") for path in paths[:max_images]]
+
+
+def random_crop(img, size):
+    _, H, W = img.shape
+    top, left = random.randint(0, max(H - size, 0)), random.randint(0, max(W - size, 0))
+    return img[:, top:top + size, left:left + size]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", required=True, help="folder with the calibration images")
+    parser.add_argument("--max-images", type=int, default=16)
+    parser.add_argument("--content-size", type=int, default=256, help="resize of the style transfer calibration images")
+    parser.add_argument("--sr-size", type=int, default=96, help="crop size of the super resolution calibration images")
+    parser.add_argument("--out", default=CFG.quantized_weights_dir)
+    args = parser.parse_args()
+
+    random.seed(0)
+    torch.manual_seed(0)
+    os.makedirs(args.out, exist_ok=True)
+
+    images = load_images(args.images, args.max_images)
+    if len(images) < 2:
+        raise SystemExit("At least two calibration images are needed")
+
+    style_transform = get_style_transfer_transform(img_size=args.content_size)
+    st_images = [random_crop(style_transform(img), args.content_size).unsqueeze(0) for img in images]
+    sr_images = [random_crop(get_super_resolution_transform()(img) * 255, args.sr_size).unsqueeze(0) for img in images]
+
+    style_model = load_style_transfer_model(precision="fp32", compile_mode="none", backend="torch").to("cpu").eval()
+    sr_model = load_super_resolution_model(precision="fp32", compile_mode="none", backend="torch").to("cpu").eval()
+
+    # encoder
+    print("Quantizing VGG_ENCODER")
+    q_encoder = quantize_model(style_model.encoder, (st_images[0],), [(img,) for img in st_images])
+    save_quantized_model(q_encoder, (st_images[0],), os.path.join(args.out, QUANTIZED_ENCODER_FILE))
+
+    # decoder, calibrated with the AdaIN outputs of random content/style pairs
+    print("Quantizing VGG_DECODER")
+    with torch.no_grad():
+        features = [style_model.encode_content(img) for img in st_images]
+        decoder_inputs = []
+        for i, content_features in enumerate(features):
+            style_features = features[(i + 1) % len(features)]
+            alpha = random.uniform(0.5, 1.0)
+            t = alpha * AdaIN(content_features, style_features) + (1 - alpha) * content_features
+            decoder_inputs.append((t,))
+    q_decoder = quantize_model(style_model.decoder, decoder_inputs[0], decoder_inputs)
+    save_quantized_model(q_decoder, decoder_inputs[0], os.path.join(args.out, QUANTIZED_DECODER_FILE))
+
+    # mdsr, one graph per scale
+    q_sr_models = {}
+    for scale in SUPER_RESOLUTION_SCALES:
+        print(f"Quantizing MDSR x{scale}")
+        scale_model = SuperResolutionScale(sr_model, scale).eval()
+        q_sr_models[scale] = quantize_model(scale_model, (sr_images[0],), [(img,) for img in sr_images])
+        save_quantized_model(q_sr_models[scale], (sr_images[0],), os.path.join(args.out, get_quantized_mdsr_file(scale)))
+
+    # quality report of the INT8 models against the FP32 models
+    q_style_model = Network(q_encoder, q_decoder).eval()
+    q_sr_model = ScaleDispatchMDSR(q_sr_models).eval()
+    report = {"style_transfer": [], **{f"super_resolution_x{s}": [] for s in SUPER_RESOLUTION_SCALES}}
+
+    with torch.no_grad():
+        for i, content_img in enumerate(st_images):
+            style_img = st_images[(i + 1) % len(st_images)]
+            fp32_out = style_model.stylize_image(content_img, style_img, alpha=1.0)
+            int8_out = q_style_model.stylize_image(content_img, style_img, alpha=1.0)
+            report["style_transfer"].append({"psnr": calculate_psnr(fp32_out, int8_out), "ssim": calculate_ssim(fp32_out, int8_out)})
+
+        for scale in SUPER_RESOLUTION_SCALES:
+            for img in sr_images:
+                fp32_out = torch.clip(sr_model(img, scale), 0, 255) / 255
+                int8_out = torch.clip(q_sr_model(img, scale), 0, 255) / 255
+                report[f"super_resolution_x{scale}"].append({"psnr": calculate_psnr(fp32_out, int8_out), "ssim": calculate_ssim(fp32_out, int8_out)})
+
+    summary = {}
+    print(f"{'model':>22} | {'PSNR (dB)':>10} | {'SSIM':>6}")
+    for name, results in report.items():
+        psnr = sum(r["psnr"] for r in results) / len(results)
+        ssim = sum(r["ssim"] for r in results) / len(results)
+        summary[name] = {"psnr": psnr, "ssim": ssim}
+        print(f"{name:>22} | {psnr:>10.2f} | {ssim:>6.4f}")
+
+    with open(os.path.join(args.out, "quality_report.json"), "w") as f:
+        json.dump({"summary": summary, "images": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Checks the models of a running inference service (inference_server.py) against the same models
+loaded in this process: every remote call has to return the local output shape and values.
+
+usage (from the server folder, with the service running):
+    INFERENCE_SERVICE_ADDRESS=/tmp/imagecraft-inference.sock python -m scripts.check_inference_service
+"""
+import os
+
+# the local reference models are loaded in this process, the service is only reached through the client
+os.environ["INFERENCE_SERVICE_WORKER"] = "true"
+
+import torch
+from model_config import CFG
+from models.model_registry import load_style_transfer_model, load_super_resolution_model, load_similarity_model
+from models.similarity_model import get_embedding
+from utils.inference_service import InferenceClient, RemoteModel, RemoteStyleTransferModel, RemoteSuperResolutionModel
+
+
+def compare(name, local, remote, atol=1e-3):
+    ok = local.shape == remote.shape and torch.allclose(local.float(), remote.float(), atol=atol)
+    max_diff = (local.float() - remote.float()).abs().max().item() if local.shape == remote.shape else float("nan")
+    print(f"{name:>18} | local {tuple(local.shape)} | remote {tuple(remote.shape)} | max diff {max_diff:.2e} | {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def main():
+    if not CFG.inference_service_address:
+        raise SystemExit("Set INFERENCE_SERVICE_ADDRESS to the unix socket path of the inference service")
+
+    client = InferenceClient(CFG.inference_service_address, CFG.inference_service_authkey.encode())
+    generator = torch.Generator().manual_seed(0)
+    img = torch.rand(3, 224, 224, generator=generator).to(CFG.device)
+    results = []
+
+    with torch.no_grad():
+        local = load_similarity_model(backend="torch").eval()
+        results.append(compare("similarity", get_embedding(local, img), get_embedding(RemoteModel(client, "similarity"), img)))
+
+        local = load_style_transfer_model(backend="torch").eval()
+        remote = RemoteStyleTransferModel(client, "style_transfer")
+        results.append(compare("style encode", local.encode_content(img.unsqueeze(0)), remote.encode_content(img.unsqueeze(0))))
+
+        local = load_super_resolution_model(backend="torch").eval()
+        remote = RemoteSuperResolutionModel(client, "super_resolution")
+        lr = img[:, :64, :64].unsqueeze(0) * 255
+        results.append(compare("super resolution", local(lr, 2), remote(lr, 2), atol=1e-1))
+
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Converts the checkpoints of the inference models into state dicts torch.load can memory map
+(CFG.mmap_weights_dir). The worker processes then map the same files read-only and share the
+page cache pages instead of every worker holding a private copy of the weights.
+
+usage (from the server folder):
+    python -m scripts.convert_checkpoints
+"""
+import argparse
+import os
+from model_config import CFG
+from models.checkpoints import convert_checkpoint
+
+
+# checkpoint path and the key of the state dict inside the checkpoint
+CHECKPOINTS = [
+    (CFG.style_transfer_encoder_path, None),
+    (CFG.style_transfer_decoder_path, None),
+    (CFG.super_resolution_model_path, "model_state"),
+    (CFG.similarity_model_path, None),
+    (CFG.super_resolution_x2_model_path, "model_state"),
+    (CFG.super_resolution_x4_model_path, "model_state"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=CFG.mmap_weights_dir)
+    args = parser.parse_args()
+    CFG.mmap_weights_dir = args.out
+
+    for path, key in CHECKPOINTS:
+        if not os.path.exists(path):
+            print(f"Skipping {path}, the checkpoint does not exist")
+            continue
+        mmap_path = convert_checkpoint(path, key)
+        print(f"{os.path.basename(path)} ({os.path.getsize(path) / 1024 ** 2:.1f} MB) -> {mmap_path} ({os.path.getsize(mmap_path) / 1024 ** 2:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
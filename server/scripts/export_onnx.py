@@ -0,0 +1,97 @@
+"""
+Exports VGG_ENCODER, VGG_DECODER, MDSR (one graph per scale) and the vgg16 similarity trunk to ONNX
+with dynamic batch and spatial axes, then checks the ONNX Runtime outputs against the PyTorch outputs.
+
+The exported models are used when the server runs with INFERENCE_BACKEND=onnxruntime.
+Needs the optional `onnx` and `onnxruntime` packages, they are not part of requirements.txt.
+
+usage (from the server folder): python -m scripts.export_onnx --opset 17
+"""
+import argparse
+import os
+import sys
+import torch
+# the reference outputs are always computed by the plain fp32 torch models, whatever the server runs with
+os.environ["EXECUTION_MODE"] = "fp32"
+os.environ["INFERENCE_BACKEND"] = "torch"
+from model_config import CFG
+from models.model_registry import load_style_transfer_model, load_super_resolution_model, load_similarity_model
+from models.quantization import SuperResolutionScale
+from models.onnx_backend import (
+    EncoderRelu41, SimilarityTrunk, OnnxModule, ONNX_ENCODER_FILE, ONNX_DECODER_FILE, ONNX_SIMILARITY_FILE,
+    ONNX_SUPER_RESOLUTION_SCALES, get_onnx_mdsr_file
+)
+
+
+def export(model, example_input, file_name, out_dir, opset, spatial_axes=True):
+    dynamic_axes = {0: "batch", 2: "height", 3: "width"} if spatial_axes else {0: "batch"}
+    path = os.path.join(out_dir, file_name)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(), (example_input,), path,
+            input_names=["input"], output_names=["output"],
+            dynamic_axes={"input": dynamic_axes, "output": dynamic_axes},
+            opset_version=opset,
+        )
+    print(f"Exported {path}")
+
+
+def check_parity(model, file_name, inputs, atol, rtol):
+    """
+    Runs the torch model and the exported graph on inputs of a different size than the export example
+    so the dynamic axes are exercised too
+    """
+    onnx_model = OnnxModule(file_name)
+    passed = True
+    with torch.no_grad():
+        for x in inputs:
+            expected, actual = model(x), onnx_model(x)
+            max_diff = (expected - actual).abs().max().item()
+            ok = expected.shape == actual.shape and torch.allclose(expected, actual, atol=atol, rtol=rtol)
+            passed = passed and ok
+            print(f"{file_name:>22} {str(tuple(x.shape)):>20} max abs diff {max_diff:.2e} {'ok' if ok else 'FAILED'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--out", default=CFG.onnx_models_dir)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument("--rtol", type=float, default=1e-3)
+    parser.add_argument("--skip-check", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    CFG.onnx_models_dir = args.out
+
+    style_model = load_style_transfer_model(precision="fp32", compile_mode="none", backend="torch").to("cpu").eval()
+    sr_model = load_super_resolution_model(precision="fp32", compile_mode="none", backend="torch").to("cpu").eval()
+    sim_model = SimilarityTrunk(load_similarity_model(backend="torch").to("cpu"))
+
+    encoder = EncoderRelu41(style_model.encoder)
+    export(encoder, torch.rand(1, 3, 256, 256), ONNX_ENCODER_FILE, args.out, args.opset)
+    export(style_model.decoder, torch.rand(1, 512, 32, 32), ONNX_DECODER_FILE, args.out, args.opset)
+    for scale in ONNX_SUPER_RESOLUTION_SCALES:
+        export(SuperResolutionScale(sr_model, scale), torch.rand(1, 3, 64, 64) * 255, get_onnx_mdsr_file(scale), args.out, args.opset)
+    # the classifier layer needs the fixed 7x7 avgpool output so only the batch axis is dynamic
+    export(sim_model, torch.rand(1, 3, 224, 224), ONNX_SIMILARITY_FILE, args.out, args.opset, spatial_axes=False)
+
+    if args.skip_check:
+        return
+
+    passed = check_parity(encoder, ONNX_ENCODER_FILE, [torch.rand(1, 3, 320, 448), torch.rand(2, 3, 512, 384)], args.atol, args.rtol)
+    passed &= check_parity(style_model.decoder, ONNX_DECODER_FILE, [torch.rand(1, 512, 40, 56), torch.rand(2, 512, 64, 48)], args.atol, args.rtol)
+    for scale in ONNX_SUPER_RESOLUTION_SCALES:
+        # mdsr outputs are in the 0-255 range
+        passed &= check_parity(SuperResolutionScale(sr_model, scale), get_onnx_mdsr_file(scale), [torch.rand(1, 3, 48, 80) * 255], args.atol * 255, args.rtol)
+    passed &= check_parity(sim_model, ONNX_SIMILARITY_FILE, [torch.rand(1, 3, 224, 224), torch.rand(3, 3, 224, 224)], args.atol, args.rtol)
+
+    if not passed:
+        print("ONNX Runtime outputs do not match the PyTorch outputs")
+        sys.exit(1)
+    print("All exported models match the PyTorch outputs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import math
+import threading
+import time
+from collections import deque, Counter, OrderedDict
+from contextlib import contextmanager
+from utils.latency_budget import OverloadedError, percentile
+from utils.metrics import admission_requests, admission_wait, admission_queue_depth
+from utils.server_timing import record_span
+
+
+# bytes per pixel of the buffers of a request: decoded RGB, float32 RGB tensor and the feature maps of
+# the first convolution blocks (two 64 channel float32 maps, the largest activations of VGG, the AdaIN
+# decoder and the MDSR/EDSR upsampler)
+RGB_BYTES = 3
+RGB_FLOAT_BYTES = 3 * 4
+FEATURE_BYTES = 2 * 64 * 4
+
+
+def estimate_style_transfer_memory(width, height, img_size, num_alphas=1, batched=False):
+    """
+    Peak memory of stylizing a width x height content image resized to img_size (None keeps the size)
+    with num_alphas alpha values, estimated from the image header before decoding.
+    batched: the request runs through the style batcher, which pads every image of a bucket to the
+    largest height and width of the batch. The request is charged the square of its longer side, the
+    padded slot of a batch mixing portrait and landscape images of the same bucket. A partner image
+    with a longer side than that still pads this slot past the estimate, the limit is per request.
+    """
+    pixels = width * height
+    scale = img_size / min(width, height) if img_size else 1
+    model_pixels = pixels * scale ** 2
+    if batched:
+        model_pixels = (math.ceil(max(width, height) * scale / 8) * 8) ** 2
+    # encoder/decoder activations of every alpha, every output resized back to the original size
+    return int(model_pixels * (RGB_BYTES + RGB_FLOAT_BYTES + num_alphas * FEATURE_BYTES) + num_alphas * pixels * (RGB_FLOAT_BYTES + RGB_BYTES))
+
+
+def estimate_super_resolution_memory(width, height, scale, tile_size=0, overlap=0, num_workers=1):
+    """
+    Peak memory of upscaling a width x height image by scale, with tiling only the tiles in flight hold activations
+    """
+    pixels = width * height
+    model_pixels = pixels
+    if tile_size > 0:
+        model_pixels = min(pixels, (tile_size + 2 * overlap) ** 2 * max(num_workers, 1))
+    output_pixels = pixels * scale ** 2
+    return int(pixels * (RGB_BYTES + RGB_FLOAT_BYTES) + model_pixels * scale ** 2 * FEATURE_BYTES + output_pixels * (RGB_FLOAT_BYTES + RGB_BYTES))
+
+
+class AdmissionError(OverloadedError):
+    """
+    Raised when a request is not admitted, status is 429 when the user is over its own limits and
+    503 when the server is saturated
+    """
+
+    def __init__(self, message, retry_after, status):
+        super().__init__(message, retry_after)
+        self.status = status
+
+
+def parse_tier_weights(value):
+    """
+    "ultimate:4,pro:1" -> {"ultimate": 4.0, "pro": 1.0}
+    """
+    weights = {}
+    for item in value.split(","):
+        if item.strip():
+            tier, weight = item.split(":")
+            weights[tier.strip().lower()] = float(weight)
+    return weights
+
+
+class AdmissionTicket:
+    def __init__(self, user_id, memory, tier):
+        self.user_id = user_id
+        self.memory = memory
+        self.tier = tier
+        self.granted = False
+        self.queued_at = time.perf_counter()
+
+
+class TierQueue:
+    """
+    Waiting requests of one tier, one FIFO per user served round robin
+    """
+
+    def __init__(self, weight):
+        self.weight = weight
+        # virtual time of the tier, advanced by 1 / weight for every admitted request
+        self.virtual_time = 0.0
+        self.users = OrderedDict()
+        self.waits = deque(maxlen=512)
+        self.admitted = 0
+
+    def __len__(self):
+        return sum(len(tickets) for tickets in self.users.values())
+
+
+class AdmissionController:
+    """
+    Bounds the inference running in this process by count (max_concurrent) and estimated memory
+    (max_memory bytes), and per user (max_per_user running requests).
+
+    Requests which can not start right away wait in a queue of at most max_queue requests
+    (max_queued_per_user per user) for at most max_wait seconds. The queue is scheduled by weighted
+    fair queuing between the subscription tiers (tier_weights, ultimate:4,pro:1 admits about 4 ultimate
+    requests for every pro request while both wait) and round robin between the users of a tier.
+    A request waiting longer than starvation_after seconds is admitted before any other so lower
+    tiers keep making progress. The request picked next waiting for memory blocks the others so
+    large images are not starved by small ones, requests only waiting for their own user's slot
+    are skipped. A request larger than max_memory runs once nothing else is running. A limit of 0
+    disables it.
+    """
+
+    def __init__(self, max_concurrent=4, max_memory=0, max_per_user=2, max_queue=16, max_queued_per_user=2, max_wait=30.0,
+                 tier_weights=None, default_tier="pro", starvation_after=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_memory = max_memory
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.max_wait = max_wait
+        self.default_tier = default_tier
+        self.starvation_after = starvation_after
+
+        self._cond = threading.Condition()
+        # every waiting request in arrival order, the oldest ones are checked for starvation
+        self._queue = deque()
+        self._tiers = {tier: TierQueue(weight) for tier, weight in (tier_weights or {}).items()}
+        self._tiers.setdefault(default_tier, TierQueue(1.0))
+        # virtual time of the last admitted request, idle tiers restart from it instead of their old (lower) time
+        self._virtual_time = 0.0
+        self._running = 0
+        self._memory = 0
+        self._user_running = Counter()
+        self._user_queued = Counter()
+        self._results = Counter()
+        self._starved = 0
+        # service time of the last requests, used for Retry-After
+        self._durations = deque(maxlen=64)
+
+    def _get_tier(self, tier):
+        tier = (tier or self.default_tier).lower()
+        return tier if tier in self._tiers else self.default_tier
+
+    def _fits(self, ticket):
+        if self.max_concurrent > 0 and self._running >= self.max_concurrent:
+            return False
+        if self.max_memory > 0 and self._running > 0 and self._memory + ticket.memory > self.max_memory:
+            return False
+        return True
+
+    def _user_full(self, user_id):
+        return self.max_per_user > 0 and self._user_running[user_id] >= self.max_per_user
+
+    def _start(self, ticket):
+        ticket.granted = True
+        self._running += 1
+        self._memory += ticket.memory
+        self._user_running[ticket.user_id] += 1
+
+    def _enqueue(self, ticket):
+        tier_queue = self._tiers[ticket.tier]
+        if not tier_queue.users:
+            tier_queue.virtual_time = max(tier_queue.virtual_time, self._virtual_time)
+        tier_queue.users.setdefault(ticket.user_id, deque()).append(ticket)
+        self._queue.append(ticket)
+        self._user_queued[ticket.user_id] += 1
+
+    def _dequeue(self, ticket):
+        self._queue.remove(ticket)
+        self._user_queued[ticket.user_id] -= 1
+        if self._user_queued[ticket.user_id] <= 0:
+            del self._user_queued[ticket.user_id]
+
+        users = self._tiers[ticket.tier].users
+        users[ticket.user_id].remove(ticket)
+        if users[ticket.user_id]:
+            # the user goes after the other users of its tier
+            users.move_to_end(ticket.user_id)
+        else:
+            del users[ticket.user_id]
+
+    def _next(self):
+        """
+        Request to admit next: the oldest starved one, otherwise the first user's oldest request of the
+        tier with the lowest virtual time (users at their own limit are skipped)
+        """
+        now = time.perf_counter()
+        if self.starvation_after > 0:
+            for ticket in self._queue:
+                if now - ticket.queued_at < self.starvation_after:
+                    break
+                if not self._user_full(ticket.user_id):
+                    return ticket, True
+
+        best = None
+        for tier_queue in self._tiers.values():
+            if best is not None and tier_queue.virtual_time >= best[0]:
+                continue
+            for user_id, tickets in tier_queue.users.items():
+                if not self._user_full(user_id):
+                    best = (tier_queue.virtual_time, tickets[0])
+                    break
+        return (best[1], False) if best is not None else (None, False)
+
+    def _grant(self):
+        granted = False
+        while self._queue:
+            ticket, starved = self._next()
+            if ticket is None or not self._fits(ticket):
+                break
+            self._dequeue(ticket)
+            self._start(ticket)
+
+            tier_queue = self._tiers[ticket.tier]
+            self._virtual_time = max(self._virtual_time, tier_queue.virtual_time)
+            tier_queue.virtual_time += 1 / tier_queue.weight
+            self._starved += starved
+            granted = True
+        admission_queue_depth.set(len(self._queue))
+        if granted:
+            self._cond.notify_all()
+
+    def retry_after(self):
+        """
+        Seconds until the queue ahead of a new request is likely drained
+        """
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(average * (len(self._queue) + 1) / max(self.max_concurrent, 1)))
+
+    def _reject(self, ticket, result, message, status):
+        self._results[result] += 1
+        admission_requests.labels(ticket.tier, result).inc()
+        return AdmissionError(message, retry_after=self.retry_after(), status=status)
+
+    def _record_admitted(self, ticket, result, wait):
+        tier_queue = self._tiers[ticket.tier]
+        tier_queue.waits.append(wait)
+        tier_queue.admitted += 1
+        self._results[result] += 1
+        admission_requests.labels(ticket.tier, result).inc()
+        admission_wait.labels(ticket.tier).observe(wait)
+
+    def _acquire(self, user_id, memory, tier):
+        with self._cond:
+            ticket = AdmissionTicket(user_id, memory, self._get_tier(tier))
+            if not self._queue and not self._user_full(user_id) and self._fits(ticket):
+                self._start(ticket)
+                self._record_admitted(ticket, "admitted", 0.0)
+                return ticket
+
+            if self.max_queued_per_user > 0 and self._user_queued[user_id] >= self.max_queued_per_user:
+                raise self._reject(ticket, "rejected_user", "Too many image processing requests in progress, try again later", 429)
+            if self.max_queue > 0 and len(self._queue) >= self.max_queue:
+                raise self._reject(ticket, "rejected_queue", "Server is busy, try again later", 503)
+
+            self._enqueue(ticket)
+            # a request of a higher tier may be admitted before the ones already waiting for a free slot
+            self._grant()
+            deadline = time.monotonic() + self.max_wait
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._dequeue(ticket)
+                    # the request may have blocked the ones behind it
+                    self._grant()
+                    raise self._reject(ticket, "timed_out", f"Server is busy, the request waited {self.max_wait:.0f}s", 503)
+                self._cond.wait(remaining)
+
+            wait = time.perf_counter() - ticket.queued_at
+            self._record_admitted(ticket, "queued", wait)
+            record_span("admission", 1000 * wait)
+            return ticket
+
+    def _release(self, ticket, duration):
+        with self._cond:
+            self._running -= 1
+            self._memory -= ticket.memory
+            self._user_running[ticket.user_id] -= 1
+            if self._user_running[ticket.user_id] <= 0:
+                del self._user_running[ticket.user_id]
+            self._durations.append(duration)
+            self._grant()
+
+    @contextmanager
+    def admit(self, user_id, memory, tier=None):
+        """
+        Runs the block once the request is admitted, raises AdmissionError when it is rejected
+        memory: estimated peak memory of the request in bytes (see estimate_*_memory)
+        tier: subscription plan of the user, unknown tiers are scheduled as default_tier
+        """
+        ticket = self._acquire(user_id, memory, tier)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(ticket, time.perf_counter() - start)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": len(self._queue),
+                "memory_mb": round(self._memory / 1024 ** 2, 1),
+                "max_concurrent": self.max_concurrent,
+                "max_memory_mb": round(self.max_memory / 1024 ** 2, 1),
+                "users_running": len(self._user_running),
+                "results": dict(self._results),
+                "starved": self._starved,
+                "retry_after": self.retry_after(),
+                # wait of the last admitted requests per tier, compare with the latency targets of the paid tiers
+                "tiers": {
+                    tier: {
+                        "weight": tier_queue.weight,
+                        "queued": len(tier_queue),
+                        "admitted": tier_queue.admitted,
+                        "p50_wait_ms": round(1000 * percentile(list(tier_queue.waits), 0.5), 1) if tier_queue.waits else None,
+                        "p95_wait_ms": round(1000 * percentile(list(tier_queue.waits), 0.95), 1) if tier_queue.waits else None,
+                    }
+                    for tier, tier_queue in self._tiers.items()
+                },
+            }
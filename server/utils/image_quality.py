@@ -0,0 +1,43 @@
+import torch
+import torch.nn.functional as F
+
+
+def calculate_psnr(img1, img2, max_value=1.0):
+    """
+    img1, img2: (B, C, H, W) or (C, H, W) tensors in [0, max_value]
+    """
+    mse = F.mse_loss(img1.float(), img2.float())
+    if mse == 0:
+        return float("inf")
+    return (10 * torch.log10(max_value ** 2 / mse)).item()
+
+
+def gaussian_window(size=11, sigma=1.5):
+    coords = torch.arange(size, dtype=torch.float32) - size // 2
+    g = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    g = g / g.sum()
+    return g.view(-1, 1) * g.view(1, -1)
+
+
+def calculate_ssim(img1, img2, max_value=1.0, window_size=11):
+    """
+    Mean structural similarity computed per channel with a gaussian window
+
+    img1, img2: (B, C, H, W) or (C, H, W) tensors in [0, max_value]
+    """
+    if img1.dim() == 3:
+        img1, img2 = img1.unsqueeze(0), img2.unsqueeze(0)
+    img1, img2 = img1.float(), img2.float()
+
+    C = img1.shape[1]
+    window = gaussian_window(window_size).to(img1.device).expand(C, 1, window_size, window_size)
+    c1, c2 = (0.01 * max_value) ** 2, (0.03 * max_value) ** 2
+
+    mu1 = F.conv2d(img1, window, groups=C)
+    mu2 = F.conv2d(img2, window, groups=C)
+    sigma1 = F.conv2d(img1 * img1, window, groups=C) - mu1 ** 2
+    sigma2 = F.conv2d(img2 * img2, window, groups=C) - mu2 ** 2
+    sigma12 = F.conv2d(img1 * img2, window, groups=C) - mu1 * mu2
+
+    ssim_map = ((2 * mu1 * mu2 + c1) * (2 * sigma12 + c2)) / ((mu1 ** 2 + mu2 ** 2 + c1) * (sigma1 + sigma2 + c2))
+    return ssim_map.mean().item()
@@ -0,0 +1,187 @@
+import sys
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client
+from multiprocessing.shared_memory import SharedMemory
+import torch
+from model_config import CFG
+
+
+# methods the web workers are allowed to call on the models held by the inference service
+ALLOWED_METHODS = {
+    "style_transfer": {"encode_content", "encode_content_batch", "decode_batch", "decode_alphas", "calculate_style_stats", "stylize_image_with_stats"},
+    "super_resolution": {"__call__", "forward_tiled"},
+    "super_resolution_fast": {"__call__", "forward_tiled"},
+    "similarity": {"__call__"},
+}
+
+
+def create_shared_memory(size, track=True):
+    if sys.version_info >= (3, 13):
+        return SharedMemory(create=True, size=size, track=track)
+
+    shm = SharedMemory(create=True, size=size)
+    if not track:
+        # the block is unlinked by the process which receives it
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def attach_shared_memory(name, track=True):
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=track)
+
+    shm = SharedMemory(name=name)
+    if not track:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def pack_tensors(obj, blocks, track=True):
+    """
+    Replaces every tensor in (nested lists/tuples/dicts of) obj by a descriptor of a shared memory
+    block holding its data, so only the small descriptors go through the socket. The created
+    blocks are appended to `blocks`.
+    """
+    if isinstance(obj, torch.Tensor):
+        tensor = obj.detach().to("cpu").contiguous()
+        shm = create_shared_memory(max(tensor.numel() * tensor.element_size(), 1), track=track)
+        if tensor.numel():
+            torch.frombuffer(shm.buf, dtype=tensor.dtype, count=tensor.numel()).copy_(tensor.view(-1))
+        blocks.append(shm)
+        return {"__shm__": shm.name, "shape": list(tensor.shape), "dtype": str(tensor.dtype).replace("torch.", "")}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(pack_tensors(o, blocks, track) for o in obj)
+    if isinstance(obj, dict):
+        return {k: pack_tensors(v, blocks, track) for k, v in obj.items()}
+    return obj
+
+
+def unpack_tensors(obj, unlink=False, track=True, device="cpu"):
+    """
+    Inverse of pack_tensors, copies the shared memory blocks into regular tensors
+    """
+    if isinstance(obj, dict) and "__shm__" in obj:
+        shm = attach_shared_memory(obj["__shm__"], track=track)
+        try:
+            numel = 1
+            for dim in obj["shape"]:
+                numel *= dim
+            dtype = getattr(torch, obj["dtype"])
+            tensor = torch.frombuffer(shm.buf, dtype=dtype, count=numel).clone() if numel else torch.empty(0, dtype=dtype)
+        finally:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        return tensor.view(obj["shape"]).to(device)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(unpack_tensors(o, unlink, track, device) for o in obj)
+    if isinstance(obj, dict):
+        return {k: unpack_tensors(v, unlink, track, device) for k, v in obj.items()}
+    return obj
+
+
+class InferenceClient:
+    """
+    Sends model calls from the web workers to the inference service over a unix socket.
+    Every thread uses its own connection, tensors are passed through shared memory.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, request):
+        conn = self._connection()
+        try:
+            conn.send(request)
+            # the service fails requests after INFERENCE_REQUEST_TIMEOUT, waiting longer means it is stuck
+            if not conn.poll(CFG.inference_request_timeout + 30):
+                raise TimeoutError("Inference service did not answer")
+            return conn.recv()
+        except (EOFError, OSError):
+            # the service restarted or hangs (TimeoutError), reconnect on the next call
+            self._local.conn = None
+            conn.close()
+            raise
+
+    def call(self, model_name, method, *args, **kwargs):
+        blocks = []
+        try:
+            request = ("call", model_name, method, pack_tensors(args, blocks), pack_tensors(kwargs, blocks))
+            ok, result = self._request(request)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        if not ok:
+            raise RuntimeError(f"Inference service error: {result}")
+        return unpack_tensors(result, unlink=True, device=CFG.device)
+
+    def stats(self):
+        ok, result = self._request(("stats",))
+        return result
+
+
+class RemoteModel:
+    """
+    Stand-in for a model held by the inference service, only forwards the allowed methods
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.backend = "inference_service"
+
+    def _call(self, method, *args, **kwargs):
+        return self.client.call(self.name, method, *args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        return self._call("__call__", *args, **kwargs)
+
+    def eval(self):
+        return self
+
+    def parameters(self):
+        return iter(())
+
+    def state_dict(self):
+        return {}
+
+
+class RemoteStyleTransferModel(RemoteModel):
+    def encode_content(self, content_img):
+        return self._call("encode_content", content_img)
+
+    def encode_content_batch(self, content_imgs):
+        return self._call("encode_content_batch", content_imgs)
+
+    def decode_batch(self, content_features, style_stats, alphas, sizes):
+        return self._call("decode_batch", content_features, style_stats, alphas, sizes)
+
+    def decode_alphas(self, content_features, style_mean, style_std, alphas):
+        return self._call("decode_alphas", content_features, style_mean, style_std, alphas)
+
+    def calculate_style_stats(self, style_img):
+        return self._call("calculate_style_stats", style_img)
+
+    def stylize_image_with_stats(self, content_img, style_mean, style_std, alpha=0.5):
+        return self._call("stylize_image_with_stats", content_img, style_mean, style_std, alpha=alpha)
+
+
+class RemoteSuperResolutionModel(RemoteModel):
+    def forward_tiled(self, x, scale, tile_size=256, overlap=16, num_workers=1, progress=None):
+        # callbacks can not cross the process boundary, the tiles run as a single call in the service
+        return self._call("forward_tiled", x, scale, tile_size=tile_size, overlap=overlap, num_workers=num_workers)
+
+
+inference_client = InferenceClient(CFG.inference_service_address, CFG.inference_service_authkey.encode()) if CFG.inference_service_address else None
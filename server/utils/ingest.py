@@ -0,0 +1,131 @@
+import io
+import threading
+import time
+from PIL import Image
+from model_config import CFG
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised before decoding when the image has more pixels than CFG.max_image_pixels
+    """
+
+    def __init__(self, width, height, max_pixels):
+        super().__init__(f"Image is too large ({width}x{height}), at most {max_pixels / 1e6:.0f} megapixels are allowed")
+        self.width = width
+        self.height = height
+
+
+class IngestMetrics:
+    """
+    Decode time and decoded memory of the images opened by this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.drafted = 0
+        self.reduced = 0
+        self.rejected = 0
+        self.decode_ms = 0.0
+        self.max_decode_ms = 0.0
+        self.decoded_bytes = 0
+        self.full_bytes = 0
+
+    def record(self, stats):
+        with self._lock:
+            self.images += 1
+            self.drafted += stats["draft"]
+            self.reduced += stats["reduce"] > 1
+            self.decode_ms += stats["decode_ms"]
+            self.max_decode_ms = max(self.max_decode_ms, stats["decode_ms"])
+            self.decoded_bytes += stats["decoded_bytes"]
+            self.full_bytes += stats["full_bytes"]
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "drafted": self.drafted,
+                "reduced": self.reduced,
+                "rejected": self.rejected,
+                "avg_decode_ms": round(self.decode_ms / self.images, 2) if self.images else None,
+                "max_decode_ms": round(self.max_decode_ms, 2),
+                "decoded_mb": round(self.decoded_bytes / 1024 ** 2, 1),
+                # what a full resolution decode of the same images would have taken
+                "full_decode_mb": round(self.full_bytes / 1024 ** 2, 1),
+            }
+
+
+ingest_metrics = IngestMetrics()
+
+
+def probe_image(data, max_pixels=None):
+    """
+    Opens the image lazily (only the header is read) and rejects it when it has too many pixels
+    """
+    max_pixels = CFG.max_image_pixels if max_pixels is None else max_pixels
+    image = Image.open(io.BytesIO(data))
+    if max_pixels > 0 and image.width * image.height > max_pixels:
+        ingest_metrics.record_rejected()
+        raise ImageTooLargeError(image.width, image.height, max_pixels)
+    return image
+
+
+def get_draft_size(width, height, min_side):
+    """
+    Smallest size keeping the aspect ratio whose shorter side is at least min_side
+    """
+    shorter = min(width, height)
+    if shorter <= min_side:
+        return width, height
+    # rounded up so the shorter side does not end below min_side
+    return -(-width * min_side // shorter), -(-height * min_side // shorter)
+
+
+def open_image(data, min_side=None, max_pixels=None):
+    """
+    Decodes the image bytes to RGB.
+
+    min_side: shorter side the image is resized to afterwards (None keeps the full resolution). JPEGs
+    are decoded by libjpeg directly at the smallest 1/2, 1/4 or 1/8 scale whose shorter side is still
+    at least min_side (draft), what remains of a large reduction is done with an integer box filter
+    (reduce), so the later resize never upsamples.
+
+    returns the RGB image, the (width, height) of the source image and the decode stats
+    """
+    start = time.perf_counter()
+    image = probe_image(data, max_pixels=max_pixels)
+    source_size = image.size
+    source_format = image.format
+
+    drafted = False
+    if min_side and CFG.ingest_draft and source_format == "JPEG" and min(source_size) > min_side:
+        image.draft("RGB", get_draft_size(*source_size, min_side))
+        drafted = image.size != source_size
+
+    image = image.convert("RGB")
+
+    factor = 1
+    if min_side and CFG.ingest_draft:
+        factor = min(image.size) // min_side
+        if factor > 1:
+            image = image.reduce(factor)
+
+    stats = {
+        "format": source_format,
+        "source_size": source_size,
+        "decoded_size": image.size,
+        "draft": drafted,
+        "reduce": max(factor, 1),
+        "decode_ms": 1000 * (time.perf_counter() - start),
+        "decoded_bytes": image.width * image.height * 3,
+        "full_bytes": source_size[0] * source_size[1] * 3,
+    }
+    ingest_metrics.record(stats)
+    return image, source_size, stats
+
@@ -0,0 +1,269 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from model_config import CFG
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class JobQueue:
+    """
+    Local job queue backed by SQLite and the filesystem, shared by every worker process on the host.
+
+    `submit` stores the input files under `jobs_dir/<job_id>/` and a row in `jobs_dir/jobs.db`.
+    Worker threads (started in every process with `start`) claim the oldest queued job inside
+    an immediate transaction so a job only runs once, call the handler registered for its kind
+    and store the outputs next to the inputs. Finished jobs and their files are deleted after
+    `result_ttl` seconds, running jobs older than `job_timeout` are marked failed (their
+    process died).
+
+    handler(job, inputs, progress) receives the job row, the input files ({name: bytes}) and a
+    callable taking a progress value between 0 and 1. It returns ({name: bytes} outputs, result dict).
+    on_success(job, result) is called once the outputs are stored.
+    """
+
+    def __init__(self, jobs_dir, num_workers=1, result_ttl=3600, job_timeout=900, poll_interval=0.5):
+        self.jobs_dir = jobs_dir
+        self.db_path = os.path.join(jobs_dir, "jobs.db")
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self.job_timeout = job_timeout
+        self.poll_interval = poll_interval
+
+        self._handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def register(self, kind, handler, on_success=None):
+        self._handlers[kind] = (handler, on_success)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run_worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._run_cleanup, name="job-cleanup", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, user_id, params, inputs):
+        if kind not in self._handlers:
+            raise KeyError(f"No handler registered for {kind} jobs")
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        for name, data in inputs.items():
+            with open(os.path.join(job_dir, f"input_{name}"), "wb") as f:
+                f.write(data)
+
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, user_id, status, params, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, str(user_id), JOB_QUEUED, json.dumps(params), time.time()),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        Long polling, returns the job once it finished or the timeout expired
+        """
+        deadline = time.time() + timeout
+        job = self.get(job_id)
+        while job is not None and job["status"] not in FINISHED_STATUSES and time.time() < deadline:
+            time.sleep(min(self.poll_interval, max(deadline - time.time(), 0)))
+            job = self.get(job_id)
+        return job
+
+    def read_output(self, job_id, name):
+        path = os.path.join(self._job_dir(job_id), f"output_{name}")
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def count_active(self, user_id, kind):
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND kind = ? AND status IN (?, ?)",
+                (str(user_id), kind, JOB_QUEUED, JOB_RUNNING),
+            ).fetchone()[0]
+
+    def queue_depth(self, kind):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = ?", (kind, JOB_QUEUED)).fetchone()[0]
+
+    def set_progress(self, job_id, progress):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE job_id = ?", (round(min(max(progress, 0.0), 1.0), 4), job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        """
+        returns False when the job is no longer running (cleanup failed it after job_timeout)
+        """
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, progress = CASE WHEN ? THEN 1 ELSE progress END WHERE job_id = ? AND status = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), status == JOB_DONE, job_id, JOB_RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def _claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND kind IN ({','.join('?' * len(self._handlers))}) ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, *self._handlers),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ?", (JOB_RUNNING, time.time(), row["job_id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def _run_job(self, job):
+        handler, on_success = self._handlers[job["kind"]]
+        job_dir = self._job_dir(job["job_id"])
+        inputs = {}
+        for file_name in os.listdir(job_dir):
+            if file_name.startswith("input_"):
+                with open(os.path.join(job_dir, file_name), "rb") as f:
+                    inputs[file_name[len("input_"):]] = f.read()
+
+        try:
+            outputs, result = handler(job, inputs, lambda progress: self.set_progress(job["job_id"], progress))
+            for name, data in outputs.items():
+                tmp_path = os.path.join(job_dir, f"output_{name}.tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(job_dir, f"output_{name}"))
+        except Exception as e:
+            print(f"Job {job['job_id']} ({job['kind']}) failed: {str(e)}")
+            self._finish(job["job_id"], JOB_FAILED, error=str(e))
+            return
+
+        if not self._finish(job["job_id"], JOB_DONE, result=result):
+            print(f"Job {job['job_id']} ({job['kind']}) finished after it timed out")
+            return
+        if on_success is not None:
+            try:
+                on_success(job, result)
+            except Exception as e:
+                print(f"on_success of job {job['job_id']} failed: {str(e)}")
+
+    def _run_worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Failed to claim a job: {str(e)}")
+                job = None
+
+            if job is None:
+                # jobs submitted by other processes are picked up on the next poll
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._run_job(job)
+
+    def cleanup(self):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND started_at < ?",
+                (JOB_FAILED, "Job timed out", now, JOB_RUNNING, now - self.job_timeout),
+            )
+            expired = [row["job_id"] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED_STATUSES, now - self.result_ttl),
+            )]
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+
+        for job_id in expired:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        return len(expired)
+
+    def _run_cleanup(self):
+        while True:
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Job cleanup failed: {str(e)}")
+            time.sleep(60)
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+
+
+job_queue = JobQueue(
+    CFG.jobs_dir,
+    num_workers=CFG.job_workers,
+    result_ttl=CFG.job_result_ttl,
+    job_timeout=CFG.job_timeout,
+)
@@ -0,0 +1,117 @@
+import math
+import threading
+import time
+from collections import deque, Counter
+from contextlib import contextmanager
+
+
+class OverloadedError(Exception):
+    """
+    Raised when a request can not meet the latency budget even at the smallest resolution
+    """
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+class LatencyBudget:
+    """
+    Picks the largest content resolution whose predicted latency fits a p95 target.
+
+    Every finished request records its latency divided by the pixels it had to wait for (its own
+    plus the pixels of the requests already in flight when it started). The p95 of these per pixel
+    costs over the last `window_sec` seconds times the pixels in flight plus the candidate's pixels
+    predicts the latency of a new request. Until `min_samples` requests finished the largest
+    resolution is used.
+    """
+
+    def __init__(self, target_ms, window_sec=120, min_samples=5, shed_factor=2.0):
+        self.target_ms = target_ms
+        self.window_sec = window_sec
+        self.min_samples = min_samples
+        self.shed_factor = shed_factor
+
+        self._lock = threading.Lock()
+        self._samples = deque()  # (finished_at, seconds per pixel, latency seconds)
+        self._pending_pixels = 0
+        self._in_flight = 0
+        self._resolutions = Counter()
+        self._shed = 0
+
+    def _trim(self, now):
+        while self._samples and now - self._samples[0][0] > self.window_sec:
+            self._samples.popleft()
+
+    def cost_per_pixel(self):
+        with self._lock:
+            self._trim(time.time())
+            if len(self._samples) < self.min_samples:
+                return None
+            return percentile([cost for _, cost, _ in self._samples], 0.95)
+
+    def choose(self, candidates, allow_shed=True):
+        """
+        candidates: [(resolution, pixels)] from the largest to the smallest resolution
+        returns the chosen (resolution, pixels) and the predicted latency in ms (None without enough samples)
+        """
+        cost = self.cost_per_pixel()
+        if cost is None:
+            return candidates[0], None
+
+        pending_pixels = self._pending_pixels
+        for resolution, pixels in candidates:
+            predicted_ms = 1000 * cost * (pending_pixels + pixels)
+            if predicted_ms <= self.target_ms:
+                return (resolution, pixels), predicted_ms
+
+        # degrade to the smallest resolution, unless even that is far over the budget
+        if allow_shed and self.shed_factor > 0 and predicted_ms > self.shed_factor * self.target_ms:
+            with self._lock:
+                self._shed += 1
+            raise OverloadedError(
+                f"Server is busy, the request would take about {predicted_ms / 1000:.1f}s", retry_after=math.ceil(predicted_ms / 1000),
+            )
+        return candidates[-1], predicted_ms
+
+    @contextmanager
+    def track(self, resolution, pixels):
+        """
+        Wraps the inference of a request at the chosen resolution and records its latency
+        """
+        with self._lock:
+            waiting_pixels = self._pending_pixels + pixels
+            self._pending_pixels += pixels
+            self._in_flight += 1
+            self._resolutions[resolution] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self._pending_pixels -= pixels
+                self._in_flight -= 1
+                self._samples.append((time.time(), latency / max(waiting_pixels, 1), latency))
+
+    def metrics(self):
+        with self._lock:
+            self._trim(time.time())
+            latencies = [latency for _, _, latency in self._samples]
+            costs = [cost for _, cost, _ in self._samples]
+            return {
+                "target_ms": self.target_ms,
+                "in_flight": self._in_flight,
+                "pending_megapixels": round(self._pending_pixels / 1e6, 3),
+                "p95_latency_ms": round(1000 * percentile(latencies, 0.95), 1) if latencies else None,
+                "p95_ms_per_megapixel": round(1e9 * percentile(costs, 0.95), 1) if costs else None,
+                "samples": len(self._samples),
+                "resolutions": {str(k): v for k, v in self._resolutions.items()},
+                "shed": self._shed,
+            }
@@ -0,0 +1,34 @@
+import threading
+from contextlib import contextmanager
+from utils.metrics import inference_in_flight
+
+
+class InFlightCounter:
+    """
+    Thread safe count of the requests currently running a piece of work in this process,
+    exported as inference_in_flight{model=name} summed over the processes when name is given
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+        self._gauge = inference_in_flight.labels(name) if name is not None else None
+
+    @property
+    def value(self):
+        return self._value
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self._value += 1
+        if self._gauge is not None:
+            self._gauge.inc()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._value -= 1
+            if self._gauge is not None:
+                self._gauge.dec()
@@ -0,0 +1,158 @@
+"""
+Prometheus metrics of the Flask app, served by /metrics (see main.py).
+
+Under gunicorn every worker process keeps its own values. Set PROMETHEUS_MULTIPROC_DIR (an empty
+directory, cleared before gunicorn starts) in the environment of the workers and the values are
+written to memory mapped files there and summed over all the workers on every scrape.
+"""
+import os
+import re
+import time
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from flask import Response, g, request
+from model_config import CFG
+
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# requests range from milliseconds (auth, projects) to minutes (4x super resolution)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+http_requests = Counter(
+    "http_requests_total", "Finished HTTP requests", ["endpoint", "method", "status"],
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["endpoint", "method"], buckets=LATENCY_BUCKETS,
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being served", ["endpoint"], multiprocess_mode="livesum",
+)
+span_duration = Histogram(
+    "span_duration_seconds", "Duration of the request stages (Server-Timing spans)", ["endpoint", "span"], buckets=LATENCY_BUCKETS,
+)
+inference_in_flight = Gauge(
+    "inference_in_flight", "Requests running a model", ["model"], multiprocess_mode="livesum",
+)
+style_batch_size = Histogram(
+    "style_batch_size", "Requests per style transfer batch", buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+style_batch_queue_wait = Histogram(
+    "style_batch_queue_wait_seconds", "Time a style transfer request waited for its batch", buckets=LATENCY_BUCKETS,
+)
+style_batch_queue_depth = Gauge(
+    "style_batch_queue_depth", "Style transfer requests waiting for a batch", multiprocess_mode="livesum",
+)
+cache_lookups = Counter(
+    "cache_lookups_total", "Cache lookups by result (hit, disk_hit or miss)", ["cache", "result"],
+)
+result_cache_requests = Counter(
+    "result_cache_requests_total", "Results by source (computed, cached or coalesced)", ["source"],
+)
+admission_requests = Counter(
+    "admission_requests_total", "Image processing requests by subscription tier and admission result", ["tier", "result"],
+)
+admission_wait = Histogram(
+    "admission_wait_seconds", "Time an image processing request waited to be admitted", ["tier"], buckets=LATENCY_BUCKETS,
+)
+admission_queue_depth = Gauge(
+    "admission_queue_depth", "Image processing requests waiting to be admitted", multiprocess_mode="livesum",
+)
+
+
+def get_endpoint_label():
+    # requests which matched no route share one label, the raw path would make the label unbounded
+    return request.endpoint or "not_found"
+
+
+def record_cache_lookup(cache, result):
+    cache_lookups.labels(cache, result).inc()
+
+
+def record_span_metric(endpoint, name, ms):
+    span_duration.labels(endpoint, name).observe(ms / 1000)
+
+
+class JobQueueCollector:
+    """
+    Jobs per status, read from the SQLite queue shared by all the processes at scrape time
+    """
+
+    def collect(self):
+        from utils.job_queue import job_queue
+
+        jobs = GaugeMetricFamily("jobs", "Asynchronous jobs by status", labels=["status"])
+        for status, count in job_queue.stats().items():
+            jobs.add_metric([status], count)
+        yield jobs
+
+
+job_queue_registry = CollectorRegistry()
+job_queue_registry.register(JobQueueCollector())
+
+
+def remove_dead_processes():
+    """
+    Drops the live gauges of worker processes which exited (gunicorn restarts workers)
+    """
+    for file_name in os.listdir(MULTIPROC_DIR):
+        match = re.match(r"gauge_live\w+_(\d+)\.db$", file_name)
+        if match is None:
+            continue
+        pid = int(match.group(1))
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
+        except PermissionError:
+            pass
+
+
+def metrics_response():
+    if CFG.metrics_token and request.headers.get("Authorization") != f"Bearer {CFG.metrics_token}":
+        return Response("Unauthorized", status=401)
+
+    if MULTIPROC_DIR:
+        remove_dead_processes()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry) + generate_latest(job_queue_registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """
+    Counts, times and tracks in flight every request of the app
+    """
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics_start = time.perf_counter()
+        g._metrics_endpoint = get_endpoint_label()
+        http_requests_in_flight.labels(g._metrics_endpoint).inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        endpoint = g.get("_metrics_endpoint")
+        if endpoint is not None:
+            http_requests.labels(endpoint, request.method, str(response.status_code)).inc()
+            http_request_duration.labels(endpoint, request.method).observe(time.perf_counter() - g._metrics_start)
+            g._metrics_recorded = True
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        endpoint = g.get("_metrics_endpoint")
+        if endpoint is None:
+            return
+        http_requests_in_flight.labels(endpoint).dec()
+        # unhandled exceptions skip after_request
+        if not g.get("_metrics_recorded"):
+            http_requests.labels(endpoint, request.method, "500").inc()
+            http_request_duration.labels(endpoint, request.method).observe(time.perf_counter() - g._metrics_start)
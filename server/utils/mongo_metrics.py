@@ -0,0 +1,48 @@
+"""
+Mongo command latency, kept apart from utils/metrics.py so the modules which only need the
+database (config/db_config.py) do not import flask, the model config and torch.
+"""
+import os
+import threading
+from prometheus_client import Histogram
+from pymongo import monitoring
+
+
+# the values of the worker processes are written there (see utils/metrics.py)
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency", ["command", "collection", "status"], buckets=MONGO_BUCKETS,
+)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Times every command of the MongoClient it is passed to (event_listeners)
+    """
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finished(self, event, status):
+        with self._lock:
+            collection = self._collections.pop(event.request_id, "")
+        mongo_command_duration.labels(event.command_name, collection, status).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event, "ok")
+
+    def failed(self, event):
+        self._finished(event, "error")
+
+
+mongo_command_listener = MongoCommandListener()
@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+import torch
+import torch.nn.functional as F
+from utils.server_timing import record_span
+
+
+class StageTimings:
+    """
+    Wall time of the stages of a request in ms, stages entered several times add up.
+    Every stage is also recorded as a span (Server-Timing header and in-process aggregate).
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = 1000 * (time.perf_counter() - start)
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+            record_span(name, ms)
+
+    def __str__(self):
+        return ", ".join(f"{name} {ms:.1f}ms" for name, ms in self.stages.items())
+
+
+def resize_tensor(image, size):
+    """
+    image: (C, H, W) float tensor, size: (height, width)
+    bicubic with antialiasing like PIL's resize (in float32, also for half precision outputs),
+    a no-op when the image already has that size
+    """
+    if tuple(image.shape[-2:]) == tuple(size):
+        return image
+    return F.interpolate(image.unsqueeze(0).float(), size=tuple(size), mode="bicubic", align_corners=False, antialias=True)[0]
+
+
+def quantize(image, max_value=1.0):
+    """
+    Float image in [0, max_value] to uint8, the scaled copy is rounded and clamped in place before the cast
+    """
+    return torch.mul(image, 255 / max_value).round_().clamp_(0, 255).to(torch.uint8)
+
+
+def to_numpy_image(image, size=None, max_value=1.0, timings=None):
+    """
+    Turns a model output (C, H, W), float in [0, max_value] on any device, into a contiguous HWC uint8
+    numpy array which PIL encodes without another conversion. The resize to size (height, width)
+    runs on the float tensor and only the uint8 image is copied to the cpu.
+    """
+    timings = StageTimings() if timings is None else timings
+    with torch.no_grad():
+        if size is not None:
+            with timings.stage("resize"):
+                image = resize_tensor(image, size)
+        with timings.stage("quantize"):
+            image = quantize(image, max_value)
+        with timings.stage("to_numpy"):
+            image = image.permute(1, 2, 0).contiguous().cpu().numpy()
+    return image
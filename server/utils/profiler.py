@@ -0,0 +1,154 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import torch
+from torch.profiler import profile, ProfilerActivity
+from model_config import CFG
+
+
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+# file suffix of every downloadable part of a capture
+TRACE_FILES = {"trace": ".trace.json", "table": ".table.txt"}
+META_SUFFIX = ".meta.json"
+
+
+class InferenceProfiler:
+    """
+    Captures the inference of single requests with the torch profiler.
+
+    Every capture writes `<trace_id>.trace.json` (Chrome trace, open it in chrome://tracing or
+    Perfetto), `<trace_id>.table.txt` (operator table) and `<trace_id>.meta.json` to `traces_dir`.
+    Captures older than `max_age` seconds and the oldest ones beyond `max_traces` or `max_bytes`
+    are deleted after every capture. Only one capture runs at a time per process, requests
+    arriving while another one is profiled run without the profiler.
+    """
+
+    def __init__(self, traces_dir, sample_rate=0.0, max_traces=50, max_age=72 * 3600, max_bytes=1024 ** 3):
+        self.traces_dir = traces_dir
+        self.sample_rate = sample_rate
+        self.max_traces = max_traces
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def new_trace_id(self):
+        return uuid.uuid4().hex
+
+    def _path(self, trace_id, suffix):
+        return os.path.join(self.traces_dir, f"{trace_id}{suffix}")
+
+    def get_file(self, trace_id, kind="trace"):
+        """
+        Path of a part of a capture, None for unknown ids or kinds
+        """
+        if not TRACE_ID_PATTERN.match(trace_id) or kind not in TRACE_FILES:
+            return None
+        path = self._path(trace_id, TRACE_FILES[kind])
+        return path if os.path.exists(path) else None
+
+    def exists(self, trace_id):
+        return trace_id is not None and os.path.exists(self._path(trace_id, META_SUFFIX))
+
+    @contextmanager
+    def capture(self, trace_id, name, metadata=None):
+        """
+        Profiles the block when trace_id is given (a no-op otherwise)
+        """
+        if trace_id is None or not self._lock.acquire(blocking=False):
+            yield
+            return
+
+        try:
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+
+            start = time.time()
+            # exceptions of the profiled block propagate, nothing is written for failed requests
+            with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+                yield
+            self._save(trace_id, prof, name, start, time.time() - start, metadata)
+        finally:
+            self._lock.release()
+
+        try:
+            self.cleanup()
+        except OSError as e:
+            print(f"Failed to clean up the profiles: {str(e)}")
+
+    def _save(self, trace_id, prof, name, start, duration, metadata):
+        try:
+            os.makedirs(self.traces_dir, exist_ok=True)
+            prof.export_chrome_trace(self._path(trace_id, TRACE_FILES["trace"]))
+            sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+            with open(self._path(trace_id, TRACE_FILES["table"]), "w") as f:
+                f.write(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=100))
+            # written last, a trace is listed once all its files exist
+            with open(self._path(trace_id, META_SUFFIX), "w") as f:
+                json.dump({
+                    "trace_id": trace_id,
+                    "name": name,
+                    "created_at": start,
+                    "duration_ms": round(1000 * duration, 1),
+                    "metadata": metadata or {},
+                }, f)
+        except Exception as e:
+            print(f"Failed to write the profile {trace_id}: {str(e)}")
+
+    def list(self):
+        """
+        Metadata and file sizes of the captures, newest first
+        """
+        if not os.path.isdir(self.traces_dir):
+            return []
+
+        traces = []
+        for file_name in os.listdir(self.traces_dir):
+            if not file_name.endswith(META_SUFFIX):
+                continue
+            trace_id = file_name[:-len(META_SUFFIX)]
+            try:
+                with open(self._path(trace_id, META_SUFFIX)) as f:
+                    trace = json.load(f)
+            except (OSError, ValueError):
+                continue
+            trace["size_bytes"] = sum(
+                os.path.getsize(path) for path in (self._path(trace_id, suffix) for suffix in TRACE_FILES.values()) if os.path.exists(path)
+            )
+            traces.append(trace)
+        return sorted(traces, key=lambda trace: trace["created_at"], reverse=True)
+
+    def delete(self, trace_id):
+        for suffix in [META_SUFFIX, *TRACE_FILES.values()]:
+            path = self._path(trace_id, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup(self):
+        traces = self.list()
+        now = time.time()
+        total_bytes = 0
+        deleted = 0
+        for i, trace in enumerate(traces):
+            total_bytes += trace["size_bytes"]
+            if i >= self.max_traces or now - trace["created_at"] > self.max_age or total_bytes > self.max_bytes:
+                self.delete(trace["trace_id"])
+                deleted += 1
+        return deleted
+
+
+inference_profiler = InferenceProfiler(
+    CFG.profile_dir,
+    sample_rate=CFG.profile_sample_rate,
+    max_traces=CFG.profile_max_traces,
+    max_age=CFG.profile_max_age_hours * 3600,
+    max_bytes=int(CFG.profile_max_mb * 1024 ** 2),
+)
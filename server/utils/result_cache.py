@@ -0,0 +1,166 @@
+import threading
+from concurrent.futures import Future
+import torch
+from model_config import CFG
+from utils.tensor_cache import TensorCache, hash_bytes
+from utils.metrics import result_cache_requests
+from utils.admission import AdmissionError
+
+
+RESULT_COMPUTED = "computed"
+RESULT_CACHED = "cached"
+RESULT_COALESCED = "coalesced"
+
+
+def get_model_signature():
+    """
+    Settings which change the model outputs, results computed under other settings are not reused
+    """
+    return f"{CFG.inference_backend}|{CFG.inference_precision}|{CFG.execution_mode}"
+
+
+def get_encoder_signature(image_format):
+    """
+    Encoder settings which change the pixels of the lossy formats
+    """
+    if image_format == "webp":
+        return f"{CFG.image_webp_quality}|{CFG.image_webp_lossless}"
+    if image_format == "jpeg":
+        return str(CFG.image_jpeg_quality)
+    return ""
+
+
+def get_style_result_key(content_hash, style_key, alphas, img_size=None, image_format="png"):
+    return hash_bytes(
+        content_hash.encode(), style_key, ",".join(str(alpha) for alpha in alphas), img_size, image_format,
+        get_encoder_signature(image_format), CFG.ingest_draft, get_model_signature(),
+    )
+
+
+def get_super_resolution_result_key(image_bytes, scale, tier="quality", image_format="png"):
+    # tiles are blended over the overlap, both change the output
+    return hash_bytes(
+        image_bytes, scale, tier, image_format, get_encoder_signature(image_format),
+        CFG.super_resolution_tile_size, CFG.super_resolution_tile_overlap, CFG.edsr_num_res_blocks, get_model_signature(),
+    )
+
+
+def bytes_to_tensor(data):
+    return torch.frombuffer(bytearray(data), dtype=torch.uint8)
+
+
+def tensor_to_bytes(tensor):
+    return tensor.numpy().tobytes()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, the first caller runs the function and the
+    others wait for its result (or exception) instead of running it again. Exceptions of the
+    retry_on types are specific to the first caller, the others run fn again themselves.
+    """
+
+    def __init__(self, retry_on=()):
+        self.retry_on = retry_on
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        returns the result of fn and True when it was computed by another caller
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except self.retry_on:
+                continue
+
+        try:
+            result = fn()
+        except BaseException as e:
+            # removed before the waiters wake up so the retrying ones start a new call
+            self._remove(key)
+            future.set_exception(e)
+            raise
+        self._remove(key)
+        future.set_result(result)
+        return result, False
+
+    def _remove(self, key):
+        with self._lock:
+            del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class ResultCache:
+    """
+    Cache of encoded model outputs (png/webp/jpeg bytes) keyed by the hash of the inputs and parameters.
+    Entries live in a memory LRU and a size capped disk tier shared by the worker processes,
+    identical concurrent requests in the same process only run the model once.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=None):
+        self.cache = TensorCache(max_bytes, disk_dir=disk_dir, max_disk_bytes=max_disk_bytes, name="result") if max_bytes > 0 else None
+        # a rejected admission (see utils/admission.py) belongs to the user of the first request
+        self.single_flight = SingleFlight(retry_on=(AdmissionError,))
+
+    def get_or_compute(self, key, compute, refresh=False):
+        """
+        compute: callable returning a list of bytes objects
+        refresh: skip the lookup and compute again outside of the single flight group (the new result replaces the cached one)
+        returns the list of bytes and whether it was computed, read from the cache or shared with a concurrent request
+        """
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                result_cache_requests.labels(RESULT_CACHED).inc()
+                return [tensor_to_bytes(t) for t in cached], RESULT_CACHED
+
+        def compute_and_store():
+            outputs = compute()
+            if self.cache is not None:
+                self.cache.put(key, tuple(bytes_to_tensor(data) for data in outputs))
+            return outputs
+
+        if refresh:
+            # neither joins a run in flight nor lets other requests join this one (profiled runs are not batched)
+            outputs, coalesced = compute_and_store(), False
+        else:
+            outputs, coalesced = self.single_flight.do(key, compute_and_store)
+        source = RESULT_COALESCED if coalesced else RESULT_COMPUTED
+        result_cache_requests.labels(source).inc()
+        return outputs, source
+
+    def stats(self):
+        stats = self.cache.stats() if self.cache is not None else {"enabled": False}
+        return dict(stats, coalesced=self.single_flight.coalesced, in_flight=self.single_flight.in_flight())
+
+
+def should_charge_quota(source):
+    """
+    Results served from the cache (or shared with a concurrent identical request) only count
+    against the user's quota when RESULT_CACHE_QUOTA is "charge"
+    """
+    return source == RESULT_COMPUTED or CFG.result_cache_quota == "charge"
+
+
+result_cache = ResultCache(
+    max_bytes=int(CFG.result_cache_mb * 1024 ** 2),
+    disk_dir=CFG.result_cache_dir,
+    max_disk_bytes=int(CFG.result_cache_disk_mb * 1024 ** 2),
+)
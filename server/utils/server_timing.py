@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from utils.latency_budget import percentile
+from utils.metrics import record_span_metric, get_endpoint_label
+
+
+# spans recorded outside of a request (job workers, batcher threads) are aggregated under this endpoint
+BACKGROUND_ENDPOINT = "background"
+
+
+class TimingMetrics:
+    """
+    In-process aggregate of the spans per (endpoint, span name): count, total and max, and the
+    last `window` durations for the percentiles. The spans are also exported as the
+    span_duration_seconds histogram (utils/metrics.py), aggregated over the worker processes.
+    """
+
+    def __init__(self, window=512):
+        self.window = window
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def record(self, endpoint, name, ms):
+        with self._lock:
+            entry = self._spans.get((endpoint, name))
+            if entry is None:
+                entry = self._spans[(endpoint, name)] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "recent": deque(maxlen=self.window)}
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["recent"].append(ms)
+        record_span_metric(endpoint, name, ms)
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for (endpoint, name), entry in sorted(self._spans.items()):
+                recent = list(entry["recent"])
+                stats.setdefault(endpoint, {})[name] = {
+                    "count": entry["count"],
+                    "avg_ms": round(entry["total_ms"] / entry["count"], 2),
+                    "p50_ms": round(percentile(recent, 0.5), 2),
+                    "p95_ms": round(percentile(recent, 0.95), 2),
+                    "max_ms": round(entry["max_ms"], 2),
+                }
+            return stats
+
+
+timing_metrics = TimingMetrics()
+
+
+def record_span(name, ms):
+    """
+    Adds the duration to the Server-Timing header of the current request (spans with the same name
+    add up) and to the in-process aggregate
+    """
+    if has_request_context():
+        spans = g.setdefault("_server_timing", {})
+        spans[name] = spans.get(name, 0.0) + ms
+        endpoint = get_endpoint_label()
+    else:
+        endpoint = BACKGROUND_ENDPOINT
+    timing_metrics.record(endpoint, name, ms)
+
+
+@contextmanager
+def span(name):
+    """
+    with span("decode"): ... times the block, name must be a token (no spaces, commas or semicolons)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, 1000 * (time.perf_counter() - start))
+
+
+def format_server_timing(spans):
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in spans.items())
+
+
+def init_server_timing(app, allowed_origin=None):
+    """
+    Adds the spans of every request and its total time as a Server-Timing header.
+    allowed_origin: frontend origin which may read the timings (Timing-Allow-Origin)
+    """
+
+    @app.before_request
+    def start_server_timing():
+        g._server_timing_start = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        start = g.get("_server_timing_start")
+        if start is None:
+            return response
+
+        spans = dict(g.get("_server_timing", {}))
+        spans["total"] = 1000 * (time.perf_counter() - start)
+        timing_metrics.record(get_endpoint_label(), "total", spans["total"])
+
+        response.headers["Server-Timing"] = format_server_timing(spans)
+        exposed = response.headers.get("Access-Control-Expose-Headers")
+        response.headers["Access-Control-Expose-Headers"] = f"{exposed}, Server-Timing" if exposed else "Server-Timing"
+        if allowed_origin:
+            response.headers["Timing-Allow-Origin"] = allowed_origin
+        return response
@@ -0,0 +1,122 @@
+import threading
+import requests
+import torch
+from model_config import CFG
+from config.db_config import get_db
+from models.model_registry import model_registry, STYLE_TRANSFER_MODEL
+from utils.preprocessing import get_style_transfer_transform
+from utils.ingest import open_image
+from utils.tensor_cache import TensorCache, hash_bytes
+
+
+style_stats_cache = TensorCache(
+    max_bytes=int(CFG.style_stats_cache_mb * 1024 ** 2),
+    disk_dir=CFG.style_stats_cache_dir,
+    device=CFG.device,
+    name="style_stats",
+)
+
+
+def compute_style_stats(style_image_bytes):
+    """
+    Runs the style image through the encoder and returns the relu4_1 (mean, std), (1, 512, 1, 1) each
+    """
+    style_image, _, _ = open_image(style_image_bytes, min_side=512)
+    style_image = get_style_transfer_transform(img_size=512)(style_image).unsqueeze(0).to(CFG.device)
+
+    style_transfer_model = model_registry.get(STYLE_TRANSFER_MODEL)
+    with torch.no_grad():
+        return style_transfer_model.calculate_style_stats(style_image)
+
+
+def get_style_stats(style_image_bytes):
+    """
+    Returns the relu4_1 (mean, std) of the style image, only running the encoder when the
+    same image has not been seen before
+    """
+    key = hash_bytes(style_image_bytes, 512)
+    style_stats = style_stats_cache.get(key)
+    if style_stats is not None:
+        return style_stats
+
+    style_stats = compute_style_stats(style_image_bytes)
+    style_stats_cache.put(key, style_stats)
+    return style_stats
+
+
+def style_stats_to_document(style_stats):
+    style_mean, style_std = style_stats
+    return {
+        "style_mean": style_mean.flatten().tolist(),
+        "style_std": style_std.flatten().tolist(),
+    }
+
+
+def style_stats_from_document(document):
+    style_mean = torch.tensor(document["style_mean"], dtype=torch.float32).view(1, -1, 1, 1).to(CFG.device)
+    style_std = torch.tensor(document["style_std"], dtype=torch.float32).view(1, -1, 1, 1).to(CFG.device)
+    return style_mean, style_std
+
+
+class StyleBank:
+    """
+    In-memory bank of the precomputed relu4_1 statistics of the admin curated style images.
+
+    The whole `StyleImage` collection is loaded once per worker. Styles added by another worker
+    after that are fetched from the database on their first use, and styles which were uploaded
+    before the statistics were stored are computed once and written back to their document.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._styles = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        styles = {}
+        for document in self.collection.find({"style_mean": {"$exists": True}}, {"image_id": 1, "style_mean": 1, "style_std": 1, "_id": 0}):
+            styles[document["image_id"]] = style_stats_from_document(document)
+
+        with self._lock:
+            self._styles.update(styles)
+            self._loaded = True
+        print(f"Loaded {len(styles)} styles into the style bank")
+
+    def add(self, image_id, style_stats):
+        with self._lock:
+            self._styles[image_id] = style_stats
+
+    def remove(self, image_id):
+        with self._lock:
+            self._styles.pop(image_id, None)
+
+    def get(self, image_id):
+        if not self._loaded:
+            self.load()
+
+        style_stats = self._styles.get(image_id)
+        if style_stats is not None:
+            return style_stats
+
+        document = self.collection.find_one({"image_id": image_id}, {"image_url": 1, "style_mean": 1, "style_std": 1, "_id": 0})
+        if not document:
+            return None
+
+        if "style_mean" in document:
+            style_stats = style_stats_from_document(document)
+        else:
+            response = requests.get(document["image_url"], timeout=30)
+            response.raise_for_status()
+            style_stats = compute_style_stats(response.content)
+            self.collection.update_one({"image_id": image_id}, {"$set": style_stats_to_document(style_stats)})
+
+        self.add(image_id, style_stats)
+        return style_stats
+
+    def __len__(self):
+        return len(self._styles)
+
+
+db = get_db()
+style_bank = StyleBank(db['StyleImage'])
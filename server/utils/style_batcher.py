@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque, Counter
+from concurrent.futures import Future
+import torch
+from utils.metrics import style_batch_size, style_batch_queue_wait, style_batch_queue_depth
+
+
+class StyleTransferRequest:
+    def __init__(self, content_img, style_stats, alpha, bucket, content_features=None, content_size=None):
+        self.content_img = content_img
+        self.content_features = content_features
+        self.content_size = content_size if content_img is None else tuple(content_img.shape[-2:])
+        self.style_stats = style_stats
+        self.alpha = alpha
+        self.bucket = bucket
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class StyleTransferBatcher:
+    """
+    Collects style transfer requests for a short window and runs them through the network
+    as one padded batch.
+
+    Requests are grouped by their content resize bucket (512, 1024 or None) so images of
+    similar size end up in the same batch. A single background thread owns the model, the
+    request threads only wait on the future returned by `submit`. Requests may carry already
+    encoded content features, those skip the encoder and only share the decoder pass.
+    """
+
+    def __init__(self, model_getter, max_batch_size=8, max_wait_ms=10, metrics_window_sec=60):
+        self.model_getter = model_getter
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.metrics_window_sec = metrics_window_sec
+
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self._metrics_lock = threading.Lock()
+        self._total_requests = 0
+        self._total_batches = 0
+        self._total_queue_wait = 0.0
+        self._batch_sizes = Counter()
+        self._recent = deque()  # (finished_at, batch_size)
+
+    def submit(self, content_img, style_stats, alpha, bucket=None, content_features=None, content_size=None):
+        """
+        content_img: (C, H, W) tensor already on the model device, or None when content_features is given
+        style_stats: (mean, std) of the style relu4_1 features, (1, 512, 1, 1) each
+        content_features: (1, 512, h, w) cached relu4_1 features of the content image
+        content_size: (H, W) of the content image the features were computed from
+        returns a future resolving to the stylized (C, H, W) image and the content features
+        """
+        request = StyleTransferRequest(content_img, style_stats, alpha, bucket, content_features, content_size)
+        with self._cond:
+            self._pending.setdefault(bucket, []).append(request)
+            style_batch_queue_depth.inc()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="style-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return request.future
+
+    def stylize(self, content_img, style_stats, alpha, bucket=None, content_features=None, content_size=None, timeout=None):
+        return self.submit(content_img, style_stats, alpha, bucket, content_features, content_size).result(timeout=timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            # serve the bucket whose oldest request has waited the longest
+            bucket = min(self._pending, key=lambda b: self._pending[b][0].enqueued_at)
+            deadline = self._pending[bucket][0].enqueued_at + self.max_wait_ms / 1000
+            while len(self._pending[bucket]) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._pending[bucket][:self.max_batch_size]
+            rest = self._pending[bucket][self.max_batch_size:]
+            if rest:
+                self._pending[bucket] = rest
+            else:
+                del self._pending[bucket]
+            style_batch_queue_depth.dec(len(batch))
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started_at = time.perf_counter()
+            try:
+                model = self.model_getter()
+                with torch.no_grad():
+                    to_encode = [r for r in batch if r.content_features is None]
+                    if to_encode:
+                        encoded = model.encode_content_batch([r.content_img for r in to_encode])
+                        for request, content_features in zip(to_encode, encoded):
+                            request.content_features = content_features
+
+                    outputs = model.decode_batch(
+                        [r.content_features for r in batch],
+                        [r.style_stats for r in batch],
+                        [r.alpha for r in batch],
+                        [r.content_size for r in batch],
+                    )
+                for request, output in zip(batch, outputs):
+                    request.future.set_result((output, request.content_features))
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+
+            self._record(batch, started_at)
+
+    def _record(self, batch, started_at):
+        now = time.perf_counter()
+        with self._metrics_lock:
+            self._total_requests += len(batch)
+            self._total_batches += 1
+            self._total_queue_wait += sum(started_at - r.enqueued_at for r in batch)
+            self._batch_sizes[len(batch)] += 1
+            self._recent.append((now, len(batch)))
+            while self._recent and now - self._recent[0][0] > self.metrics_window_sec:
+                self._recent.popleft()
+        style_batch_size.observe(len(batch))
+        for r in batch:
+            style_batch_queue_wait.observe(started_at - r.enqueued_at)
+
+    def metrics(self):
+        with self._metrics_lock:
+            now = time.perf_counter()
+            recent = [size for finished_at, size in self._recent if now - finished_at <= self.metrics_window_sec]
+            with self._cond:
+                queue_depth = sum(len(requests) for requests in self._pending.values())
+
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "total_requests": self._total_requests,
+                "total_batches": self._total_batches,
+                "avg_batch_size": self._total_requests / self._total_batches if self._total_batches else 0.0,
+                "avg_queue_wait_ms": 1000 * self._total_queue_wait / self._total_requests if self._total_requests else 0.0,
+                "batch_size_counts": dict(self._batch_sizes),
+                "throughput_rps": sum(recent) / self.metrics_window_sec,
+                "queue_depth": queue_depth,
+            }
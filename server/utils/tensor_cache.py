@@ -0,0 +1,174 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import torch
+from utils.metrics import record_cache_lookup
+
+
+def hash_bytes(data, *params):
+    """
+    Returns a hex digest of the raw bytes together with any extra parameters which change
+    what is computed from them (e.g. the resize bucket)
+    """
+    digest = hashlib.sha256(data)
+    for param in params:
+        digest.update(f"|{param}".encode())
+    return digest.hexdigest()
+
+
+def get_tensors_size(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class TensorCache:
+    """
+    Thread safe LRU cache of tuples of tensors bounded by the total number of bytes held in memory.
+
+    When `disk_dir` is given every entry is also written there with torch.save, entries evicted
+    from memory (or lost on restart) are loaded back from disk on the next lookup. When `ttl` is
+    given entries older than `ttl` seconds are treated as missing. When `max_disk_bytes` is given
+    the least recently used files are deleted once the disk tier grows larger. When `name` is given
+    the lookups are exported as cache_lookups_total{cache=name} (utils/metrics.py).
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, device="cpu", ttl=None, max_disk_bytes=None, name=None):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.disk_dir = disk_dir
+        self.device = device
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_size = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_entries())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def _is_expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                tensors, created_at = self._entries[key]
+                if not self._is_expired(created_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._record_lookup("hit")
+                    return tensors
+
+                del self._entries[key]
+                self._size -= get_tensors_size(tensors)
+
+        disk_path = self._disk_path(key) if self.disk_dir else None
+        if disk_path and os.path.exists(disk_path) and not self._is_expired(os.path.getmtime(disk_path)):
+            try:
+                tensors = tuple(t.to(self.device) for t in torch.load(disk_path, map_location="cpu", weights_only=True))
+            except Exception as e:
+                print(f"Failed to load cache entry {key} from disk: {str(e)}")
+            else:
+                created_at = os.path.getmtime(disk_path)
+                # the access time orders the disk eviction, the modification time stays the creation time
+                os.utime(disk_path, (time.time(), created_at))
+                self._put_memory(key, tensors, created_at)
+                with self._lock:
+                    self.disk_hits += 1
+                self._record_lookup("disk_hit")
+                return tensors
+
+        with self._lock:
+            self.misses += 1
+        self._record_lookup("miss")
+        return None
+
+    def _record_lookup(self, result):
+        if self.name is not None:
+            record_cache_lookup(self.name, result)
+
+    def put(self, key, tensors):
+        tensors = tuple(t.detach() for t in tensors)
+        self._put_memory(key, tensors, time.time())
+
+        if self.disk_dir:
+            # write to a temporary file first so readers never see a partial entry
+            tmp_path = f"{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            torch.save([t.cpu() for t in tensors], tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+
+            with self._lock:
+                self._disk_size += size
+                evict = self.max_disk_bytes is not None and self._disk_size > self.max_disk_bytes
+            if evict:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        """
+        (path, last access, size) of the files of the disk tier
+        """
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pt"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_atime, stat.st_size))
+        return entries
+
+    def _evict_disk(self):
+        # other processes share the folder, so the real size is recomputed from the files
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        disk_size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if disk_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            disk_size -= size
+
+        with self._lock:
+            self._disk_size = disk_size
+
+    def _put_memory(self, key, tensors, created_at):
+        size = get_tensors_size(tensors)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._size -= get_tensors_size(self._entries.pop(key)[0])
+            self._entries[key] = (tensors, created_at)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= get_tensors_size(evicted)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "disk_size_bytes": self._disk_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }